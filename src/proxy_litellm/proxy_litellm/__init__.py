@@ -1,3 +1,9 @@
-from .core.app import app
-
 __all__ = ['app']
+
+
+def __getattr__(name):
+    # Imported on first use, so the multi-process launcher doesn't create the app itself
+    if name == "app":
+        from .core.app import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
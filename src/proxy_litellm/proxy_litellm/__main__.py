@@ -1,5 +1,4 @@
-import uvicorn
-from .core.app import app
+from .core.launcher import main
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="debug", log_config="log_conf.yaml")
+    main()
@@ -1,11 +1,43 @@
-from typing import Annotated
-from fastapi import Header, HTTPException
+import os
+import hmac
+from typing import Annotated, Optional
+from fastapi import Header, HTTPException, Request
 
-async def get_api_key(x_bedrock_api_key: Annotated[str, Header()] = None) -> str:
-    """Validate and return the API key from request header"""
+from ..core.keys import key_validator
+
+async def get_api_key(request: Request, x_bedrock_api_key: Annotated[str, Header()] = None) -> str:
+    """Validate and return the API key from request header
+
+    With API_KEY_VALIDATION on, unknown, blocked and expired keys are
+    rejected here and the key's info is kept in request.state.key_info.
+    """
     if not x_bedrock_api_key:
         raise HTTPException(
             status_code=401,
             detail="x-bedrock-api-key header is required"
         )
+    request.state.key_info = await key_validator.validate(x_bedrock_api_key)
     return x_bedrock_api_key
+
+def is_master_key(api_key: Optional[str]) -> bool:
+    """Whether api_key is the LiteLLM master key"""
+    master_key = os.getenv("LITELLM_MASTER_KEY")
+    return bool(master_key and api_key) and hmac.compare_digest(api_key.encode(), master_key.encode())
+
+async def require_master_key(x_bedrock_api_key: Annotated[str, Header()] = None) -> None:
+    """Admit only the LiteLLM master key, for the /debug endpoints and usage of all keys"""
+    if not os.getenv("LITELLM_MASTER_KEY"):
+        raise HTTPException(
+            status_code=403,
+            detail="Admin endpoints are disabled without LITELLM_MASTER_KEY"
+        )
+    if not x_bedrock_api_key:
+        raise HTTPException(
+            status_code=401,
+            detail="x-bedrock-api-key header is required"
+        )
+    if not is_master_key(x_bedrock_api_key):
+        raise HTTPException(
+            status_code=403,
+            detail="This endpoint requires the master key"
+        )
@@ -1,15 +1,38 @@
-from fastapi.responses import StreamingResponse
-from typing import Dict, Any
+from fastapi.responses import Response
+from typing import Dict, Any, List, Optional, Tuple
 import os
+import time
 import asyncio
 import urllib.parse
 from fastapi import Request
 import logging
 
 from .utils import BaseHandler
+from ...utils.log import body_logging
+from ...core.telemetry import UPSTREAM_CONNECT, stream_usage, response_usage
+from ...core.usage import usage_ledger
+from ...utils.timing import RequestTiming
+from ...core.router import Route
+from ...core.upstreams import Upstream, UpstreamGroup
+from ...utils.connection_pool import ConnectionPool, PooledConnection
+from ...utils.eventstream import EventStreamFramer
+from ...utils.responses import ClosingStreamingResponse
+from ...utils.http_parser import HTTPParseError, HTTPResponseParser, read_response_head, read_response_body
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+
+# Client headers that must not reach LiteLLM: SigV4 auth (replaced by the
+# API key) and hop-by-hop headers that are set per upstream connection
+_DROPPED_REQUEST_HEADERS = frozenset((
+    b"authorization",
+    b"x-amz-security-token",
+    b"x-amz-date",
+    b"host",
+    b"connection",
+    b"keep-alive",
+    b"transfer-encoding",
+    b"expect",
+))
 
 class BedrockHandler(BaseHandler):
     def __init__(self):
@@ -18,63 +41,216 @@ class BedrockHandler(BaseHandler):
         if not self.litellm_endpoint:
             raise ValueError("LITELLM_ENDPOINT environment variable is required")
 
-        # Parse endpoint URL (assuming HTTP)
-        url = urllib.parse.urlparse(self.litellm_endpoint)
-        self.proxy_host = url.hostname
-        self.proxy_port = url.port or 80
-
-    async def _forward_raw(self, request: Request, path: str):
-        """Forward raw request through socket"""
-        reader, writer = await asyncio.open_connection(self.proxy_host, self.proxy_port)
-
-        try:
+        # One or more comma-separated LiteLLM URLs (assuming HTTP), each with its own pool
+        self.upstreams = self._create_group(self.litellm_endpoint)
+        # Groups for upstreams set on individual routes, created on first use
+        self.route_groups: Dict[str, UpstreamGroup] = {}
+
+        # Stream request bodies to LiteLLM instead of buffering them first
+        self.relay_request_body = os.environ.get("BEDROCK_RELAY_REQUEST_BODY", "true").lower() in ("1", "true", "yes")
+        self.relay_buffer_size = int(os.environ.get("BEDROCK_RELAY_BUFFER_SIZE", "65536"))
+
+    def _create_pool(self, host: str, port: int) -> ConnectionPool:
+        return ConnectionPool(
+            host,
+            port,
+            max_idle=int(os.environ.get("LITELLM_POOL_MAX_IDLE", "64")),
+            idle_timeout=float(os.environ.get("LITELLM_POOL_IDLE_TIMEOUT", "4.0")),
+            min_idle=int(os.environ.get("LITELLM_POOL_MIN_IDLE", "2")),
+            dns_ttl=float(os.environ.get("LITELLM_DNS_TTL", "30")),
+            on_connect=UPSTREAM_CONNECT.series("bedrock").observe
+        )
+
+    def _create_group(self, urls: str) -> UpstreamGroup:
+        group = UpstreamGroup.from_env("bedrock", urls)
+        for upstream in group.upstreams:
+            upstream.pool = self._create_pool(upstream.host, upstream.port)
+            upstream.host_header = f"host: {upstream.host}:{upstream.port}".encode("latin-1")
+        return group
+
+    async def _start_group(self, group: UpstreamGroup) -> None:
+        for upstream in group.upstreams:
+            await upstream.pool.start()
+        group.start()
+
+    async def _close_group(self, group: UpstreamGroup) -> None:
+        await group.stop()
+        for upstream in group.upstreams:
+            logger.info("Upstream pool stats: %s", upstream.pool.stats())
+            await upstream.pool.close()
+
+    def upstream_groups(self) -> Dict[str, UpstreamGroup]:
+        """Upstream groups by name: the LiteLLM endpoints and per-route upstreams"""
+        groups = {"bedrock": self.upstreams}
+        for upstream, group in self.route_groups.items():
+            groups[f"bedrock:{upstream}"] = group
+        return groups
+
+    async def _upstream_group(self, route: Optional[Route]) -> UpstreamGroup:
+        """Return the upstream group for a route"""
+        if route is None or not route.upstream or route.upstream == self.litellm_endpoint:
+            return self.upstreams
+
+        group = self.route_groups.get(route.upstream)
+        if group is None:
+            group = self.route_groups[route.upstream] = self._create_group(route.upstream)
+            await self._start_group(group)
+        return group
+
+    async def astart(self):
+        """Warm the upstream connection pools and start health checks"""
+        await self._start_group(self.upstreams)
+
+    async def aclose(self):
+        """Close pooled upstream connections"""
+        await super().aclose()
+        await self._close_group(self.upstreams)
+        for group in self.route_groups.values():
+            await self._close_group(group)
+
+    def _build_request_head(self, request: Request, path: str, host_header: bytes, keep_alive: bool, chunked: bool) -> bytes:
+        """Build the upstream request line and header block from the raw client headers"""
+        lines = [f"{request.method} {path} HTTP/1.1".encode("latin-1")]
+        api_key = None
+        for name, value in request.headers.raw:
+            name = name.lower()
+            if name == b"x-bedrock-api-key":
+                api_key = value
+            elif name not in _DROPPED_REQUEST_HEADERS:
+                lines.append(name + b": " + value)
+
+        # Move x-bedrock-api-key to Authorization
+        if api_key is not None:
+            lines.append(b"authorization: Bearer " + api_key)
+        lines.append(host_header)
+        lines.append(b"connection: keep-alive" if keep_alive else b"connection: close")
+        if chunked:
+            lines.append(b"transfer-encoding: chunked")
+        lines.append(b"\r\n")
+        return b"\r\n".join(lines)
+
+    async def _connect(self, group: UpstreamGroup, request_id: str, timing: RequestTiming,
+                       exclude: Optional[List[Upstream]] = None) -> Tuple[Upstream, PooledConnection]:
+        """Check out a pooled connection, moving on to the next upstream if one can't be reached
+
+        Nothing has been sent when connecting fails, so trying another
+        upstream is safe even though the request body is not buffered.
+        Upstreams in exclude are avoided, and the chosen one is added to it.
+        """
+        tried = exclude if exclude is not None else []
+        failed = 0
+        while True:
+            upstream = group.choose(exclude=tried)
+            try:
+                conn = await upstream.pool.acquire()
+            except (OSError, asyncio.TimeoutError) as e:
+                group.record(upstream, False)
+                group.done(upstream)
+                tried.append(upstream)
+                failed += 1
+                if failed >= len(group):
+                    raise
+                logger.warning("[%s] Connecting to %s failed, trying another upstream: %s", request_id, upstream.name, e)
+                continue
+            timing.mark("connect")
+            tried.append(upstream)
+            return upstream, conn
+
+    async def _forward_raw(self, request: Request, path: str, request_id: str,
+                           upstream: Upstream, conn: PooledConnection, keep_alive: bool = True) -> None:
+        """Forward raw request through a pooled socket.
+
+        In relay mode the client body is streamed to the upstream chunk by chunk
+        as it arrives, so only the transport's write buffer is held in memory.
+        """
+        writer = conn.writer
+
+        # Bodies without a declared length are re-chunked for the upstream
+        chunked = "content-length" not in request.headers
+        head = self._build_request_head(request, path, upstream.host_header, keep_alive, chunked)
+        logger.debug("Forwarding request head: %r", head)
+
+        if not self.relay_request_body:
             body = await request.body()
-            body_len = len(body) if body else 0
-
-            # Forward request line with encoded path
-            request_line = f"{request.method} {path} HTTP/1.1\r\n"
-            logger.debug(f"Request line: {request_line.strip()}")
-
-            # Get and modify headers
-            headers = dict(request.headers)
-
-            # Remove specified headers
-            headers.pop('Authorization', None)  # Remove if exists
-            headers.pop('X-Amz-Security-Token', None)
-            headers.pop('X-Amz-Date', None)
-
-            # Move x-bedrock-api-key to Authorization
-            if 'x-bedrock-api-key' in headers:
-                headers['Authorization'] = "Bearer " + headers.pop('x-bedrock-api-key')
-
-            # Set host header
-            headers["host"] = f"{self.proxy_host}:{self.proxy_port}"
-
-            # Log headers
-            logger.debug("Request headers:")
-            for k, v in headers.items():
-                logger.debug(f"{k}: {v}")
-
-            # Forward request line
-            writer.write(request_line.encode())
-
-            # Forward headers
-            for k, v in headers.items():
-                writer.write(f"{k}: {v}\r\n".encode())
-            writer.write(b"\r\n")
-
-            # Forward body
-            if body:
-                logger.debug(f"Request body ({body_len} bytes): {body.decode()}")
-                writer.write(body)
+            body_logging.log(request_id, "Request body", body)
+            if chunked:
+                body = b"%x\r\n%s\r\n0\r\n\r\n" % (len(body), body) if body else b"0\r\n\r\n"
+            writer.write(head + body)
             await writer.drain()
-
-            return reader, writer
-        except Exception as e:
-            logger.error(f"Error forwarding request: {str(e)}")
-            writer.close()
-            await writer.wait_closed()
-            raise e
+            return
+
+        writer.transport.set_write_buffer_limits(high=self.relay_buffer_size)
+        writer.write(head)
+        body_len = 0
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            body_len += len(chunk)
+            if chunked:
+                writer.write(b"%x\r\n" % len(chunk))
+                writer.write(chunk)
+                writer.write(b"\r\n")
+            else:
+                writer.write(chunk)
+            # Wait for the upstream to take the data before reading more
+            await writer.drain()
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        logger.debug("[%s] Relayed request body (%d bytes)", request_id, body_len)
+
+    def _body_replayable(self, request: Request) -> bool:
+        """Whether the request body can be sent again
+
+        Starlette keeps a body that was read in full, and request.stream()
+        then yields it again; a relayed body is gone once sent.
+        """
+        return not self.relay_request_body or hasattr(request, "_body")
+
+    async def _send(self, request: Request, path: str, request_id: str, timing: RequestTiming,
+                    group: UpstreamGroup, upstream: Upstream,
+                    conn: PooledConnection) -> Tuple[PooledConnection, HTTPResponseParser, List[bytes], float]:
+        """Send the request and read the response head
+
+        An idle keep-alive connection may be closed by the upstream just as
+        it is checked out, so sending or reading fails before any response
+        bytes arrive. The request is then sent once more on a new
+        connection, if its body can be sent again. On failure the connection
+        is released and the upstream marked done.
+
+        Returns:
+            The connection, its parser, body chunks that came with the head
+            and when the request was sent
+        """
+        retry = conn.reused
+        while True:
+            parser = HTTPResponseParser(request.method)
+            try:
+                await self._forward_raw(request, path, request_id, upstream, conn)
+                sent = time.perf_counter()
+                chunks = await read_response_head(conn.reader, parser)
+                return conn, parser, chunks, sent
+            except BaseException as e:
+                upstream.pool.release(conn, reusable=False)
+                if (retry and isinstance(e, (OSError, HTTPParseError)) and not parser.bytes_received
+                        and self._body_replayable(request)):
+                    retry = False
+                    logger.warning("[%s] Reused connection to %s failed before the response, "
+                                   "retrying on a new connection: %s", request_id, upstream.name, e)
+                    try:
+                        conn = await upstream.pool.acquire(fresh=True)
+                    except BaseException:
+                        group.record(upstream, False)
+                        group.done(upstream)
+                        raise
+                    timing.mark("connect")
+                    continue
+                if isinstance(e, Exception):
+                    logger.error("[%s] Error sending request: %s", request_id, e)
+                if not parser.status:
+                    group.record(upstream, False)
+                group.done(upstream)
+                raise
 
     def _encode_path(self, base_path: str, model_id: str) -> str:
         """Encode path components properly"""
@@ -84,127 +260,128 @@ class BedrockHandler(BaseHandler):
         path = f"{base_path}/{encoded_model}/converse"
         return path
 
-    async def handle_converse(self, model_id: str, request: Dict[str, Any], api_key: str, request_id: str, start_time: float, raw_request: Request):
+    def _record_usage(self, api_key: str, model_id: str, usage: Optional[Dict[str, Any]]) -> None:
+        if isinstance(usage, dict):
+            usage_ledger.record(api_key, model_id, usage.get("inputTokens") or 0, usage.get("outputTokens") or 0)
+
+    def _relay_response(self, response: Response, parser: HTTPResponseParser) -> Response:
+        """Copy the upstream end-to-end headers onto the response"""
+        response.raw_headers.extend(parser.relay_headers())
+        return response
+
+    async def handle_converse(self, model_id: str, request: Dict[str, Any], api_key: str, request_id: str, start_time: float, raw_request: Request,
+                              timing: Optional[RequestTiming] = None, route: Optional[Route] = None,
+                              exclude: Optional[List[Upstream]] = None):
         """Forward non-streaming request through proxy"""
+        timing = timing or RequestTiming(request_id, model_id, "bedrock")
         path = self._encode_path("/bedrock/model", model_id)
-        logger.debug(f"[{request_id}] Forwarding request to: {path}")
+        logger.debug("[%s] Forwarding request to: %s", request_id, path)
 
-        reader, writer = await self._forward_raw(raw_request, path)
+        group = await self._upstream_group(route)
+        upstream, conn = await self._connect(group, request_id, timing, exclude)
+        conn, parser, chunks, sent = await self._send(raw_request, path, request_id, timing, group, upstream, conn)
 
         try:
-            # Read response status line
-            status_line = await reader.readline()
-            status_text = status_line.decode().strip()
-            logger.debug(f"[{request_id}] Response status line: {status_text}")
-            status = int(status_line.split()[1])
-
-            # Read response headers
-            headers = {}
-            logger.debug(f"[{request_id}] Response headers:")
-            while True:
-                line = await reader.readline()
-                if line == b"\r\n":
-                    break
-                if line:
-                    header_line = line.decode().strip()
-                    logger.debug(f"Header: {header_line}")
-                    name, value = header_line.split(": ", 1)
-                    headers[name] = value
-
-            # Read response body
-            body = await reader.read()
-            body_text = body.decode()
-            logger.debug(f"[{request_id}] Response body: {body_text}")
-
-            return StreamingResponse(
-                [body],
-                status_code=status,
-                headers=headers
-            )
+            group.record(upstream, parser.status < 500, timing.mark("ttfb") - sent)
+            logger.debug("[%s] Response status: %d, headers: %s", request_id, parser.status, parser.headers)
+            body = await read_response_body(conn.reader, parser, chunks)
+            timing.mark("relay")
+            if parser.status >= 400:
+                body_logging.log_failure(request_id, "Response body", body)
+            else:
+                body_logging.log(request_id, "Response body", body)
+                if usage_ledger.enabled:
+                    self._record_usage(api_key, model_id, response_usage(body))
+
+            return self._relay_response(Response(content=body, status_code=parser.status), parser)
         except Exception as e:
             logger.error(f"[{request_id}] Error handling response: {str(e)}")
+            if not parser.status:
+                group.record(upstream, False)
             raise
         finally:
-            writer.close()
-            await writer.wait_closed()
+            upstream.pool.release(conn, reusable=parser.message_complete and parser.keep_alive)
+            group.done(upstream)
 
-    async def handle_stream(self, model_id: str, request: Dict[str, Any], api_key: str, request_id: str, start_time: float, raw_request: Request):
+    async def handle_stream(self, model_id: str, request: Dict[str, Any], api_key: str, request_id: str, start_time: float, raw_request: Request,
+                            timing: Optional[RequestTiming] = None, route: Optional[Route] = None):
         """Forward streaming request through proxy"""
+        timing = timing or RequestTiming(request_id, model_id, "bedrock", stream=True)
         path = self._encode_path("/bedrock/model", model_id)
         path = path.replace("/converse", "/converse-stream")
-        logger.debug(f"[{request_id}] Forwarding streaming request to: {path}")
+        logger.debug("[%s] Forwarding streaming request to: %s", request_id, path)
 
-        reader, writer = await self._forward_raw(raw_request, path)
+        group = await self._upstream_group(route)
+        upstream, conn = await self._connect(group, request_id, timing)
+        conn, parser, chunks, sent = await self._send(raw_request, path, request_id, timing, group, upstream, conn)
+        reader = conn.reader
+        handed_off = False
 
         try:
-            # Read response status line
-            status_line = await reader.readline()
-            status_text = status_line.decode().strip()
-            logger.debug(f"[{request_id}] Response status line: {status_text}")
-            status = int(status_line.split()[1])
-
-            # Read response headers
-            response_headers = {}
-            logger.debug(f"[{request_id}] Response headers:")
-            while True:
-                line = await reader.readline()
-                if line == b"\r\n":
-                    break
-                if line:
-                    header_line = line.decode().strip()
-                    logger.debug(f"Header: {header_line}")
-                    name, value = header_line.split(": ", 1)
-                    response_headers[name] = value
-
-            if status >= 400:
-                error_body = await reader.read()
-                error_text = error_body.decode()
-                logger.error(f"[{request_id}] Error response: {error_text}")
-                writer.close()
-                await writer.wait_closed()
-                raise ValueError(f"Proxy returned error status: {status}")
+            group.record(upstream, parser.status < 500, timing.mark("ttfb") - sent)
+            logger.debug("[%s] Response status: %d, headers: %s", request_id, parser.status, parser.headers)
+
+            if parser.status >= 400:
+                # Relay upstream errors as-is so clients see the Bedrock error shape
+                error_body = await read_response_body(reader, parser, chunks)
+                logger.error("[%s] Error response status: %s", request_id, parser.status)
+                body_logging.log_failure(request_id, "Response body", error_body)
+                return self._relay_response(Response(content=error_body, status_code=parser.status), parser)
+
+            released = False
+
+            def release():
+                nonlocal released
+                if not released:
+                    released = True
+                    upstream.pool.release(conn, reusable=parser.message_complete and parser.keep_alive)
+                    group.done(upstream)
 
             async def generate():
+                framer = EventStreamFramer()
+                # The last messages relayed and where the last one starts; usage is in the final metadata event
+                last, last_offset = b"", 0
                 try:
-                    # Read the response in binary mode without decoding
-                    # This preserves the AWS event stream format and checksums
-                    buffer = bytearray()
-                    chunk_count = 0
+                    # Relay the decoded body without touching the AWS event
+                    # stream format and checksums
+                    for chunk in chunks:
+                        framer.feed(chunk)
                     while True:
-                        # Read a smaller chunk to avoid buffering too much
-                        chunk = await reader.read(4096)
-                        if not chunk:
-                            break
-
-                        buffer.extend(chunk)
-                        chunk_count += 1
-
-                        # Forward complete event stream messages
+                        # Forward all complete event stream messages in one write
                         # This ensures we don't split messages in the middle
-                        while len(buffer) >= 12:  # Minimum size for prelude
-                            # Parse prelude to get message size
-                            total_length = int.from_bytes(buffer[0:4], byteorder='big')
-
-                            # Wait for complete message
-                            if len(buffer) < total_length:
-                                break
-
-                            # Extract and forward complete message
-                            message = buffer[:total_length]
-                            buffer = buffer[total_length:]
-
-                            logger.debug(f"[{request_id}] Forwarding message {chunk_count}, size: {len(message)}")
-                            yield bytes(message)
+                        messages = framer.drain()
+                        if messages:
+                            last, last_offset = messages, framer.last_message_offset
+                            yield messages
+                        if parser.message_complete:
+                            break
 
+                        data = await reader.read(framer.read_size)
+                        if not data:
+                            parser.feed_eof()
+                            continue
+                        for chunk in parser.feed(data):
+                            framer.feed(chunk)
+
+                    if framer.pending:
+                        logger.warning("[%s] Stream ended with %d bytes of incomplete message", request_id, framer.pending)
+                    if usage_ledger.enabled and last:
+                        self._record_usage(api_key, model_id, stream_usage(memoryview(last)[last_offset:]))
                 finally:
-                    logger.debug(f"[{request_id}] Stream complete after {chunk_count} chunks")
-                    writer.close()
-                    await writer.wait_closed()
-
-            return StreamingResponse(
-                generate(),
-                headers=response_headers
-            )
+                    logger.debug("[%s] Stream complete after %d messages", request_id, framer.message_count)
+                    release()
+
+            response = ClosingStreamingResponse(generate(), status_code=parser.status)
+            # Also released if the client leaves before the stream starts
+            response.call_on_close(release)
+            handed_off = True
+            return self._relay_response(response, parser)
         except Exception as e:
             logger.error(f"[{request_id}] Error handling streaming response: {str(e)}")
+            if not parser.status:
+                group.record(upstream, False)
             raise
+        finally:
+            if not handed_off:
+                upstream.pool.release(conn, reusable=parser.message_complete and parser.keep_alive)
+                group.done(upstream)
@@ -1,31 +1,104 @@
-from typing import Dict, Any, Optional, AsyncGenerator, Union, Tuple
-import json
+from typing import Dict, Any, List, Optional, AsyncGenerator, Union, Tuple
 import os
+import asyncio
 import time
 import logging
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response
 from fastapi import Request, HTTPException
 from .utils import BaseHandler
-from proxy_litellm.utils.eventstream import EventStreamMessageEncoder
+from proxy_litellm.utils.eventstream import PrecompiledEventStreamEncoder, random_padding
+from proxy_litellm.utils import json_codec
+from proxy_litellm.utils.coalesce import DeltaCoalescer
+from proxy_litellm.utils.media import DataURI, encode_parts
+from proxy_litellm.utils.responses import ClosingStreamingResponse
+from proxy_litellm.utils.log import body_logging
+from proxy_litellm.core.telemetry import connect_trace_config
+from proxy_litellm.core.usage import usage_ledger
+from proxy_litellm.utils.timing import RequestTiming
+from proxy_litellm.core.router import Route
+from proxy_litellm.core.upstreams import Upstream, UpstreamGroup
 
 OPENAI_API_URL = os.environ.get("OPENAI_API_URL", "http://127.0.0.1:4000/v1/chat/completions")
+# Delta coalescing is off unless a window is set here or per request
+STREAM_COALESCE_WINDOW_MS = float(os.environ.get("STREAM_COALESCE_WINDOW_MS", "0"))
+STREAM_COALESCE_MAX_BYTES = int(os.environ.get("STREAM_COALESCE_MAX_BYTES", "1024"))
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+
+# Media types of Bedrock document and video formats
+DOCUMENT_MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "csv": "text/csv",
+    "doc": "application/msword",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "xls": "application/vnd.ms-excel",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "html": "text/html",
+    "txt": "text/plain",
+    "md": "text/markdown"
+}
+VIDEO_MEDIA_TYPES = {
+    "mkv": "video/x-matroska",
+    "mov": "video/quicktime",
+    "mp4": "video/mp4",
+    "webm": "video/webm",
+    "flv": "video/x-flv",
+    "mpeg": "video/mpeg",
+    "mpg": "video/mpeg",
+    "wmv": "video/x-ms-wmv",
+    "three_gp": "video/3gpp"
+}
 
 class OpenAIHandler(BaseHandler):
-    def _create_event_message(self, headers: Dict[str, str], payload: Dict[str, Any], request_id: str) -> bytes:
-        """Create an event message with proper checksums using AWS event stream wire format.
+    def __init__(self):
+        super().__init__()
+        self.encoder = PrecompiledEventStreamEncoder()
+        self.trace_configs = [connect_trace_config("openai")]
+        # One or more comma-separated chat completions URLs
+        self.upstreams = UpstreamGroup.from_env("openai", OPENAI_API_URL)
+        # Groups for upstreams set on individual routes, created on first use
+        self.route_groups: Dict[str, UpstreamGroup] = {}
+
+    def upstream_groups(self) -> Dict[str, UpstreamGroup]:
+        """Upstream groups by name: OPENAI_API_URL and per-route upstreams"""
+        groups = {"openai": self.upstreams}
+        for upstream, group in self.route_groups.items():
+            groups[f"openai:{upstream}"] = group
+        return groups
+
+    async def astart(self):
+        """Start upstream health checks"""
+        self.upstreams.start()
+
+    async def aclose(self):
+        """Stop health checks and close the HTTP session"""
+        for group in self.upstream_groups().values():
+            await group.stop()
+        await super().aclose()
+
+    def _event_type(self, chunk: Dict[str, Any]) -> str:
+        """Determine the Bedrock stream event type of a converted chunk"""
+        if "role" in chunk:
+            return "messageStart"
+        if "contentBlockIndex" in chunk and "delta" not in chunk:
+            return "contentBlockStop"
+        if "stopReason" in chunk:
+            return "messageStop"
+        if "metrics" in chunk:
+            return "metadata"
+        return "contentBlockDelta"
+
+    def _create_event_messages(self, chunks: list[Dict[str, Any]], request_id: str) -> bytes:
+        """Create event messages with proper checksums using AWS event stream wire format.
 
         Args:
-            headers: Event headers
-            payload: Event payload
+            chunks: Converted Bedrock event payloads
             request_id: Request ID for logging
 
         Returns:
-            Bytes containing the complete event message
+            Bytes containing the complete event messages back to back
         """
-        logger.debug(f"[{request_id}] Creating event message with headers: {headers}, payload: {payload}")
-        return EventStreamMessageEncoder.encode(headers, payload)
+        logger.debug("[%s] Creating event messages: %s", request_id, chunks)
+        return self.encoder.encode_many((self._event_type(chunk), chunk) for chunk in chunks)
 
     def _convert_bedrock_to_openai(self, bedrock_request: Dict[str, Any], model_id: str) -> Dict[str, Any]:
         """Convert Bedrock request format to OpenAI format
@@ -43,14 +116,10 @@ class OpenAIHandler(BaseHandler):
             "content": bedrock_request.get("prompt", "")
         }])
 
-        # Clean up message content
-        for msg in messages:
-            if isinstance(msg.get("content"), list):
-                # If content is a list of content items, extract just the text
-                msg["content"] = next((
-                    item.get("text") for item in msg["content"]
-                    if isinstance(item, dict) and item.get("text")
-                ), "")
+        messages = [
+            {**msg, "content": self._convert_content(msg["content"])} if isinstance(msg.get("content"), list) else msg
+            for msg in messages
+        ]
 
         # Build request without None values
         request = {
@@ -69,7 +138,7 @@ class OpenAIHandler(BaseHandler):
         # Extract parameters from inferenceConfig if present
         inference_config = bedrock_request.get("inferenceConfig", {})
         if inference_config:
-            logger.debug(f"Found inferenceConfig: {inference_config}")
+            logger.debug("Found inferenceConfig: %s", inference_config)
             if "temperature" in inference_config:
                 request["temperature"] = inference_config["temperature"]
             if "maxTokens" in inference_config:
@@ -81,6 +150,74 @@ class OpenAIHandler(BaseHandler):
 
         return request
 
+    def _data_uri(self, kind: str, block: Dict[str, Any], media_type: str) -> DataURI:
+        """Data URI of an image, document or video block's base64 bytes"""
+        data = (block.get("source") or {}).get("bytes")
+        if data is None:
+            raise HTTPException(status_code=400, detail=f"Only {kind} content with bytes is supported for this model")
+        return DataURI(media_type, data)
+
+    def _convert_content(self, content: List[Any]) -> Union[str, List[Dict[str, Any]]]:
+        """Convert Bedrock content blocks to OpenAI content parts
+
+        Images become image_url parts and documents and videos file parts,
+        all with data URIs that reference the request body. Other blocks
+        (tool use, guard content) are dropped.
+
+        Returns:
+            The text if the content is a single text block, else the parts
+        """
+        parts = []
+        for item in content:
+            if not isinstance(item, dict):
+                continue
+            if item.get("text") is not None:
+                parts.append({"type": "text", "text": item["text"]})
+            elif item.get("image"):
+                image = item["image"]
+                fmt = image.get("format", "png")
+                url = self._data_uri("image", image, f"image/{'jpeg' if fmt == 'jpg' else fmt}")
+                parts.append({"type": "image_url", "image_url": {"url": url}})
+            elif item.get("document"):
+                document = item["document"]
+                media_type = DOCUMENT_MEDIA_TYPES.get(document.get("format"), "application/octet-stream")
+                file = {"file_data": self._data_uri("document", document, media_type)}
+                if document.get("name"):
+                    file["filename"] = document["name"]
+                parts.append({"type": "file", "file": file})
+            elif item.get("video"):
+                video = item["video"]
+                media_type = VIDEO_MEDIA_TYPES.get(video.get("format"), "video/mp4")
+                parts.append({"type": "file", "file": {"file_data": self._data_uri("video", video, media_type)}})
+        if len(parts) == 1 and parts[0]["type"] == "text":
+            return parts[0]["text"]
+        return parts or ""
+
+    def _apply_route(self, openai_request: Dict[str, Any], route: Optional[Route]) -> UpstreamGroup:
+        """Rename request parameters per the route's mapping and return the upstream group
+
+        Args:
+            openai_request: The converted OpenAI request, updated in place
+            route: The resolved route, if any
+
+        Returns:
+            The group of chat completions URLs to send the request to
+        """
+        if route is None:
+            return self.upstreams
+        if route.param_mapping:
+            for name, upstream_name in route.param_mapping.items():
+                if name in openai_request and name != upstream_name:
+                    openai_request[upstream_name] = openai_request.pop(name)
+        if not route.upstream or route.upstream == OPENAI_API_URL:
+            return self.upstreams
+
+        group = self.route_groups.get(route.upstream)
+        if group is None:
+            group = self.route_groups[route.upstream] = UpstreamGroup.from_env("openai", route.upstream)
+            group.start()
+        return group
+
     def _convert_to_bedrock_response(self, openai_response: Dict[str, Any], start_time: float) -> Dict[str, Any]:
         """Convert OpenAI response format to Bedrock format
 
@@ -149,9 +286,7 @@ class OpenAIHandler(BaseHandler):
         Returns:
             A random string of specified length
         """
-        import random
-        import string
-        return ''.join(random.choices(string.ascii_letters, k=length))
+        return random_padding(length)
 
     def _convert_to_bedrock_stream_chunk(self, chunk: Dict[str, Any], start_time: float) -> Union[Dict[str, Any], list[Dict[str, Any]], None]:
         """Convert OpenAI stream chunk to Bedrock format
@@ -188,9 +323,9 @@ class OpenAIHandler(BaseHandler):
                 "p": self._generate_random_string()
             }
 
-        # If we have a finish reason, return multiple chunks
+        # If we have a finish reason, close the block and the message; the
+        # metadata event follows once the usage chunk has arrived
         if finish_reason:
-            elapsed_ms = int((time.time() - start_time) * 1000)
             return [
                 # ContentBlockStop
                 {
@@ -201,23 +336,31 @@ class OpenAIHandler(BaseHandler):
                 {
                     "p": self._generate_random_string(),
                     "stopReason": finish_reason
-                },
-                # Metadata
-                {
-                    "p": self._generate_random_string(),
-                    "metrics": {
-                        "latencyMs": elapsed_ms
-                    },
-                    "usage": {
-                        "inputTokens": chunk.get("usage", {}).get("prompt_tokens", 0),
-                        "outputTokens": chunk.get("usage", {}).get("completion_tokens", 0),
-                        "totalTokens": chunk.get("usage", {}).get("total_tokens", 0)
-                    }
                 }
             ]
 
         return None
 
+    def _metadata_chunk(self, usage: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+        """Final metadata event of a stream
+
+        Args:
+            usage: The OpenAI usage of the stream, empty if none was sent
+            start_time: The timestamp when request started
+        """
+        elapsed_ms = int((time.time() - start_time) * 1000)
+        return {
+            "p": self._generate_random_string(),
+            "metrics": {
+                "latencyMs": elapsed_ms
+            },
+            "usage": {
+                "inputTokens": usage.get("prompt_tokens", 0),
+                "outputTokens": usage.get("completion_tokens", 0),
+                "totalTokens": usage.get("total_tokens", 0)
+            }
+        }
+
     def _extract_aws_access_key(self, request: Dict[str, Any]) -> Optional[str]:
         """Extract AWS access key from request credentials
 
@@ -270,8 +413,9 @@ class OpenAIHandler(BaseHandler):
             request_id: The ID of the request
             request: The request being made
         """
-        logger.info(f"Request {request_id}: Making request to OpenAI API",
+        logger.info("Request %s: Making request to OpenAI API", request_id,
                    extra={"model": request.get("model"), "stream": request.get("stream", False)})
+        body_logging.log(request_id, "Request body", request)
 
     def _log_success(self, request_id: str, start_time: float) -> None:
         """Log successful request completion
@@ -281,117 +425,214 @@ class OpenAIHandler(BaseHandler):
             start_time: When the request started
         """
         elapsed = time.time() - start_time
-        logger.info(f"Request {request_id}: Completed successfully in {elapsed:.2f}s")
+        logger.info("Request %s: Completed successfully in %.2fs", request_id, elapsed)
 
-    def _prepare_headers(self, api_key: str, request: Dict[str, Any]) -> Dict[str, str]:
+    def _prepare_headers(self, api_key: str, request: Dict[str, Any], content_length: int) -> Dict[str, str]:
         """Prepare headers for the request
 
         Args:
             api_key: The API key to use
             request: The request that may contain AWS credentials
+            content_length: Length of the encoded payload
 
         Returns:
             Dict containing the prepared headers
         """
         if api_key.startswith("Bearer "):
             api_key = api_key[7:]
-        headers = {"Authorization": "Bearer " + api_key}
+        headers = {"Authorization": "Bearer " + api_key, "Content-Type": "application/json",
+                   "Content-Length": str(content_length)}
         aws_access_key = self._extract_aws_access_key(request)
         if aws_access_key:
             headers["x-aws-accesskey"] = aws_access_key
         return headers
 
+    async def _iter_payload(self, parts: List[Union[bytes, memoryview]]) -> AsyncGenerator[Union[bytes, memoryview], None]:
+        """Send the encoded chunks as they are; with Content-Length set, aiohttp doesn't chunk them"""
+        for part in parts:
+            yield part
+
+    def _coalesce_window(self, request: Dict[str, Any], raw_request: Request) -> float:
+        """Resolve the delta coalescing window in seconds for a request
+
+        The window can be set per request with requestMetadata.coalesceWindowMs
+        or the x-coalesce-window-ms header; 0 disables coalescing.
+        """
+        value = (request.get("requestMetadata") or {}).get("coalesceWindowMs")
+        if value is None and raw_request is not None:
+            value = raw_request.headers.get("x-coalesce-window-ms")
+        if value is None:
+            return STREAM_COALESCE_WINDOW_MS / 1000
+        try:
+            return max(float(value), 0.0) / 1000
+        except ValueError:
+            logger.warning("Ignoring invalid coalesce window: %r", value)
+            return STREAM_COALESCE_WINDOW_MS / 1000
+
     async def handle_converse(self, model_id: str, request: Dict[str, Any],
-                            api_key: str, request_id: str, start_time: float, raw_request: Request):
+                            api_key: str, request_id: str, start_time: float, raw_request: Request,
+                            timing: Optional[RequestTiming] = None, route: Optional[Route] = None,
+                            exclude: Optional[List[Upstream]] = None):
         """Handle non-streaming conversation requests"""
+        timing = timing or RequestTiming(request_id, model_id, "openai")
         openai_request = self._convert_bedrock_to_openai(request, model_id)
+        group = self._apply_route(openai_request, route)
+        payload, length = encode_parts(openai_request)
+        timing.mark("convert")
         self._log_request(request_id, openai_request)
 
-        headers = self._prepare_headers(api_key, request)
+        headers = self._prepare_headers(api_key, request, length)
+        upstream = group.choose(exclude=exclude or ())
+        if exclude is not None:
+            exclude.append(upstream)
+        responded = False
 
         try:
             session = await self.session
+            sent = time.perf_counter()
             async with session.post(
-                OPENAI_API_URL,
+                upstream.url,
                 headers=headers,
-                json=openai_request
+                data=self._iter_payload(payload),
+                trace_request_ctx=timing
             ) as response:
+                responded = True
+                group.record(upstream, response.status < 500, timing.mark("ttfb") - sent)
                 if response.status != 200:
                     error_text = await response.text()
                     raise ValueError(error_text)
 
-                data = await response.json()
+                body = await response.read()
+                timing.mark("relay")
+                body_logging.log(request_id, "Response body", body)
+                data = json_codec.loads(body)
                 self._log_success(request_id, start_time)
-                return self._convert_to_bedrock_response(data, start_time)
+                usage = data.get("usage") or {}
+                usage_ledger.record(api_key, model_id, usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0)
+                # Serialize once here instead of through FastAPI's jsonable_encoder
+                content = json_codec.dumps(self._convert_to_bedrock_response(data, start_time))
+                timing.mark("convert")
+                return Response(content=content, media_type="application/json")
 
         except Exception as e:
+            if not responded:
+                group.record(upstream, False)
+            body_logging.log_failure(request_id, "Request body", openai_request)
             self._handle_error(e, request_id)
+        finally:
+            group.done(upstream)
 
     async def handle_stream(self, model_id: str, request: Dict[str, Any],
-                          api_key: str, request_id: str, start_time: float, raw_request: Request):
+                          api_key: str, request_id: str, start_time: float, raw_request: Request,
+                          timing: Optional[RequestTiming] = None, route: Optional[Route] = None):
         """Handle streaming conversation requests"""
+        timing = timing or RequestTiming(request_id, model_id, "openai", stream=True)
         openai_request = self._convert_bedrock_to_openai(request, model_id)
         openai_request["stream"] = True
+        # Without this, OpenAI-compatible servers leave usage out of streams
+        openai_request["stream_options"] = {"include_usage": True}
+        group = self._apply_route(openai_request, route)
+        payload, length = encode_parts(openai_request)
+        timing.mark("convert")
         self._log_request(request_id, openai_request)
 
-        headers = self._prepare_headers(api_key, request)
+        headers = self._prepare_headers(api_key, request, length)
+        coalescer = DeltaCoalescer(self._coalesce_window(request, raw_request), STREAM_COALESCE_MAX_BYTES)
 
         async def generate():
+            upstream = group.choose()
+            responded = False
             try:
                 session = await self.session
+                sent = time.perf_counter()
                 async with session.post(
-                    OPENAI_API_URL,
+                    upstream.url,
                     headers=headers,
-                    json=openai_request
+                    data=self._iter_payload(payload),
+                    trace_request_ctx=timing
                 ) as response:
+                    responded = True
+                    group.record(upstream, response.status < 500, timing.mark("ttfb") - sent)
                     if response.status != 200:
                         error_text = await response.text()
                         self._handle_error(ValueError(error_text), request_id)
 
-                    async for line in response.content:
-                        if line.startswith(b"data: "):
+                    # SSE lines are split here rather than with readline(), which
+                    # loses data if the coalescing timeout cancels it mid-line
+                    content = response.content
+                    pending = b""
+                    done = False
+                    finished = False
+                    usage = {}
+                    while not done:
+                        time_left = coalescer.time_left()
+                        if time_left is None:
+                            data = await content.readany()
+                        else:
+                            try:
+                                async with asyncio.timeout(time_left):
+                                    data = await content.readany()
+                            except TimeoutError:
+                                yield self._create_event_messages(coalescer.flush(), request_id)
+                                continue
+                        if not data:
+                            break
+
+                        lines = (pending + data).split(b"\n")
+                        pending = lines.pop()
+                        for line in lines:
+                            if not line.startswith(b"data: "):
+                                continue
                             chunk = line[6:].strip()
                             if chunk == b"[DONE]":
                                 self._log_success(request_id, start_time)
+                                done = True
                                 break
 
                             try:
-                                data = json.loads(chunk)
-                                bedrock_chunks = self._convert_to_bedrock_stream_chunk(data, start_time)
-
-                                # Handle multiple chunks or single chunk
-                                chunks_to_process = (
-                                    bedrock_chunks if isinstance(bedrock_chunks, list)
-                                    else [bedrock_chunks] if bedrock_chunks
-                                    else []
-                                )
-
-                                for chunk in chunks_to_process:
-                                    # Create event headers
-                                    event_headers = {
-                                        ":event-type": (
-                                            "messageStart" if "role" in chunk
-                                            else "contentBlockStop" if "contentBlockIndex" in chunk and "delta" not in chunk
-                                            else "messageStop" if "stopReason" in chunk
-                                            else "metadata" if "metrics" in chunk
-                                            else "contentBlockDelta"
-                                        ),
-                                        ":content-type": "application/json",
-                                        ":message-type": "event"
-                                    }
-
-                                    # Create event message with checksums
-                                    event_message = self._create_event_message(event_headers, chunk, request_id)
-                                    yield event_message
-
-                            except json.JSONDecodeError as e:
+                                openai_chunk = json_codec.loads(chunk)
+                            except ValueError as e:
                                 logger.warning(f"Failed to decode JSON chunk in stream: {e}")
                                 continue
+                            # Usage comes in a last chunk without choices, or with the finish reason
+                            if openai_chunk.get("usage"):
+                                usage = openai_chunk["usage"]
+                            choices = openai_chunk.get("choices")
+                            if choices and choices[0].get("finish_reason"):
+                                finished = True
+                            bedrock_chunks = self._convert_to_bedrock_stream_chunk(openai_chunk, start_time)
+
+                            # Handle multiple chunks or single chunk
+                            chunks_to_process = (
+                                bedrock_chunks if isinstance(bedrock_chunks, list)
+                                else [bedrock_chunks] if bedrock_chunks
+                                else []
+                            )
+                            for bedrock_chunk in chunks_to_process:
+                                coalescer.add(bedrock_chunk)
+
+                        if coalescer.ready():
+                            # Encode all events from this read into a single write
+                            yield self._create_event_messages(coalescer.flush(), request_id)
+
+                    if finished:
+                        coalescer.add(self._metadata_chunk(usage, start_time))
+                        usage_ledger.record(api_key, model_id, usage.get("prompt_tokens") or 0,
+                                            usage.get("completion_tokens") or 0)
+                    if coalescer.pending:
+                        yield self._create_event_messages(coalescer.flush(), request_id)
+                    if coalescer.merged:
+                        logger.debug("[%s] Coalesced %d text deltas", request_id, coalescer.merged)
 
             except Exception as e:
+                if not responded:
+                    group.record(upstream, False)
+                body_logging.log_failure(request_id, "Request body", openai_request)
                 self._handle_error(e, request_id)
+            finally:
+                group.done(upstream)
 
-        return StreamingResponse(
+        return ClosingStreamingResponse(
             generate(),
             media_type="application/vnd.amazon.eventstream",
             headers={
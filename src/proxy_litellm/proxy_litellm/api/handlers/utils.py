@@ -1,4 +1,3 @@
-import json
 import time
 import logging
 import asyncio
@@ -6,6 +5,8 @@ from typing import Dict, Any
 import aiohttp
 from fastapi import HTTPException
 
+from ...utils import json_codec
+
 class BaseHandler:
     """Base handler class providing common functionality for all API handlers"""
 
@@ -13,12 +14,13 @@ class BaseHandler:
         self._session = None
         self.logger = logging.getLogger(__name__)
         self.timeout = 60.0  # Default timeout of 60 seconds
+        self.trace_configs = []
 
     @property
     async def session(self):
         """Lazy initialization of aiohttp session"""
         if self._session is None:
-            self._session = aiohttp.ClientSession()
+            self._session = aiohttp.ClientSession(trace_configs=self.trace_configs or None)
         return self._session
 
     async def aclose(self):
@@ -35,11 +37,12 @@ class BaseHandler:
 
     def _log_request(self, request_id: str, request_data: Dict[str, Any]):
         """Log request details"""
-        self.logger.debug(f"[{request_id}] Request data: {json.dumps(request_data)}")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("[%s] Request data: %s", request_id, json_codec.dumps(request_data).decode())
 
     def _log_success(self, request_id: str, start_time: float):
         """Log successful request completion"""
-        self.logger.info(f"[{request_id}] Successfully completed request in {time.time() - start_time:.2f}s")
+        self.logger.info("[%s] Successfully completed request in %.2fs", request_id, time.time() - start_time)
 
     async def _execute_with_timeout(self, coro, request_id: str):
         """Execute coroutine with timeout"""
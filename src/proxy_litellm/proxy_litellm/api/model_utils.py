@@ -1,7 +1,11 @@
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
 from ..models.request_models import ConverseRequest
 from ..utils.bedrock import get_bedrock_models
+from ..utils import json_codec
+from ..utils.media import split_spans, restore_spans
 
 logger = logging.getLogger(__name__)
 
@@ -9,6 +13,43 @@ def validate_model(model_id: str) -> None:
     """Simple check if model is supported, but ignore it since we have a catch-all plan"""
     pass
 
+def _invalid(loc: Tuple[str, ...], error_type: str, msg: str) -> RequestValidationError:
+    """422 in the same format FastAPI uses for body validation errors"""
+    return RequestValidationError([{"type": error_type, "loc": ("body",) + loc, "msg": msg, "input": None}])
+
+def parse_request_body(body: bytes, translated: bool) -> Dict[str, Any]:
+    """Parse a converse request body.
+
+    Translated requests are validated into ConverseRequest in one pass from
+    the JSON bytes. Passthrough requests are sent upstream as received, so
+    they only get a structural check of the fields the proxy reads.
+    Large base64 "bytes" fields of content blocks are not parsed, they are
+    BinarySpan references to the body.
+
+    Raises:
+        RequestValidationError: If the body is not a valid converse request
+    """
+    body, spans, prefix = split_spans(body)
+    if translated:
+        try:
+            return restore_spans(ConverseRequest.model_validate_json(body).model_dump(), spans, prefix)
+        except ValidationError as e:
+            raise RequestValidationError(
+                [{**error, "loc": ("body",) + tuple(error["loc"])} for error in e.errors(include_url=False)])
+
+    try:
+        request = json_codec.loads(body)
+    except ValueError:
+        raise _invalid((), "json_invalid", "JSON decode error")
+    if not isinstance(request, dict):
+        raise _invalid((), "model_attributes_type", "Input should be a valid dictionary or object")
+    if not isinstance(request.get("messages"), list):
+        raise _invalid(("messages",), "list_type", "Input should be a valid list")
+    for field in ("inferenceConfig", "requestMetadata"):
+        if not isinstance(request.get(field) or {}, dict):
+            raise _invalid((field,), "dict_type", "Input should be a valid dictionary")
+    return restore_spans(request, spans, prefix)
+
 # Model-specific parameter mappings
 MODEL_PARAM_MAPPINGS = {
     "anthropic": {
@@ -20,13 +61,14 @@ MODEL_PARAM_MAPPINGS = {
     }
 }
 
-def transform_model_parameters(model_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
-    """Transform model parameters to the required format"""
-    model_type = next((mtype for mtype in MODEL_PARAM_MAPPINGS if model_id.startswith(mtype)), None)
-    if not model_type:
-        return params
-
-    mapping = MODEL_PARAM_MAPPINGS[model_type]
+def transform_model_parameters(model_id: str, params: Dict[str, Any],
+                               mapping: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Transform model parameters to the required format, using the route's mapping if given"""
+    if mapping is None:
+        model_type = next((mtype for mtype in MODEL_PARAM_MAPPINGS if model_id.startswith(mtype)), None)
+        if not model_type:
+            return params
+        mapping = MODEL_PARAM_MAPPINGS[model_type]
     defaults = {
         "prompt": "",
         "max_tokens": 512,
@@ -34,7 +76,7 @@ def transform_model_parameters(model_id: str, params: Dict[str, Any]) -> Dict[st
         "top_p": 0.9,
         "stop_sequences": []
     }
-    return {mapping[k]: params.get(k, default) for k, default in defaults.items()}
+    return {mapping.get(k, k): params.get(k, default) for k, default in defaults.items()}
 
 def prepare_inference_config(request: ConverseRequest) -> Dict[str, Any]:
     """Extract inference configuration from request"""
@@ -1,41 +1,156 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from typing import Annotated
-import os
-import httpx
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from typing import Annotated, Optional
+from datetime import datetime, timezone
 import re
 
-from ..models.request_models import ConverseRequest
-from .auth import get_api_key
+from .auth import get_api_key, is_master_key, require_master_key
 from ..core.handler import handler
+from ..utils.bedrock import model_catalog
+from ..core.router import model_router
+from ..core.cache import response_cache
+from ..core.ratelimit import rate_limiter
+from ..core.keys import key_validator
+from ..core.registration import registrar
+from ..utils.metrics import registry
+from ..utils.shared_metrics import worker_metrics
+from ..core.telemetry import slow_requests
+from ..core.overload import load_shedder
+from ..core.usage import usage_ledger, key_id, GROUP_BY
 
 router = APIRouter()
+# Internal state and stats of all keys, for the master key only
+admin = [Depends(require_master_key)]
 
 @router.get("/health")
 async def health_check():
-    """Health check endpoint that returns 200 OK if the service is running."""
-    return {"status": "ok"}
+    """Health check endpoint that returns 200 OK if the service is running.
 
+    Reports "overloaded" while new converse requests are being shed, along
+    with the event loop lag and number of requests in flight.
+    """
+    load = load_shedder.stats()
+    return {"status": "overloaded" if load["overloaded"] else "ok", **load}
+
+@router.get("/debug/pool", dependencies=admin)
+async def pool_stats():
+    """Upstream connection pool counters (hits, misses, evictions) per handler."""
+    return handler.stats()
+
+@router.get("/debug/upstreams", dependencies=admin)
+async def upstream_stats():
+    """Per-upstream load, latency, health, circuit breaker and pool state."""
+    return handler.upstream_stats()
+
+@router.get("/debug/models", dependencies=admin)
+async def model_catalog_stats():
+    """Bedrock model catalog size, source and refresh counters."""
+    return model_catalog.stats()
+
+@router.get("/debug/routes/{model_id}", dependencies=admin)
+async def resolve_route(model_id: str):
+    """Show how a model id is routed: handler, upstream and upstream model id."""
+    return {"route": model_router.resolve(model_id).to_dict(), "router": model_router.stats()}
+
+@router.get("/debug/cache", dependencies=admin)
+async def cache_stats():
+    """Response cache size and settings."""
+    return response_cache.stats()
+
+@router.get("/debug/limits", dependencies=admin)
+async def limit_stats():
+    """Rate limiter state: queued requests and tracked key and model scopes."""
+    return rate_limiter.stats()
+
+@router.get("/debug/keys", dependencies=admin)
+async def key_stats():
+    """API key validation mode and cache counts."""
+    return key_validator.stats()
+
+@router.get("/debug/registrations", dependencies=admin)
+async def registration_stats():
+    """Key store location and registrations cached or in flight."""
+    return registrar.stats()
+
+@router.get("/debug/slow-requests", dependencies=admin)
+async def slow_request_log():
+    """Phase breakdown of the latest requests over SLOW_REQUEST_THRESHOLD_MS, newest first."""
+    return {
+        "threshold_ms": slow_requests.threshold * 1000,
+        "recorded": slow_requests.recorded,
+        "requests": slow_requests.entries()
+    }
+
+def _timestamp(name: str, value: Optional[str]) -> Optional[float]:
+    """Unix seconds or an ISO 8601 date/time (UTC unless it has an offset)"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+@router.get("/usage")
+async def usage(request: Request, x_bedrock_api_key: Annotated[str, Header()] = None,
+                api_key: Optional[str] = None, model: Optional[str] = None,
+                since: Optional[str] = None, until: Optional[str] = None, group_by: str = "key,model"):
+    """Token usage from the usage ledger, summed per group_by columns (key, model, hour, day).
+
+    Filters by API key (the key or its sha256: digest), model and time
+    (hours starting from since and before until). Callers other than the
+    master key only see the usage of their own key. Usage of the last
+    USAGE_FLUSH_INTERVAL seconds may not be written yet.
+    """
+    master = is_master_key(x_bedrock_api_key)
+    if not master:
+        own_key = await get_api_key(request, x_bedrock_api_key)
+        if api_key and api_key not in (own_key, key_id(own_key)):
+            raise HTTPException(status_code=403, detail="Only the usage of your own key can be queried")
+        api_key = own_key
+    columns = [c.strip() for c in group_by.split(",") if c.strip()]
+    unknown = [c for c in columns if c not in GROUP_BY]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Invalid group_by: {', '.join(unknown)}")
+    rows = await usage_ledger.query(api_key, model, _timestamp("since", since), _timestamp("until", until), columns)
+    return {"usage": rows, "ledger": usage_ledger.stats()} if master else {"usage": rows}
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus metrics: request counts, errors, latency, TTFT and stream throughput per model.
+
+    Under the multi-process launcher, the metrics of all workers are combined.
+    """
+    body = worker_metrics.render() if worker_metrics is not None else registry.render()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+# The body is read by the handler once the model's route is known, so
+# passthrough requests are never validated into ConverseRequest
 @router.post("/model/{model_id}/converse")
 async def converse(
     model_id: str,
-    request: ConverseRequest,
     api_key: Annotated[str, Depends(get_api_key)],
     raw_request: Request
 ):
-    return await handler.handle_request(model_id, request.dict(), api_key, raw_request=raw_request)
+    return await handler.handle_request(model_id, None, api_key, raw_request=raw_request)
 
 @router.post("/model/{model_id}/converse-stream")
 async def converse_stream(
     model_id: str,
-    request: ConverseRequest,
     api_key: Annotated[str, Depends(get_api_key)],
     raw_request: Request
 ):
-    return await handler.handle_request(model_id, request.dict(), api_key, stream=True, raw_request=raw_request)
+    return await handler.handle_request(model_id, None, api_key, stream=True, raw_request=raw_request)
 
 @router.post("/register")
 async def register(request: Request):
-    """Register endpoint that generates a key based on AWS credentials."""
+    """Register endpoint that returns a key for an AWS access key, the stored one for the master key."""
     # Get the Credential header
     credential = request.headers.get("Authorization")
     if credential:
@@ -55,33 +170,9 @@ async def register(request: Request):
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid credential format")
 
-    # Get litellm configuration from environment
-    litellm_endpoint = os.getenv("LITELLM_ENDPOINT")
-    litellm_master_key = os.getenv("LITELLM_MASTER_KEY")
+    if not aws_access_key:
+        raise HTTPException(status_code=400, detail="Invalid credential format")
 
-    if not litellm_endpoint or not litellm_master_key:
-        raise HTTPException(
-            status_code=500,
-            detail="LiteLLM configuration is not properly set"
-        )
-
-    # Call litellm key generation endpoint
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{litellm_endpoint}/key/generate",
-                headers={
-                    "Authorization": f"Bearer {litellm_master_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "user_id": aws_access_key
-                }
-            )
-            response.raise_for_status()
-            return response.json()
-    except httpx.HTTPError as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to generate key: {str(e)}"
-        )
+    # Anyone can name an access key, so only the master key gets the stored key back
+    reuse = is_master_key(request.headers.get("x-bedrock-api-key"))
+    return await registrar.register(aws_access_key, reuse)
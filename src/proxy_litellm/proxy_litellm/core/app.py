@@ -2,24 +2,43 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from ..api.routes import router
 from .handler import handler
+from ..utils.bedrock import model_catalog
+from ..utils.log import setup_logging
+from .middleware import RequestArrivalMiddleware, LoadSheddingMiddleware
+from .overload import loop_monitor, load_shedder
+from .keys import key_validator
+from .registration import registrar
+from .usage import usage_ledger
+from ..utils.shared_metrics import worker_metrics
 import logging
 from fastapi.middleware.cors import CORSMiddleware
 
-# Set up logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.StreamHandler()]
-)
+# Set up logging from log_conf.yaml, written by a background thread
+setup_logging()
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for FastAPI application"""
     # Startup
+    model_catalog.start()
+    await handler.start()
+    await key_validator.start()
+    await registrar.start()
+    await usage_ledger.start()
+    loop_monitor.start()
+    if worker_metrics is not None:
+        worker_metrics.start()
     yield
     # Shutdown
+    await loop_monitor.stop()
+    if worker_metrics is not None:
+        await worker_metrics.stop()
+    await usage_ledger.close()
+    await registrar.close()
+    await key_validator.close()
     await handler.close()
+    model_catalog.stop()
 
 def create_app() -> FastAPI:
     """Create and configure the FastAPI application"""
@@ -31,6 +50,9 @@ def create_app() -> FastAPI:
         allow_methods=["*"],     
         allow_headers=["*"],     
     )
+    app.add_middleware(LoadSheddingMiddleware, shedder=load_shedder)
+    # Added last so it runs first and sees the request before anything else
+    app.add_middleware(RequestArrivalMiddleware)
     # Include API routes
     app.include_router(router)
 
@@ -41,4 +63,5 @@ app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="debug", log_config="log_conf.yaml")
+    # Logging is already configured by setup_logging()
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None)
@@ -0,0 +1,296 @@
+"""Exact-match response cache for deterministic converse requests"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from array import array
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from ..utils.eventstream import iter_messages
+from ..utils.metrics import registry, Gauge
+from ..utils.responses import ClosingStreamingResponse
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "300"))
+# Only requests with temperature 0 are cached unless this is turned off
+RESPONSE_CACHE_DETERMINISTIC_ONLY = os.environ.get("RESPONSE_CACHE_DETERMINISTIC_ONLY", "true").lower() in ("1", "true", "yes")
+# Streams share the response cache's size budget and TTL
+STREAM_CACHE_ENABLED = os.environ.get("STREAM_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+# wire: replay as fast as the client reads, paced: keep the recorded gaps between writes
+STREAM_CACHE_REPLAY = os.environ.get("STREAM_CACHE_REPLAY", "wire").lower()
+
+CACHE_REQUESTS = registry.counter(
+    "proxy_response_cache_requests_total", "Response cache lookups by result (hit, miss, bypass)", ("result",))
+STREAM_CACHE_REQUESTS = registry.counter(
+    "proxy_stream_cache_requests_total", "Stream cache lookups by result (hit, miss, bypass)", ("result",))
+STREAM_CACHE_RECORDINGS = registry.counter(
+    "proxy_stream_cache_recordings_total", "Recorded streams by outcome (stored, incomplete, too_large)", ("outcome",))
+CACHE_EVICTIONS = registry.counter(
+    "proxy_response_cache_evictions_total", "Entries evicted to stay within RESPONSE_CACHE_MAX_BYTES")
+
+# Headers recomputed for every response instead of being replayed
+_SKIPPED_HEADERS = frozenset((b"content-length", b"server-timing", b"x-cache", b"date"))
+
+
+def _normalize(value: Any) -> Any:
+    """Drop unset (None) fields so explicit nulls and omitted fields hash the same"""
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def fingerprint(model_id: str, request: Dict[str, Any], api_key: str, *extra: str) -> str:
+    """Canonical hash of a converse request.
+
+    requestMetadata is left out since it only carries tags and cache
+    controls. The API key is part of the hash so callers never share entries.
+    """
+    body = {k: v for k, v in request.items() if k != "requestMetadata"}
+    canonical = json.dumps(_normalize(body), sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (model_id, api_key or "", *extra):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(canonical.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def is_deterministic(request: Dict[str, Any]) -> bool:
+    """Whether the request asks for greedy decoding (temperature 0)"""
+    inference_config = request.get("inferenceConfig") or {}
+    return inference_config.get("temperature") == 0
+
+
+def cache_bypassed(request: Dict[str, Any], raw_request: Optional[Request]) -> bool:
+    """Per-request bypass with requestMetadata.cacheBypass, x-cache-bypass or Cache-Control: no-cache"""
+    # Request metadata values can be any JSON type, e.g. true or 1
+    if str((request.get("requestMetadata") or {}).get("cacheBypass", "")).lower() in ("1", "true", "yes"):
+        return True
+    if raw_request is None:
+        return False
+    if raw_request.headers.get("x-cache-bypass", "").lower() in ("1", "true", "yes"):
+        return True
+    cache_control = raw_request.headers.get("cache-control", "").lower()
+    return "no-cache" in cache_control or "no-store" in cache_control
+
+
+class CacheEntry:
+    """A cached response body with its status and relayed headers"""
+
+    __slots__ = ("body", "status", "headers", "expires_at", "size")
+
+    def __init__(self, body: bytes, status: int, headers: List[Tuple[bytes, bytes]], expires_at: float):
+        self.body = body
+        self.status = status
+        self.headers = headers
+        self.expires_at = expires_at
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers) + 128
+
+    def to_response(self) -> Response:
+        response = Response(content=self.body, status_code=self.status)
+        response.raw_headers.extend(self.headers)
+        return response
+
+
+def _stream_complete(buffer: memoryview) -> bool:
+    """Whether a recorded event stream ends normally and carries no exception events"""
+    last_event = None
+    for headers, _ in iter_messages(buffer):
+        if headers.get(":message-type") != "event":
+            return False
+        last_event = headers.get(":event-type")
+    return last_event in ("messageStop", "metadata")
+
+
+class StreamCacheEntry(CacheEntry):
+    """A recorded event stream.
+
+    All writes are stored back to back in one buffer with their end offsets
+    and the gap before each write, so replay hands out slices of the buffer
+    without copying.
+    """
+
+    __slots__ = ("offsets", "delays")
+
+    def __init__(self, body: bytes, offsets: array, delays: array, status: int,
+                 headers: List[Tuple[bytes, bytes]], expires_at: float):
+        super().__init__(body, status, headers, expires_at)
+        self.offsets = offsets
+        self.delays = delays
+        self.size += offsets.itemsize * len(offsets) + delays.itemsize * len(delays)
+
+    async def replay(self, paced: bool = False) -> AsyncIterator[memoryview]:
+        view = memoryview(self.body)
+        start = 0
+        for end, delay in zip(self.offsets, self.delays):
+            if paced and delay > 0:
+                await asyncio.sleep(delay)
+            yield view[start:end]
+            start = end
+
+    def to_response(self, paced: bool = False) -> StreamingResponse:
+        response = ClosingStreamingResponse(self.replay(paced), status_code=self.status)
+        response.raw_headers.extend(self.headers)
+        return response
+
+
+class ResponseCache:
+    """LRU cache of successful responses, bounded by total bytes and expiring after a TTL"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300.0,
+                 enabled: bool = False, deterministic_only: bool = True, stream_enabled: bool = False):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled and max_bytes > 0
+        self.stream_enabled = stream_enabled and max_bytes > 0
+        self.deterministic_only = deterministic_only
+        # Entries over this size would flush most of the cache, so they are not stored
+        self.max_entry_bytes = max(max_bytes // 8, 1)
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.size = 0
+
+    def cacheable(self, request: Dict[str, Any], stream: bool = False) -> bool:
+        enabled = self.stream_enabled if stream else self.enabled
+        return enabled and (not self.deterministic_only or is_deterministic(request))
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: CacheEntry) -> bool:
+        if entry.size > self.max_entry_bytes:
+            return False
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+            CACHE_EVICTIONS.inc()
+        return True
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+
+    def lookup(self, key: str) -> Optional[Response]:
+        """Return a cached response and count the hit or miss"""
+        entry = self.get(key)
+        CACHE_REQUESTS.inc("hit" if entry is not None else "miss")
+        if entry is None:
+            return None
+        response = entry.to_response()
+        response.headers["x-cache"] = "HIT"
+        return response
+
+    def store(self, key: str, response: Response) -> None:
+        """Cache a successful non-streaming response"""
+        if response is None or response.status_code != 200:
+            return
+        headers = [(k, v) for k, v in response.raw_headers if k not in _SKIPPED_HEADERS]
+        self.put(key, CacheEntry(bytes(response.body), response.status_code, headers, time.monotonic() + self.ttl))
+        response.headers["x-cache"] = "MISS"
+
+    def lookup_stream(self, key: str) -> Optional[StreamingResponse]:
+        """Return a replay of a cached stream and count the hit or miss"""
+        entry = self.get(key)
+        STREAM_CACHE_REQUESTS.inc("hit" if entry is not None else "miss")
+        if entry is None:
+            return None
+        response = entry.to_response(paced=STREAM_CACHE_REPLAY == "paced")
+        response.headers["x-cache"] = "HIT"
+        return response
+
+    async def _record(self, key: str, iterator: AsyncIterator[bytes], status: int,
+                      headers: List[Tuple[bytes, bytes]]) -> AsyncIterator[bytes]:
+        chunks: List[bytes] = []
+        offsets = array("I")
+        delays = array("d")
+        size = 0
+        recording = True
+        last = time.perf_counter()
+        async for chunk in iterator:
+            if recording:
+                now = time.perf_counter()
+                size += len(chunk)
+                if size > self.max_entry_bytes:
+                    # Too large to keep, stop buffering but keep relaying
+                    recording = False
+                    chunks = []
+                    STREAM_CACHE_RECORDINGS.inc("too_large")
+                else:
+                    chunks.append(chunk)
+                    offsets.append(size)
+                    delays.append(now - last)
+                    last = now
+            yield chunk
+
+        # Only reached when the upstream stream finished and the client read all of it
+        if not recording:
+            return
+        body = b"".join(chunks)
+        if not _stream_complete(memoryview(body)):
+            STREAM_CACHE_RECORDINGS.inc("incomplete")
+            return
+        self.put(key, StreamCacheEntry(body, offsets, delays, status, headers, time.monotonic() + self.ttl))
+        STREAM_CACHE_RECORDINGS.inc("stored")
+
+    def record_stream(self, key: str, response: Response) -> Response:
+        """Tee a successful streaming response into the cache as it is relayed"""
+        if not isinstance(response, StreamingResponse) or response.status_code != 200:
+            return response
+        headers = [(k, v) for k, v in response.raw_headers if k not in _SKIPPED_HEADERS]
+        response.body_iterator = self._record(key, response.body_iterator, response.status_code, headers)
+        response.headers["x-cache"] = "MISS"
+        return response
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+    def collect(self) -> List[Gauge]:
+        entries = Gauge("proxy_response_cache_entries", "Responses in the cache")
+        size = Gauge("proxy_response_cache_bytes", "Approximate bytes held by the response cache")
+        entries.set(len(self._entries))
+        size.set(self.size)
+        return [entries, size]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "stream_enabled": self.stream_enabled,
+            "stream_replay": STREAM_CACHE_REPLAY,
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl
+        }
+
+
+response_cache = ResponseCache(
+    max_bytes=RESPONSE_CACHE_MAX_BYTES,
+    ttl=RESPONSE_CACHE_TTL,
+    enabled=RESPONSE_CACHE_ENABLED,
+    deterministic_only=RESPONSE_CACHE_DETERMINISTIC_ONLY,
+    stream_enabled=STREAM_CACHE_ENABLED
+)
+registry.add_collector(response_cache.collect)
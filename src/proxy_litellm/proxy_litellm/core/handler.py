@@ -1,15 +1,31 @@
+import os
 import time
+import asyncio
 import logging
-from typing import Dict, Any
-from fastapi import Request
+from typing import Dict, Any, Optional
+from fastapi import Request, HTTPException
 
 from ..api.handlers.bedrock_handler import BedrockHandler
 from ..api.handlers.openai_handler import OpenAIHandler
-from ..utils.bedrock import get_bedrock_models
-from ..api.model_utils import validate_model
+from .router import model_router, Route
+from .cache import response_cache, fingerprint, is_deterministic, cache_bypassed, CACHE_REQUESTS, STREAM_CACHE_REQUESTS
+from .singleflight import singleflight, singleflight_enabled
+from .ratelimit import rate_limiter
+from .upstreams import UpstreamGroup, CLOSED
+from .hedging import hedger, hedging_enabled
+from ..api.model_utils import validate_model, parse_request_body
+from .keys import KeyInfo
+from ..utils.metrics import registry, Gauge, Counter
+from ..utils.timing import RequestTiming
+from .telemetry import REQUESTS, RELAYED_BYTES, record_error, finish_request, instrument_response
 
 logger = logging.getLogger(__name__)
 
+# Largest request body buffered for one request, 0 disables. Translated
+# requests reference their binary content in the body instead of copying it,
+# so this bounds their memory too; relayed passthrough bodies are not buffered
+REQUEST_MEMORY_BUDGET = int(os.environ.get("REQUEST_MEMORY_BUDGET", str(100 * 1024 * 1024)))
+
 class Handler:
     def __init__(self):
         self.handlers = {
@@ -17,31 +33,233 @@ class Handler:
             "openai": OpenAIHandler()
         }
 
+    async def start(self):
+        """Start all handler resources"""
+        for handler in self.handlers.values():
+            if hasattr(handler, 'astart'):
+                await handler.astart()
+
+    def upstream_groups(self) -> Dict[str, UpstreamGroup]:
+        """Upstream groups of all handlers by name"""
+        groups = {}
+        for handler in self.handlers.values():
+            groups.update(handler.upstream_groups())
+        return groups
+
+    def upstream_stats(self) -> Dict[str, Any]:
+        """Balancing, health and circuit breaker state of every upstream"""
+        return {name: group.stats() for name, group in self.upstream_groups().items()}
+
+    def stats(self) -> Dict[str, Any]:
+        """Collect upstream connection pool stats from all handlers"""
+        stats = {}
+        for name, group in self.upstream_groups().items():
+            for upstream in group.upstreams:
+                if upstream.pool is not None:
+                    # Single upstreams keep the group name, as before upstream lists
+                    stats[name if len(group) == 1 else f"{name}:{upstream.name}"] = upstream.pool.stats()
+        return stats
+
+    def collect_pool_metrics(self):
+        """Expose connection pool stats as metrics at scrape time"""
+        idle = Gauge("proxy_upstream_pool_idle_connections", "Idle upstream connections", ("handler",))
+        in_use = Gauge("proxy_upstream_pool_in_use_connections", "Checked out upstream connections", ("handler",))
+        reused = Counter("proxy_upstream_pool_hits_total", "Requests served on a reused connection", ("handler",))
+        created = Counter("proxy_upstream_pool_created_total", "Upstream connections opened", ("handler",))
+        errors = Counter("proxy_upstream_connect_errors_total", "Failed upstream connection attempts", ("handler",))
+        for name, stats in self.stats().items():
+            idle.set(stats["idle"], name)
+            in_use.set(stats["in_use"], name)
+            reused.inc(name, amount=stats["hits"])
+            created.inc(name, amount=stats["created"])
+            errors.inc(name, amount=stats["connect_errors"])
+        return [idle, in_use, reused, created, errors]
+
+    def collect_upstream_metrics(self):
+        """Expose upstream load and circuit breaker state as metrics at scrape time"""
+        outstanding = Gauge("proxy_upstream_outstanding_requests", "Requests in flight per upstream", ("handler", "upstream"))
+        latency = Gauge("proxy_upstream_latency_ewma_seconds", "Smoothed time to response head per upstream",
+                        ("handler", "upstream"), aggregate="max")
+        available = Gauge("proxy_upstream_available", "1 if the upstream is healthy and its circuit breaker closed",
+                          ("handler", "upstream"), aggregate="min")
+        for group in self.upstream_groups().values():
+            for upstream in group.upstreams:
+                outstanding.set(upstream.outstanding, group.name, upstream.name)
+                latency.set(upstream.ewma, group.name, upstream.name)
+                available.set(1 if upstream.healthy and upstream.state == CLOSED else 0, group.name, upstream.name)
+        return [outstanding, latency, available]
+
     async def close(self):
         """Close all handler resources"""
         for handler in self.handlers.values():
             if hasattr(handler, 'aclose'):
                 await handler.aclose()
 
-    async def handle_request(self, model_id: str, request: Dict[str, Any],
+    def _needs_body(self, route: Route, stream: bool, key_info: Optional[KeyInfo]) -> bool:
+        """Whether the parsed request body is used for more than the upstream call
+
+        Passthrough requests are only coalesced when their route turns it on:
+        finding deterministic requests would mean parsing every body.
+        """
+        return (route.handler != "bedrock"
+                or (response_cache.stream_enabled if stream else response_cache.enabled)
+                or route.singleflight is True
+                or rate_limiter.enabled
+                or (key_info is not None and key_info.limits is not None))
+
+    def _over_budget(self, length: int, model_id: str, handler_type: str, timing: RequestTiming) -> None:
+        """Reject a body larger than the per-request memory budget with 413"""
+        if REQUEST_MEMORY_BUDGET and length > REQUEST_MEMORY_BUDGET:
+            record_error(model_id, handler_type, 413)
+            finish_request(timing, 413)
+            raise HTTPException(
+                status_code=413,
+                detail=f"Request body of {length} bytes exceeds the {REQUEST_MEMORY_BUDGET} byte limit"
+            )
+
+    async def handle_request(self, model_id: str, request: Optional[Dict[str, Any]],
                            api_key: str, stream: bool = False, raw_request: Request = None):
-        """Handle both streaming and non-streaming requests"""
+        """Handle both streaming and non-streaming requests
+
+        With request None, the body is read from raw_request once the route
+        is known: translated requests are validated into the request model,
+        passthrough requests only get a structural check, and not even that
+        if nothing but the upstream call uses the body.
+        """
         start_time = time.time()
         request_id = f"req_{int(start_time * 1000)}"
-        logger.info(f"[{request_id}] Starting {'streaming ' if stream else ''}request for model: {model_id}")
+        logger.info("[%s] Starting %srequest for model: %s", request_id, "streaming " if stream else "", model_id)
 
         validate_model(model_id)
 
-        # Determine handler type based on model
-        handler_type = "bedrock" if model_id in get_bedrock_models() else "openai"
+        # Determine handler, upstream and upstream model id from the routing table
+        route = model_router.resolve(model_id)
+        handler_type = route.handler
         handler = self.handlers[handler_type]
 
+        # Models and limits of the API key, from API key validation
+        key_info = getattr(raw_request.state, "key_info", None) if raw_request is not None else None
+
+        # Time spent before this point (body read, validation) counts as parse
+        arrival = getattr(raw_request.state, "arrival", None) if raw_request is not None else None
+        timing = RequestTiming(request_id, model_id, handler_type, stream, start=arrival)
+        # Slow non-streaming requests may be sent a second time; both attempts
+        # send the buffered request body
+        hedge = not stream and hedging_enabled(route.hedge)
+        needs_body = request is None and self._needs_body(route, stream, key_info)
+        if raw_request is not None and (needs_body or hedge):
+            # Checked before the body is read where the length is known
+            content_length = raw_request.headers.get("content-length")
+            if content_length and content_length.isdigit():
+                self._over_budget(int(content_length), model_id, handler_type, timing)
+        if request is None:
+            if needs_body:
+                body = await raw_request.body()
+                self._over_budget(len(body), model_id, handler_type, timing)
+                request = parse_request_body(body, translated=handler_type != "bedrock")
+            else:
+                # Passthrough body is relayed upstream as it arrives
+                request = {}
+        timing.mark("parse")
+
+        REQUESTS.inc(model_id, handler_type, "true" if stream else "false")
+        if raw_request is not None:
+            content_length = raw_request.headers.get("content-length")
+            if content_length and content_length.isdigit():
+                RELAYED_BYTES.inc(model_id, handler_type, "request", amount=int(content_length))
+
+        if key_info is not None and not key_info.allows(model_id, route.model_id):
+            record_error(model_id, handler_type, 403)
+            finish_request(timing, 403)
+            raise HTTPException(status_code=403, detail=f"API key is not allowed to use model {model_id}")
+
+        use_cache = response_cache.cacheable(request, stream)
+        coalesce = singleflight_enabled(route.singleflight, is_deterministic(request))
+        request_key = None
+        if use_cache or coalesce:
+            request_key = fingerprint(model_id, request, api_key, handler_type, route.model_id,
+                                      "stream" if stream else "converse")
+
+        # Serve repeated deterministic requests from the response cache;
+        # streams are replayed from recorded frames
+        cache_key = None
+        if use_cache:
+            if cache_bypassed(request, raw_request):
+                (STREAM_CACHE_REQUESTS if stream else CACHE_REQUESTS).inc("bypass")
+            else:
+                cache_key = request_key
+                cached = response_cache.lookup_stream(cache_key) if stream else response_cache.lookup(cache_key)
+                if cached is not None:
+                    timing.mark("cache")
+                    logger.info("[%s] Served from response cache", request_id)
+                    return instrument_response(cached, timing)
+
+        # Per API key and per model limits; rejected requests get 429 with Retry-After
+        key_limits = key_info.limits if key_info is not None else None
+        try:
+            permit = await rate_limiter.acquire(api_key, model_id, request, stream, key_limits)
+        except HTTPException as e:
+            record_error(model_id, handler_type, e.status_code)
+            finish_request(timing, e.status_code)
+            raise
+        if rate_limiter.enabled or key_limits is not None:
+            timing.mark("admission")
+
         # Call appropriate handler method
         handler_method = handler.handle_stream if stream else handler.handle_converse
-        return await handler_method(model_id, request, api_key, request_id, start_time, raw_request)
+
+        tried = []
+        if hedge and raw_request is not None:
+            await raw_request.body()
+
+        async def attempt(number):
+            # A hedged attempt keeps its own timing and avoids the upstreams already used
+            attempt_timing = timing if number == 1 else RequestTiming(request_id, model_id, handler_type)
+            return await handler_method(route.model_id, request, api_key, request_id, start_time, raw_request,
+                                        timing=attempt_timing, route=route, exclude=tried)
+
+        async def call():
+            if hedge:
+                response = await hedger.run(model_id, attempt)
+            else:
+                response = await handler_method(route.model_id, request, api_key, request_id, start_time, raw_request,
+                                                timing=timing, route=route)
+            if cache_key is not None:
+                if stream:
+                    response = response_cache.record_stream(cache_key, response)
+                else:
+                    response_cache.store(cache_key, response)
+            return response
+
+        try:
+            if coalesce:
+                # Identical requests already in flight share that upstream call
+                response, shared = await singleflight.do(request_key, call)
+                if shared:
+                    timing.mark("singleflight")
+                    logger.info("[%s] Sharing response of an identical in-flight request", request_id)
+            else:
+                response = await call()
+        except HTTPException as e:
+            permit.release()
+            record_error(model_id, handler_type, e.status_code)
+            finish_request(timing, e.status_code)
+            raise
+        except Exception:
+            permit.release()
+            record_error(model_id, handler_type, 500)
+            finish_request(timing, 500)
+            raise
+        except asyncio.CancelledError:
+            # Client disconnected while the upstream call was running
+            permit.release()
+            raise
+        return permit.attach(instrument_response(response, timing))
 
 # Create single handler instance
 handler = Handler()
+registry.add_collector(handler.collect_pool_metrics)
+registry.add_collector(handler.collect_upstream_metrics)
 
 # Convenience functions
 async def handle_converse(*args, **kwargs):
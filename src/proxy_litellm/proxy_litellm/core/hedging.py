@@ -0,0 +1,165 @@
+"""Hedged requests for non-streaming converse"""
+
+import os
+import time
+import asyncio
+import logging
+from array import array
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from fastapi.responses import Response
+
+from ..utils.metrics import registry, Gauge
+
+logger = logging.getLogger(__name__)
+
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+# Latency percentile after which a second attempt is sent
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+# Extra attempts allowed as a share of requests
+HEDGE_BUDGET_PERCENT = float(os.environ.get("HEDGE_BUDGET_PERCENT", "5"))
+HEDGE_MIN_DELAY_MS = float(os.environ.get("HEDGE_MIN_DELAY_MS", "50"))
+# Requests seen for a model before its latency percentile is trusted
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+# Latencies kept per model
+HEDGE_WINDOW = 512
+# Unspent budget saved up for bursts of slow requests, in attempts
+HEDGE_MAX_BALANCE = 10.0
+
+HEDGE_REQUESTS = registry.counter(
+    "proxy_hedge_requests_total", "Hedging decisions for slow requests (sent, won, lost, no_budget)", ("model", "outcome"))
+
+Attempt = Callable[[int], Awaitable[Response]]
+
+
+class LatencyWindow:
+    """Latencies of the latest requests for one model, with a cached percentile"""
+
+    __slots__ = ("samples", "index", "count", "threshold", "_stale")
+
+    def __init__(self, size: int = HEDGE_WINDOW):
+        self.samples = array("d", bytes(8 * size))
+        self.index = 0
+        self.count = 0
+        self.threshold: Optional[float] = None
+        self._stale = 0
+
+    def add(self, latency: float) -> None:
+        self.samples[self.index] = latency
+        self.index = (self.index + 1) % len(self.samples)
+        self.count += 1
+        self._stale += 1
+
+    def percentile(self, pct: float, min_samples: int) -> Optional[float]:
+        """Return the pct percentile, recomputed every few samples"""
+        if self.count < min_samples:
+            return None
+        if self.threshold is None or self._stale >= 16:
+            n = min(self.count, len(self.samples))
+            ordered = sorted(self.samples[:n])
+            self.threshold = ordered[min(n - 1, int(n * pct / 100))]
+            self._stale = 0
+        return self.threshold
+
+
+class Hedger:
+    """Sends a second attempt for requests slower than the model's usual latency.
+
+    The delay before hedging is the HEDGE_PERCENTILE of recent latencies of
+    the model. Whichever attempt responds first wins and the other one is
+    cancelled. Each request adds budget_percent / 100 to a balance that every
+    hedge spends 1 from, which caps hedges at that share of traffic even
+    when an upstream is slow for everyone.
+    """
+
+    def __init__(self, percentile: float = 95, budget_percent: float = 5, min_delay: float = 0.05,
+                 min_samples: int = 20):
+        self.percentile = percentile
+        self.budget_rate = budget_percent / 100
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.balance = 0.0
+        self._latencies: Dict[str, LatencyWindow] = {}
+
+    def delay(self, model_id: str) -> Optional[float]:
+        """Seconds to wait before hedging, None until enough latencies are known"""
+        window = self._latencies.get(model_id)
+        threshold = window.percentile(self.percentile, self.min_samples) if window is not None else None
+        return max(threshold, self.min_delay) if threshold is not None else None
+
+    def observe(self, model_id: str, latency: float) -> None:
+        window = self._latencies.get(model_id)
+        if window is None:
+            window = self._latencies[model_id] = LatencyWindow()
+        window.add(latency)
+
+    async def _timed(self, model_id: str, attempt: Attempt, number: int) -> Response:
+        start = time.perf_counter()
+        response = await attempt(number)
+        if response.status_code < 500:
+            self.observe(model_id, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def _failed(task: asyncio.Task) -> bool:
+        return task.exception() is not None or task.result().status_code >= 500
+
+    async def run(self, model_id: str, attempt: Attempt) -> Response:
+        """Call attempt(1), and attempt(2) as well if the first one is slow
+
+        Returns:
+            The first successful response, or the first attempt's result if both fail
+        """
+        self.balance = min(self.balance + self.budget_rate, HEDGE_MAX_BALANCE)
+        first = asyncio.create_task(self._timed(model_id, attempt, 1))
+        delay = self.delay(model_id)
+        if delay is None:
+            return await first
+
+        try:
+            done, _ = await asyncio.wait((first,), timeout=delay)
+        except asyncio.CancelledError:
+            first.cancel()
+            raise
+        if done:
+            return first.result()
+        if self.balance < 1.0:
+            HEDGE_REQUESTS.inc(model_id, "no_budget")
+            return await first
+
+        self.balance -= 1.0
+        HEDGE_REQUESTS.inc(model_id, "sent")
+        logger.debug("Hedging %s request after %.3fs", model_id, delay)
+        second = asyncio.create_task(self._timed(model_id, attempt, 2))
+        pending = {first, second}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in (first, second) if t in done and not self._failed(t)), None)
+                if winner is None and pending:
+                    # The failed attempt doesn't win while the other one may still succeed
+                    continue
+                if winner is None:
+                    winner = first
+                HEDGE_REQUESTS.inc(model_id, "won" if winner is second else "lost")
+                return winner.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            for task in (first, second):
+                if task.done() and not task.cancelled():
+                    task.exception()
+
+    def collect(self) -> List[Gauge]:
+        balance = Gauge("proxy_hedge_budget_balance", "Hedges the budget currently allows")
+        balance.set(self.balance)
+        return [balance]
+
+
+def hedging_enabled(route_setting: Optional[bool]) -> bool:
+    """Per-route setting wins over HEDGE_ENABLED"""
+    return route_setting if route_setting is not None else HEDGE_ENABLED
+
+
+hedger = Hedger(HEDGE_PERCENTILE, HEDGE_BUDGET_PERCENT, HEDGE_MIN_DELAY_MS / 1000, HEDGE_MIN_SAMPLES)
+registry.add_collector(hedger.collect)
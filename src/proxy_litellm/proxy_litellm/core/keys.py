@@ -0,0 +1,321 @@
+"""API key validation with a TTL and LRU cache"""
+
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+
+import aiohttp
+import yaml
+from fastapi import HTTPException
+
+from ..models.key_models import KeysConfig
+from ..models.limit_models import LimitConfig
+from ..utils import json_codec
+from ..utils.metrics import registry, Gauge
+from .upstreams import split_urls
+
+logger = logging.getLogger(__name__)
+
+# off: any non-empty key is accepted; litellm: checked with LiteLLM /key/info; file: listed in API_KEYS_FILE
+API_KEY_VALIDATION = os.environ.get("API_KEY_VALIDATION", "off")
+API_KEYS_FILE = os.environ.get("API_KEYS_FILE", "api_keys.yaml")
+# Seconds between checks of API_KEYS_FILE for changes
+API_KEYS_FILE_CHECK_INTERVAL = float(os.environ.get("API_KEYS_FILE_CHECK_INTERVAL", "5"))
+# Defaults to /key/info on the first LITELLM_ENDPOINT
+API_KEY_INFO_URL = os.environ.get("API_KEY_INFO_URL") or next(
+    (url.rstrip("/") + "/key/info" for url in split_urls(os.environ.get("LITELLM_ENDPOINT", ""))), "")
+API_KEY_CACHE_SIZE = int(os.environ.get("API_KEY_CACHE_SIZE", "10000"))
+API_KEY_CACHE_TTL = float(os.environ.get("API_KEY_CACHE_TTL", "300"))
+API_KEY_NEGATIVE_TTL = float(os.environ.get("API_KEY_NEGATIVE_TTL", "30"))
+# Share of the TTL after which a key in use is looked up again in the background
+API_KEY_REFRESH_AHEAD = float(os.environ.get("API_KEY_REFRESH_AHEAD", "0.8"))
+API_KEY_LOOKUP_TIMEOUT = float(os.environ.get("API_KEY_LOOKUP_TIMEOUT", "2"))
+# Admit keys that can't be checked because LiteLLM is unreachable; LiteLLM still checks them itself
+API_KEY_FAIL_OPEN = os.environ.get("API_KEY_FAIL_OPEN", "true").lower() in ("1", "true", "yes")
+LITELLM_MASTER_KEY = os.environ.get("LITELLM_MASTER_KEY")
+
+# LiteLLM's marker for keys that may use every model
+_ALL_MODELS = "all-proxy-models"
+
+KEY_VALIDATIONS = registry.counter(
+    "proxy_key_validations_total", "API key checks by result (hit, negative_hit, valid, invalid, error)", ("result",))
+
+
+class KeyInfo:
+    """What is known about a valid API key: allowed models, limits and metadata"""
+
+    __slots__ = ("models", "limits", "metadata", "expires_at")
+
+    def __init__(self, models: Iterable[str] = (), limits: Optional[LimitConfig] = None,
+                 metadata: Optional[Dict[str, str]] = None, expires_at: Optional[float] = None):
+        models = frozenset(models)
+        self.models = models if models and _ALL_MODELS not in models else None
+        self.limits = limits
+        self.metadata = metadata or {}
+        # Unix time the key expires at, if it does
+        self.expires_at = expires_at
+
+    def allows(self, *model_ids: str) -> bool:
+        """True if the key may use any of the given model ids"""
+        return self.models is None or any(model_id in self.models for model_id in model_ids)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "models": sorted(self.models) if self.models is not None else None,
+            "limits": self.limits.model_dump(exclude_none=True) if self.limits is not None else None,
+            "metadata": self.metadata,
+            "expires_at": self.expires_at
+        }
+
+
+# Keys accepted without a check: validation is off, or LiteLLM could not be reached
+UNCHECKED = KeyInfo()
+
+
+class _InvalidKey(Exception):
+    """Raised by lookups for unknown, blocked or expired keys"""
+
+
+class _Entry:
+    __slots__ = ("info", "reason", "expires", "refresh_at")
+
+    def __init__(self, info: Optional[KeyInfo], reason: Optional[str], expires: float, refresh_at: float):
+        self.info = info
+        self.reason = reason
+        self.expires = expires
+        self.refresh_at = refresh_at
+
+
+class KeyValidator:
+    """Checks API keys against LiteLLM or a key file and caches the outcome.
+
+    Valid keys are cached for ttl seconds and invalid ones for negative_ttl,
+    in an LRU of max_entries keys, so repeated bad keys are rejected without
+    a lookup. A valid key used after refresh_ahead of its TTL is looked up
+    again in the background, so keys in steady use never wait for LiteLLM
+    and revocations take effect within the TTL. Concurrent lookups of the
+    same key share one request.
+    """
+
+    def __init__(self, mode: str = "off", info_url: str = "", keys_file: str = "",
+                 master_key: Optional[str] = None, max_entries: int = 10000, ttl: float = 300.0,
+                 negative_ttl: float = 30.0, refresh_ahead: float = 0.8, timeout: float = 2.0,
+                 fail_open: bool = True, keys_check_interval: float = 5.0):
+        if mode not in ("off", "litellm", "file"):
+            raise ValueError(f"Unknown API key validation mode: {mode}")
+        if mode == "litellm" and not info_url:
+            raise ValueError("API_KEY_VALIDATION=litellm requires LITELLM_ENDPOINT or API_KEY_INFO_URL")
+        self.mode = mode
+        self.enabled = mode != "off"
+        self.info_url = info_url
+        self.keys_file = keys_file
+        self.master_key = master_key
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_ahead = refresh_ahead
+        self.timeout = timeout
+        self.fail_open = fail_open
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._keys: Optional[KeysConfig] = None
+        self._keys_mtime: Optional[float] = None
+        self.keys_check_interval = keys_check_interval
+        self._keys_checked = 0.0
+
+    @classmethod
+    def from_env(cls) -> "KeyValidator":
+        return cls(
+            API_KEY_VALIDATION,
+            info_url=API_KEY_INFO_URL,
+            keys_file=API_KEYS_FILE,
+            master_key=LITELLM_MASTER_KEY,
+            max_entries=API_KEY_CACHE_SIZE,
+            ttl=API_KEY_CACHE_TTL,
+            negative_ttl=API_KEY_NEGATIVE_TTL,
+            refresh_ahead=API_KEY_REFRESH_AHEAD,
+            timeout=API_KEY_LOOKUP_TIMEOUT,
+            fail_open=API_KEY_FAIL_OPEN,
+            keys_check_interval=API_KEYS_FILE_CHECK_INTERVAL
+        )
+
+    async def start(self) -> None:
+        if self.mode == "litellm" and self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        elif self.mode == "file":
+            # Fail at startup rather than reject every key
+            self._keys_checked = time.monotonic()
+            await asyncio.to_thread(self._load_file)
+        if self.enabled:
+            logger.info("Validating API keys with %s", self.info_url if self.mode == "litellm" else self.keys_file)
+
+    async def close(self) -> None:
+        for task in list(self._pending.values()):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _load_file(self) -> KeysConfig:
+        """Return the keys file, reloaded when it changed; the last good copy is kept on errors"""
+        try:
+            mtime = os.stat(self.keys_file).st_mtime
+            if mtime != self._keys_mtime:
+                with open(self.keys_file) as f:
+                    self._keys = KeysConfig.model_validate(yaml.safe_load(f) or {})
+                self._keys_mtime = mtime
+                logger.info("Loaded %d API keys from %s", len(self._keys.keys), self.keys_file)
+        except Exception as e:
+            if self._keys is None:
+                raise
+            logger.error("Failed to reload API keys from %s, keeping the previous keys: %s", self.keys_file, e)
+        return self._keys
+
+    async def _file_keys(self) -> KeysConfig:
+        """The keys file, checked for changes every keys_check_interval seconds in a thread"""
+        now = time.monotonic()
+        if now - self._keys_checked < self.keys_check_interval:
+            return self._keys
+        self._keys_checked = now
+        return await asyncio.to_thread(self._load_file)
+
+    async def _fetch_file(self, api_key: str) -> KeyInfo:
+        keys = (await self._file_keys()).keys
+        config = keys.get(api_key)
+        if config is None:
+            config = keys.get("sha256:" + hashlib.sha256(api_key.encode()).hexdigest())
+        if config is None:
+            raise _InvalidKey("Invalid API key")
+        return KeyInfo(config.models, config.limits, config.metadata)
+
+    async def _fetch_litellm(self, api_key: str) -> KeyInfo:
+        # Without a master key, LiteLLM lets a key look up its own info
+        headers = {"Authorization": f"Bearer {self.master_key or api_key}"}
+        async with self._session.get(self.info_url, params={"key": api_key}, headers=headers) as response:
+            if response.status in (400, 401, 403, 404):
+                raise _InvalidKey("Invalid API key")
+            response.raise_for_status()
+            body = await response.json(loads=json_codec.loads)
+
+        info = body.get("info") or {}
+        if info.get("blocked"):
+            raise _InvalidKey("API key is blocked")
+        expires_at = None
+        if info.get("expires"):
+            expires = datetime.fromisoformat(info["expires"].replace("Z", "+00:00"))
+            if expires.tzinfo is None:
+                expires = expires.replace(tzinfo=timezone.utc)
+            expires_at = expires.timestamp()
+            if expires_at <= time.time():
+                raise _InvalidKey("API key has expired")
+
+        rpm, tpm = info.get("rpm_limit"), info.get("tpm_limit")
+        limits = None
+        if rpm or tpm:
+            # LiteLLM counts requests per minute, so a minute's worth may come at once
+            limits = LimitConfig(requests_per_second=rpm / 60 if rpm else None, burst=rpm or None,
+                                 tokens_per_minute=tpm or None)
+        metadata = {name: str(info[name]) for name in ("key_alias", "user_id", "team_id") if info.get(name)}
+        return KeyInfo(info.get("models") or (), limits, metadata, expires_at)
+
+    def _store(self, api_key: str, info: Optional[KeyInfo], reason: Optional[str]) -> _Entry:
+        now = time.monotonic()
+        if info is None:
+            entry = _Entry(None, reason, now + self.negative_ttl, now + self.negative_ttl)
+        else:
+            ttl = self.ttl
+            if info.expires_at is not None:
+                ttl = max(0.0, min(ttl, info.expires_at - time.time()))
+            entry = _Entry(info, None, now + ttl, now + ttl * self.refresh_ahead)
+        self._cache[api_key] = entry
+        self._cache.move_to_end(api_key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return entry
+
+    async def _load(self, api_key: str) -> Optional[_Entry]:
+        """Look up a key and cache the outcome; None if it could not be checked"""
+        try:
+            fetch = self._fetch_litellm if self.mode == "litellm" else self._fetch_file
+            try:
+                info = await fetch(api_key)
+            except _InvalidKey as e:
+                KEY_VALIDATIONS.inc("invalid")
+                return self._store(api_key, None, str(e))
+            except Exception as e:
+                KEY_VALIDATIONS.inc("error")
+                logger.warning("API key lookup failed: %s", e)
+                # Keep serving a cached key until it expires, without retrying on every request
+                entry = self._cache.get(api_key)
+                if entry is not None:
+                    entry.refresh_at = entry.expires
+                return None
+            KEY_VALIDATIONS.inc("valid")
+            return self._store(api_key, info, None)
+        finally:
+            del self._pending[api_key]
+
+    def _lookup(self, api_key: str) -> asyncio.Task:
+        task = self._pending.get(api_key)
+        if task is None:
+            task = self._pending[api_key] = asyncio.create_task(self._load(api_key))
+        return task
+
+    @staticmethod
+    def _reject(reason: str) -> HTTPException:
+        return HTTPException(status_code=401, detail=reason)
+
+    async def validate(self, api_key: str) -> KeyInfo:
+        """Return what is known about a key, or raise 401 if it is unknown, blocked or expired"""
+        if not self.enabled:
+            return UNCHECKED
+
+        now = time.monotonic()
+        entry = self._cache.get(api_key)
+        if entry is not None and entry.expires > now:
+            self._cache.move_to_end(api_key)
+            if entry.info is None:
+                KEY_VALIDATIONS.inc("negative_hit")
+                raise self._reject(entry.reason)
+            KEY_VALIDATIONS.inc("hit")
+            if now >= entry.refresh_at:
+                self._lookup(api_key)
+            return entry.info
+
+        # Shielded so a client disconnecting doesn't cancel a lookup others wait for
+        entry = await asyncio.shield(self._lookup(api_key))
+        if entry is None:
+            if self.fail_open:
+                return UNCHECKED
+            raise HTTPException(status_code=503, detail="API key could not be validated")
+        if entry.info is None:
+            raise self._reject(entry.reason)
+        return entry.info
+
+    def collect(self):
+        entries = Gauge("proxy_key_cache_entries", "API keys in the validation cache", ("valid",))
+        valid = sum(1 for entry in self._cache.values() if entry.info is not None)
+        entries.set(valid, "true")
+        entries.set(len(self._cache) - valid, "false")
+        return [entries]
+
+    def stats(self) -> Dict[str, Any]:
+        valid = sum(1 for entry in self._cache.values() if entry.info is not None)
+        return {
+            "mode": self.mode,
+            "cached_valid": valid,
+            "cached_invalid": len(self._cache) - valid,
+            "lookups_in_flight": len(self._pending),
+            "ttl": self.ttl,
+            "negative_ttl": self.negative_ttl
+        }
+
+
+key_validator = KeyValidator.from_env()
+registry.add_collector(key_validator.collect)
@@ -0,0 +1,255 @@
+"""Multi-process launcher.
+
+Starts WORKERS uvicorn processes that each bind their own listening socket
+to the same address with SO_REUSEPORT, so the kernel spreads connections
+over them. Workers are spawned rather than forked: the application and its
+singletons (handler, model catalog, log writer thread) are only created in
+the workers. Metrics are shared through shared memory, see
+utils.shared_metrics.
+
+The launcher replaces workers that exit, including ones that stop after
+WORKER_MAX_REQUESTS requests, and recycles workers older than
+WORKER_MAX_LIFETIME one at a time: the replacement is started and ready
+before the old worker is asked to stop and finishes its requests. SIGHUP
+recycles all workers this way; SIGTERM and SIGINT shut everything down.
+"""
+
+import os
+import math
+import time
+import random
+import signal
+import socket
+import logging
+import multiprocessing
+from typing import List, Optional
+
+import uvicorn
+
+from ..utils.shared_metrics import SharedMetrics
+
+logger = logging.getLogger(__name__)
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "8000"))
+# Number of worker processes, "auto" for one per available CPU, within the cgroup CPU quota
+WORKERS = os.environ.get("WORKERS", "1")
+# Restart a worker after about this many requests, 0 disables
+WORKER_MAX_REQUESTS = int(os.environ.get("WORKER_MAX_REQUESTS", "0"))
+# Recycle workers older than this many seconds, 0 disables
+WORKER_MAX_LIFETIME = float(os.environ.get("WORKER_MAX_LIFETIME", "0"))
+# Seconds a stopping worker gets to finish its requests and streams
+WORKER_GRACEFUL_TIMEOUT = float(os.environ.get("WORKER_GRACEFUL_TIMEOUT", "30"))
+# Seconds a new worker gets to start serving
+WORKER_STARTUP_TIMEOUT = float(os.environ.get("WORKER_STARTUP_TIMEOUT", "60"))
+METRICS_SLOT_SIZE = int(os.environ.get("METRICS_SLOT_SIZE", str(4 * 1024 * 1024)))
+LISTEN_BACKLOG = int(os.environ.get("LISTEN_BACKLOG", "2048"))
+
+
+def cpu_quota() -> Optional[int]:
+    """CPUs allowed by the cgroup (v2 or v1) CPU quota, None without a quota"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota == "max":
+            return None
+        return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+    except (OSError, ValueError):
+        return None
+    if quota <= 0 or period <= 0:
+        return None
+    return max(1, math.ceil(quota / period))
+
+
+def worker_count(value: str) -> int:
+    if value == "auto":
+        cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+        quota = cpu_quota()
+        return min(cpus, quota) if quota else cpus
+    return max(1, int(value))
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    """Listening socket sharing the port with the other workers"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(LISTEN_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(host: str, port: int, max_requests: int) -> None:
+    """Worker process entry point"""
+    sock = _bind(host, port)
+    # Imported here so the app is created in the worker, not the launcher
+    from .app import app
+
+    config = uvicorn.Config(
+        app,
+        log_config=None,
+        limit_max_requests=max_requests or None,
+        timeout_graceful_shutdown=WORKER_GRACEFUL_TIMEOUT
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class _Worker:
+    __slots__ = ("process", "slot", "started_at", "stop_deadline")
+
+    def __init__(self, process: multiprocessing.Process, slot: int):
+        self.process = process
+        self.slot = slot
+        self.started_at = time.monotonic()
+        self.stop_deadline: Optional[float] = None
+
+
+class Launcher:
+    """Keeps a set number of worker processes serving on a shared port"""
+
+    def __init__(self, host: str, port: int, workers: int):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.context = multiprocessing.get_context("spawn")
+        # Twice the workers, so replacements can start before old workers stop
+        self.metrics = SharedMetrics.create(workers * 2, METRICS_SLOT_SIZE)
+        self._running: List[_Worker] = []
+        self._stopping: List[_Worker] = []
+        self._shutdown = False
+        self._recycle_all = False
+
+    def _free_slot(self) -> Optional[int]:
+        used = {w.slot for w in self._running + self._stopping}
+        return next((slot for slot in range(self.metrics.retired_slot) if slot not in used), None)
+
+    def _spawn(self) -> Optional[_Worker]:
+        """Start a worker, None while every metrics slot is taken by running or stopping workers"""
+        slot = self._free_slot()
+        if slot is None:
+            logger.error("No free worker slot, %d workers running and %d stopping",
+                         len(self._running), len(self._stopping))
+            return None
+        # Spread restarts so workers don't all recycle at once
+        max_requests = WORKER_MAX_REQUESTS + random.randint(0, WORKER_MAX_REQUESTS // 10) if WORKER_MAX_REQUESTS else 0
+        # Spawned processes inherit the environment at start
+        os.environ["PROXY_METRICS_SHM"] = self.metrics.name
+        os.environ["PROXY_WORKER_SLOT"] = str(slot)
+        process = self.context.Process(target=_run_worker, args=(self.host, self.port, max_requests),
+                                       name=f"proxy-worker-{slot}")
+        process.start()
+        worker = _Worker(process, slot)
+        self._running.append(worker)
+        logger.info("Started worker %d (pid %d)", slot, process.pid)
+        return worker
+
+    def _wait_ready(self, worker: _Worker) -> bool:
+        """Wait until a new worker has started its app, seen from its first metrics publish"""
+        deadline = time.monotonic() + WORKER_STARTUP_TIMEOUT
+        while time.monotonic() < deadline and worker.process.is_alive():
+            if self.metrics.read(worker.slot):
+                return True
+            time.sleep(0.1)
+        return False
+
+    def _stop(self, worker: _Worker) -> None:
+        """Ask a worker to finish its requests and exit"""
+        self._running.remove(worker)
+        self._stopping.append(worker)
+        # uvicorn stops accepting on SIGTERM and waits for open requests
+        worker.stop_deadline = time.monotonic() + WORKER_GRACEFUL_TIMEOUT + 5
+        if worker.process.is_alive():
+            worker.process.terminate()
+
+    def _recycle(self, worker: _Worker) -> None:
+        logger.info("Recycling worker %d (pid %d)", worker.slot, worker.process.pid)
+        replacement = self._spawn()
+        if replacement is None:
+            return
+        if not self._wait_ready(replacement):
+            logger.error("Replacement for worker %d did not start, keeping the old worker", worker.slot)
+            return
+        self._stop(worker)
+
+    def _reap(self) -> None:
+        """Retire exited workers"""
+        for worker in list(self._running):
+            if not worker.process.is_alive():
+                self._running.remove(worker)
+                self.metrics.retire(worker.slot)
+                if worker.process.exitcode != 0:
+                    logger.warning("Worker %d (pid %d) exited with code %s",
+                                   worker.slot, worker.process.pid, worker.process.exitcode)
+
+        now = time.monotonic()
+        for worker in list(self._stopping):
+            if worker.process.is_alive() and now > worker.stop_deadline:
+                logger.warning("Worker %d (pid %d) did not stop in time, killing it", worker.slot, worker.process.pid)
+                worker.process.kill()
+            if not worker.process.is_alive():
+                worker.process.join()
+                self._stopping.remove(worker)
+                self.metrics.retire(worker.slot)
+
+    def _fill(self) -> None:
+        """Start workers until the set number is running, or wait for a slot to free up"""
+        while len(self._running) < self.workers and not self._shutdown:
+            if self._spawn() is None:
+                return
+
+    def _on_hup(self, signum, frame) -> None:
+        self._recycle_all = True
+
+    def _on_term(self, signum, frame) -> None:
+        self._shutdown = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGHUP, self._on_hup)
+        signal.signal(signal.SIGTERM, self._on_term)
+        signal.signal(signal.SIGINT, self._on_term)
+        logger.info("Starting %d workers on %s:%d", self.workers, self.host, self.port)
+        try:
+            self._fill()
+            while not self._shutdown:
+                time.sleep(0.5)
+                self._reap()
+                # Replaces workers that exited on their own
+                self._fill()
+                if self._recycle_all:
+                    self._recycle_all = False
+                    for worker in list(self._running):
+                        if not self._shutdown:
+                            self._recycle(worker)
+                elif WORKER_MAX_LIFETIME:
+                    now = time.monotonic()
+                    for worker in list(self._running):
+                        if now - worker.started_at > WORKER_MAX_LIFETIME and not self._shutdown:
+                            self._recycle(worker)
+        finally:
+            logger.info("Stopping workers")
+            for worker in list(self._running):
+                self._stop(worker)
+            while self._stopping:
+                time.sleep(0.1)
+                self._reap()
+            self.metrics.close()
+
+
+def main() -> None:
+    workers = worker_count(WORKERS)
+    if workers == 1:
+        from .app import app
+        # Logging is already configured by setup_logging() when the app is imported
+        uvicorn.run(app, host=HOST, port=PORT, log_config=None)
+        return
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    Launcher(HOST, PORT, workers).run()
@@ -0,0 +1,57 @@
+import time
+
+from fastapi.responses import JSONResponse
+
+from .overload import LoadShedder
+
+_CONVERSE_PATHS = ("/converse", "/converse-stream")
+
+
+class RequestArrivalMiddleware:
+    """Stamps each HTTP request with its arrival time.
+
+    The stamp is read from request.state.arrival so that body parsing and
+    validation before the route handler runs are counted in the request
+    timing. Implemented as plain ASGI to keep streaming responses untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["arrival"] = time.perf_counter()
+        await self.app(scope, receive, send)
+
+
+class LoadSheddingMiddleware:
+    """Rejects new converse requests with 503 while the worker is overloaded.
+
+    Counts converse requests in flight until their response, including a
+    whole stream, has been sent. Requests already running are never
+    interrupted, and other endpoints such as /health are always served.
+    """
+
+    def __init__(self, app, shedder: LoadShedder):
+        self.app = app
+        self.shedder = shedder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].endswith(_CONVERSE_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        shedder = self.shedder
+        reason = shedder.shed_reason()
+        if reason is not None:
+            shedder.record_shed(reason)
+            response = JSONResponse({"detail": f"Service overloaded ({reason})"}, status_code=503,
+                                    headers={"Retry-After": "1"})
+            await response(scope, receive, send)
+            return
+
+        shedder.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            shedder.in_flight -= 1
@@ -0,0 +1,114 @@
+"""Event loop lag monitoring and load shedding"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from ..utils.metrics import registry, Gauge, GAP_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+# Shed new converse requests while the smoothed event loop lag is above this, 0 disables
+SHED_LOOP_LAG_MS = float(os.environ.get("SHED_LOOP_LAG_MS", "0"))
+# Shed new converse requests while this many are in flight (streams included), 0 disables
+SHED_MAX_IN_FLIGHT = int(os.environ.get("SHED_MAX_IN_FLIGHT", "0"))
+LOOP_LAG_INTERVAL_MS = float(os.environ.get("LOOP_LAG_INTERVAL_MS", "100"))
+# Weight of the newest sample in the smoothed lag
+LAG_SMOOTHING = 0.3
+
+LOOP_LAG = registry.histogram(
+    "proxy_event_loop_lag_seconds", "Delay of the event loop in running a scheduled wakeup", (), GAP_BUCKETS)
+SHED_REQUESTS = registry.counter(
+    "proxy_shed_requests_total", "Converse requests rejected with 503 because the worker is overloaded", ("reason",))
+
+
+class LoopLagMonitor:
+    """Measures event loop lag by timing how late a periodic sleep wakes up.
+
+    A background task sleeps for interval seconds; anything beyond that is
+    time the loop was busy with other callbacks. The lag is kept both as the
+    latest sample and as an exponentially weighted average, so a single slow
+    callback does not trigger shedding on its own.
+    """
+
+    def __init__(self, interval: float = 0.1, smoothing: float = LAG_SMOOTHING):
+        self.interval = interval
+        self.smoothing = smoothing
+        self.lag = 0.0
+        self.smoothed = 0.0
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.lag = lag
+            self.smoothed += self.smoothing * (lag - self.smoothed)
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG.observe(lag)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class LoadShedder:
+    """Decides whether a new converse request is admitted or shed with 503.
+
+    Only requests that have not started are shed; running requests and
+    streams are counted in in_flight until their response is complete.
+    """
+
+    def __init__(self, monitor: LoopLagMonitor, max_lag: float = 0.5, max_in_flight: int = 0):
+        self.monitor = monitor
+        self.max_lag = max_lag
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.shed = 0
+
+    def shed_reason(self) -> Optional[str]:
+        """Return why a new request should be shed, None to admit it"""
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return "in_flight"
+        if self.max_lag and self.monitor.smoothed > self.max_lag:
+            return "loop_lag"
+        return None
+
+    def record_shed(self, reason: str) -> None:
+        self.shed += 1
+        SHED_REQUESTS.inc(reason)
+
+    def collect(self) -> List[Gauge]:
+        in_flight = Gauge("proxy_in_flight_requests", "Converse requests currently being served, streams included")
+        in_flight.set(self.in_flight)
+        lag = Gauge("proxy_event_loop_lag_smoothed_seconds", "Smoothed event loop lag used for load shedding", aggregate="max")
+        lag.set(self.monitor.smoothed)
+        return [in_flight, lag]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "overloaded": self.shed_reason() is not None,
+            "loop_lag_ms": round(self.monitor.lag * 1000, 3),
+            "loop_lag_smoothed_ms": round(self.monitor.smoothed * 1000, 3),
+            "loop_lag_max_ms": round(self.monitor.max_lag * 1000, 3),
+            "in_flight": self.in_flight,
+            "shed": self.shed
+        }
+
+
+loop_monitor = LoopLagMonitor(LOOP_LAG_INTERVAL_MS / 1000)
+load_shedder = LoadShedder(loop_monitor, SHED_LOOP_LAG_MS / 1000, SHED_MAX_IN_FLIGHT)
+registry.add_collector(load_shedder.collect)
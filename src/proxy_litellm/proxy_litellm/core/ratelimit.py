@@ -0,0 +1,312 @@
+"""Per API key and per model admission control"""
+
+import os
+import math
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import yaml
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+from ..models.limit_models import LimitConfig, RateLimitsConfig
+from ..utils.metrics import registry, Gauge, GAP_BUCKETS
+from ..utils.responses import ClosingStreamingResponse
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITS_FILE = os.environ.get("RATE_LIMITS_FILE", "rate_limits.yaml")
+# Key scopes beyond this many are dropped when idle, since keys come from request headers
+MAX_KEY_SCOPES = 10000
+
+RATE_LIMITED = registry.counter(
+    "proxy_rate_limited_total", "Requests rejected with 429 by scope (key, model) and limit", ("scope", "limit"))
+ADMISSION_WAIT = registry.histogram(
+    "proxy_admission_wait_seconds", "Time admitted requests waited for capacity", (), GAP_BUCKETS)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate tokens per second up to capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount tokens are available, 0 if they are now"""
+        self._refill(now)
+        # Requests larger than the bucket only need a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def resize(self, rate: float, capacity: float) -> None:
+        """Change the limits, keeping the tokens spent so far"""
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+
+class _Scope:
+    """Buckets and stream counter of one API key or model"""
+
+    __slots__ = ("name", "config", "requests", "tokens", "max_streams", "streams", "released")
+
+    def __init__(self, name: str, config: LimitConfig):
+        self.name = name
+        self.requests: Optional[TokenBucket] = None
+        self.tokens: Optional[TokenBucket] = None
+        self.streams = 0
+        self.released = asyncio.Event()
+        self.configure(config)
+
+    @staticmethod
+    def _bucket(bucket: Optional[TokenBucket], rate: float, capacity: float) -> TokenBucket:
+        if bucket is None:
+            return TokenBucket(rate, capacity)
+        bucket.resize(rate, capacity)
+        return bucket
+
+    def configure(self, config: LimitConfig) -> None:
+        """Apply limits; streams admitted under earlier limits stay counted"""
+        self.config = config
+        rps = config.requests_per_second
+        self.requests = self._bucket(self.requests, rps, config.burst or max(rps, 1.0)) if rps else None
+        tpm = config.tokens_per_minute
+        self.tokens = self._bucket(self.tokens, tpm / 60, tpm) if tpm else None
+        self.max_streams = config.max_concurrent_streams
+
+    @property
+    def idle(self) -> bool:
+        return self.streams == 0
+
+    def check(self, tokens: int, stream: bool, now: float) -> Tuple[float, Optional[str]]:
+        """Return how long to wait for capacity and the limit that is exhausted"""
+        wait, limit = 0.0, None
+        if stream and self.max_streams is not None and self.streams >= self.max_streams:
+            # Unknown until a stream ends; waiters are woken on release
+            wait, limit = math.inf, "streams"
+        if self.requests is not None:
+            requests_wait = self.requests.wait_time(1, now)
+            if requests_wait > wait:
+                wait, limit = requests_wait, "requests"
+        if self.tokens is not None:
+            tokens_wait = self.tokens.wait_time(tokens, now)
+            if tokens_wait > wait:
+                wait, limit = tokens_wait, "tokens"
+        return wait, limit
+
+    def take(self, tokens: int, stream: bool) -> None:
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+        if stream:
+            self.streams += 1
+
+    def release(self) -> None:
+        self.streams -= 1
+        event, self.released = self.released, asyncio.Event()
+        event.set()
+
+
+class Permit:
+    """Admission of one request; releases its stream slots when done"""
+
+    __slots__ = ("scopes", "released")
+
+    def __init__(self, scopes: List[_Scope]):
+        self.scopes = scopes
+        self.released = False
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        for scope in self.scopes:
+            scope.release()
+
+    async def _release_after(self, iterator: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            self.release()
+
+    def attach(self, response: Response) -> Response:
+        """Hold the permit until a streaming response has been relayed or abandoned"""
+        if isinstance(response, ClosingStreamingResponse) and self.scopes:
+            # Released even if the client disconnects before the stream starts
+            response.call_on_close(self.release)
+        elif isinstance(response, StreamingResponse) and self.scopes:
+            response.body_iterator = self._release_after(response.body_iterator)
+        else:
+            self.release()
+        return response
+
+
+_NO_LIMITS = Permit([])
+
+
+class RateLimiter:
+    """Token bucket and concurrency limits per API key and per model.
+
+    A request is admitted once every scope it belongs to has capacity. If it
+    would have to wait longer than max_wait_ms, or the wait queue is full, it
+    is rejected right away with 429 and a Retry-After header.
+    """
+
+    def __init__(self, config: Optional[RateLimitsConfig] = None):
+        self.config = config if config is not None else RateLimitsConfig()
+        self.enabled = bool(self.config.default_key or self.config.keys or self.config.models)
+        self.waiting = 0
+        self._key_configs: Dict[str, Optional[LimitConfig]] = {}
+        self._key_scopes: Dict[str, _Scope] = {}
+        self._model_scopes: Dict[str, Optional[_Scope]] = {}
+
+    @classmethod
+    def from_file(cls, path: str) -> "RateLimiter":
+        config = None
+        if path and os.path.exists(path):
+            with open(path) as f:
+                config = RateLimitsConfig.model_validate(yaml.safe_load(f) or {})
+            logger.info("Loaded rate limits from %s: %d keys, %d models", path, len(config.keys), len(config.models))
+        return cls(config)
+
+    def _configured_limits(self, api_key: str) -> Optional[LimitConfig]:
+        """The key's own entry in the rate limits file, by key or sha256 digest"""
+        if api_key not in self._key_configs:
+            config = self.config.keys.get(api_key)
+            if config is None:
+                config = self.config.keys.get("sha256:" + hashlib.sha256(api_key.encode()).hexdigest())
+            if len(self._key_configs) >= MAX_KEY_SCOPES:
+                self._key_configs.clear()
+            self._key_configs[api_key] = config
+        return self._key_configs[api_key]
+
+    def _key_scope(self, api_key: str, key_limits: Optional[LimitConfig] = None) -> Optional[_Scope]:
+        # The rate limits file wins over limits that come with the key from validation
+        config = self._configured_limits(api_key) or key_limits or self.config.default_key
+        if config is None:
+            return None
+        scope = self._key_scopes.get(api_key)
+        if scope is None:
+            if len(self._key_scopes) >= MAX_KEY_SCOPES:
+                self._key_scopes = {k: s for k, s in self._key_scopes.items() if not s.idle}
+            scope = self._key_scopes[api_key] = _Scope("key", config)
+        elif scope.config is not config and scope.config != config:
+            # Limits changed when the key was refreshed
+            scope.configure(config)
+        return scope
+
+    def _model_scope(self, model_id: str) -> Optional[_Scope]:
+        if model_id not in self._model_scopes:
+            config = self.config.models.get(model_id)
+            self._model_scopes[model_id] = _Scope("model", config) if config is not None else None
+        return self._model_scopes[model_id]
+
+    def estimate_tokens(self, request: Dict[str, Any]) -> int:
+        """Tokens charged against tokens_per_minute for a request"""
+        max_tokens = (request.get("inferenceConfig") or {}).get("maxTokens")
+        return max_tokens if max_tokens else self.config.default_max_tokens
+
+    def _reject(self, scope: _Scope, limit: str, wait: float) -> None:
+        RATE_LIMITED.inc(scope.name, limit)
+        retry_after = 1 if math.isinf(wait) else max(1, math.ceil(wait))
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded for {scope.name} ({limit})",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    async def acquire(self, api_key: str, model_id: str, request: Dict[str, Any], stream: bool,
+                      key_limits: Optional[LimitConfig] = None) -> Permit:
+        """Wait for capacity in the key and model scopes, or raise 429
+
+        key_limits are the key's limits from API key validation, used when
+        the rate limits file has no entry for the key.
+        """
+        if not self.enabled and key_limits is None:
+            return _NO_LIMITS
+
+        scopes = [s for s in (self._key_scope(api_key, key_limits), self._model_scope(model_id)) if s is not None]
+        if not scopes:
+            return _NO_LIMITS
+        tokens = self.estimate_tokens(request)
+        start = time.monotonic()
+        deadline = start + self.config.max_wait_ms / 1000
+        queued = False
+
+        try:
+            while True:
+                now = time.monotonic()
+                wait, blocking, limit = 0.0, None, None
+                for scope in scopes:
+                    scope_wait, scope_limit = scope.check(tokens, stream, now)
+                    if scope_wait > wait:
+                        wait, blocking, limit = scope_wait, scope, scope_limit
+
+                if blocking is None:
+                    # Take from all scopes only once all of them have capacity
+                    for scope in scopes:
+                        scope.take(tokens, stream)
+                    if queued:
+                        ADMISSION_WAIT.observe(now - start)
+                    return Permit(scopes if stream else [])
+
+                # Stream slots free up at an unknown time, so those waits last until the deadline
+                if now + wait > deadline and not (math.isinf(wait) and now < deadline):
+                    self._reject(blocking, limit, wait)
+                if not queued:
+                    if self.waiting >= self.config.queue_size:
+                        self._reject(blocking, "queue", wait)
+                    queued = True
+                    self.waiting += 1
+
+                if math.isinf(wait):
+                    try:
+                        await asyncio.wait_for(blocking.released.wait(), deadline - now)
+                    except asyncio.TimeoutError:
+                        self._reject(blocking, limit, wait)
+                else:
+                    await asyncio.sleep(wait)
+        finally:
+            if queued:
+                self.waiting -= 1
+
+    def collect(self) -> List[Gauge]:
+        waiting = Gauge("proxy_admission_waiting", "Requests waiting for rate limit capacity")
+        waiting.set(self.waiting)
+        streams = Gauge("proxy_rate_limited_model_streams", "Admitted streams per rate limited model", ("model",))
+        for model_id, scope in self._model_scopes.items():
+            if scope is not None and scope.max_streams is not None:
+                streams.set(scope.streams, model_id)
+        return [waiting, streams]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "waiting": self.waiting,
+            "key_scopes": len(self._key_scopes),
+            "model_scopes": sum(1 for s in self._model_scopes.values() if s is not None)
+        }
+
+
+rate_limiter = RateLimiter.from_file(RATE_LIMITS_FILE)
+registry.add_collector(rate_limiter.collect)
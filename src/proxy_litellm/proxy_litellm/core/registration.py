@@ -0,0 +1,244 @@
+"""Key registration for AWS access keys, backed by a local key store"""
+
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from ..utils import json_codec
+from ..utils.metrics import registry
+from .keys import key_validator
+from .upstreams import split_urls
+
+logger = logging.getLogger(__name__)
+
+# SQLite file mapping AWS access keys to their generated keys, shared by all workers
+REGISTER_DB = os.environ.get("REGISTER_DB", "registrations.db")
+REGISTER_TIMEOUT = float(os.environ.get("REGISTER_TIMEOUT", "10"))
+# Registrations kept in memory per worker
+REGISTER_CACHE_SIZE = int(os.environ.get("REGISTER_CACHE_SIZE", "10000"))
+
+REGISTRATIONS = registry.counter(
+    "proxy_registrations_total", "Registrations by result (stored, generated, shared, expired, unverified)", ("result",))
+
+
+class KeyStore:
+    """SQLite table of access key to the LiteLLM key generation response.
+
+    The latest rows read are cached in memory. The database is in WAL mode
+    so several worker processes can use the same file; calls are made from
+    a thread so disk writes don't block the event loop.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._rows: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def open(self) -> None:
+        created = not os.path.exists(self.path)
+        self._db = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        if created:
+            # The file holds API keys
+            os.chmod(self.path, 0o600)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS registrations ("
+            "access_key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)")
+        count = self._db.execute("SELECT COUNT(*) FROM registrations").fetchone()[0]
+        logger.info("Opened key store %s with %d registrations", self.path, count)
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _get(self, access_key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response FROM registrations WHERE access_key = ?", (access_key,)).fetchone()
+        return json_codec.loads(row[0]) if row is not None else None
+
+    def _put(self, access_key: str, response: Dict[str, Any], replaces: Optional[str]) -> Dict[str, Any]:
+        data = json_codec.dumps(response).decode()
+        with self._lock:
+            # Another worker may have registered or replaced the key meanwhile; its key wins
+            if replaces is not None:
+                self._db.execute(
+                    "UPDATE registrations SET response = ?, created_at = ? "
+                    "WHERE access_key = ? AND json_extract(response, '$.key') = ?",
+                    (data, time.time(), access_key, replaces))
+            else:
+                self._db.execute("INSERT OR IGNORE INTO registrations VALUES (?, ?, ?)",
+                                 (access_key, data, time.time()))
+            row = self._db.execute(
+                "SELECT response FROM registrations WHERE access_key = ?", (access_key,)).fetchone()
+        return json_codec.loads(row[0])
+
+    def _cache(self, access_key: str, response: Dict[str, Any]) -> None:
+        self._rows[access_key] = response
+        self._rows.move_to_end(access_key)
+        while len(self._rows) > self.max_entries:
+            self._rows.popitem(last=False)
+
+    async def get(self, access_key: str, cached: bool = True) -> Optional[Dict[str, Any]]:
+        """Return the registration of an access key, from memory unless cached is False"""
+        response = self._rows.get(access_key) if cached else None
+        if response is not None:
+            self._rows.move_to_end(access_key)
+            return response
+        response = await asyncio.to_thread(self._get, access_key)
+        if response is not None:
+            self._cache(access_key, response)
+        return response
+
+    async def put(self, access_key: str, response: Dict[str, Any], replaces: Optional[str] = None) -> Dict[str, Any]:
+        """Store a registration, replacing the one with key replaces, and return the one that is kept"""
+        response = await asyncio.to_thread(self._put, access_key, response, replaces)
+        self._cache(access_key, response)
+        return response
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+def _expired(response: Dict[str, Any]) -> bool:
+    expires = response.get("expires")
+    if not expires:
+        return False
+    try:
+        expires_at = datetime.fromisoformat(expires.replace("Z", "+00:00"))
+    except ValueError:
+        return False
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at <= datetime.now(timezone.utc)
+
+
+class Registrar:
+    """Hands out one LiteLLM key per AWS access key.
+
+    The first registration of an access key generates a key with LiteLLM
+    and stores it; later ones made with the master key return the stored
+    key, so hosts that register on every start don't create new keys.
+    Stored keys that expired, or that API key validation rejects, are
+    replaced. Concurrent registrations of the same access key share one
+    call. Other callers only ever get a newly generated key that is not
+    stored: the access key in a request is not proof of owning it.
+    """
+
+    def __init__(self, store: KeyStore, timeout: float = 10.0):
+        self.store = store
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+            await asyncio.to_thread(self.store.open)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self.store.close()
+
+    async def _usable(self, response: Dict[str, Any]) -> bool:
+        if _expired(response):
+            return False
+        if key_validator.enabled:
+            try:
+                await key_validator.validate(response["key"])
+            except HTTPException as e:
+                return e.status_code != 401
+        return True
+
+    async def _generate(self, access_key: str) -> Dict[str, Any]:
+        litellm_endpoint = os.getenv("LITELLM_ENDPOINT")
+        litellm_master_key = os.getenv("LITELLM_MASTER_KEY")
+        if not litellm_endpoint or not litellm_master_key:
+            raise HTTPException(
+                status_code=500,
+                detail="LiteLLM configuration is not properly set"
+            )
+
+        try:
+            # Key management goes to the first LiteLLM instance of a list
+            response = await self._client.post(
+                f"{split_urls(litellm_endpoint)[0]}/key/generate",
+                headers={
+                    "Authorization": f"Bearer {litellm_master_key}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "user_id": access_key
+                }
+            )
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to generate key: {str(e)}"
+            )
+
+    async def _register(self, access_key: str) -> Dict[str, Any]:
+        try:
+            stored = await self.store.get(access_key)
+            usable = stored is not None and await self._usable(stored)
+            if stored is not None and not usable:
+                # Another worker may have replaced the key already
+                latest = await self.store.get(access_key, cached=False)
+                if latest["key"] != stored["key"]:
+                    stored = latest
+                    usable = await self._usable(stored)
+            if usable:
+                REGISTRATIONS.inc("stored")
+                return stored
+            if stored is not None:
+                REGISTRATIONS.inc("expired")
+                logger.info("Replacing the expired or revoked key of a registered access key")
+            response = await self._generate(access_key)
+            REGISTRATIONS.inc("generated")
+            return await self.store.put(access_key, response, replaces=stored["key"] if stored is not None else None)
+        finally:
+            del self._pending[access_key]
+
+    async def register(self, access_key: str, reuse: bool) -> Dict[str, Any]:
+        """Return a key for an access key.
+
+        With reuse, the key registered for the access key, generated if
+        needed; otherwise a new key that is not stored.
+        """
+        if not reuse:
+            response = await self._generate(access_key)
+            REGISTRATIONS.inc("unverified")
+            return response
+        task = self._pending.get(access_key)
+        if task is None:
+            task = self._pending[access_key] = asyncio.create_task(self._register(access_key))
+        else:
+            REGISTRATIONS.inc("shared")
+        # Shielded so a client disconnecting doesn't cancel a registration others wait for
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "store": self.store.path,
+            "cached": len(self.store),
+            "in_flight": len(self._pending)
+        }
+
+
+registrar = Registrar(KeyStore(REGISTER_DB, REGISTER_CACHE_SIZE), REGISTER_TIMEOUT)
@@ -0,0 +1,203 @@
+"""Model routing table"""
+
+import os
+import re
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+from ..models.route_models import RouteConfig, RoutingConfig
+from ..api.model_utils import MODEL_PARAM_MAPPINGS
+from ..utils.bedrock import ModelCatalog, model_catalog
+
+logger = logging.getLogger(__name__)
+
+MODEL_ROUTES_FILE = os.environ.get("MODEL_ROUTES_FILE", "model_routes.yaml")
+ROUTE_CACHE_SIZE = int(os.environ.get("ROUTE_CACHE_SIZE", "4096"))
+
+
+class Route:
+    """Where a model id is sent: handler, upstream and the model id used upstream"""
+
+    __slots__ = ("handler", "upstream", "model_id", "param_mapping", "singleflight", "hedge", "source")
+
+    def __init__(self, handler: str, model_id: str, upstream: Optional[str] = None,
+                 param_mapping: Optional[Dict[str, str]] = None, singleflight: Optional[bool] = None,
+                 hedge: Optional[bool] = None, source: str = "default"):
+        self.handler = handler
+        self.model_id = model_id
+        self.upstream = upstream
+        self.param_mapping = param_mapping
+        self.singleflight = singleflight
+        self.hedge = hedge
+        self.source = source
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "handler": self.handler,
+            "model_id": self.model_id,
+            "upstream": self.upstream,
+            "param_mapping": self.param_mapping,
+            "singleflight": self.singleflight,
+            "hedge": self.hedge,
+            "source": self.source
+        }
+
+
+class _CompiledRoute:
+    __slots__ = ("config", "param_mapping", "source")
+
+    def __init__(self, config: RouteConfig, index: int):
+        self.config = config
+        mapping = config.param_mapping
+        if isinstance(mapping, str):
+            if mapping not in MODEL_PARAM_MAPPINGS:
+                raise ValueError(f"Unknown param_mapping {mapping!r} in route {index}")
+            mapping = MODEL_PARAM_MAPPINGS[mapping]
+        self.param_mapping = mapping
+        kind = "model" if config.model is not None or config.aliases else "prefix" if config.prefix is not None else "regex"
+        self.source = f"{kind}:{index}"
+
+    def route(self, model_id: str, matched_prefix: str = "") -> Route:
+        config = self.config
+        target = config.target_model
+        if target is None:
+            target = (model_id[len(matched_prefix):] if config.strip_prefix else None) or model_id
+        return Route(config.handler, target, config.upstream, self.param_mapping, config.singleflight,
+                     config.hedge, self.source)
+
+
+class ModelRouter:
+    """Resolves model ids to routes.
+
+    The routing table is compiled once: exact ids and aliases go into a dict,
+    prefixes into a character trie (longest prefix wins) and runs of regexes
+    into one alternation whose matching group names the route. Regexes with
+    groups or inline flags would mean something else inside the alternation,
+    so they are matched on their own, in table order. Resolution order is
+    exact, prefix, regex, then the Bedrock model catalog and finally the
+    default handler. Resolved routes are cached per model id; the cache is
+    dropped whenever the catalog changes.
+    """
+
+    def __init__(self, config: Optional[RoutingConfig] = None, catalog: Optional[ModelCatalog] = None,
+                 cache_size: int = 4096):
+        self.catalog = catalog
+        self.cache_size = cache_size
+        self._cache: Dict[str, Route] = {}
+        self._cache_version = -1
+        self.compile(config or RoutingConfig())
+
+    @classmethod
+    def from_file(cls, path: str, catalog: Optional[ModelCatalog] = None, cache_size: int = 4096) -> "ModelRouter":
+        """Load the routing table from YAML; a missing file gives catalog-only routing"""
+        config = None
+        if path and os.path.exists(path):
+            with open(path) as f:
+                config = RoutingConfig.model_validate(yaml.safe_load(f) or {})
+            logger.info("Loaded %d model routes from %s", len(config.routes), path)
+        return cls(config, catalog, cache_size)
+
+    def compile(self, config: RoutingConfig) -> None:
+        """Build the lookup structures for a routing table"""
+        exact: Dict[str, _CompiledRoute] = {}
+        trie: Dict[str, Any] = {}
+        patterns: List[str] = []
+        regex_routes: Dict[str, _CompiledRoute] = {}
+        # Alternations of simple regexes and standalone regexes, in table order
+        regexes: List[Tuple[re.Pattern, Optional[_CompiledRoute]]] = []
+
+        for index, route_config in enumerate(config.routes):
+            compiled = _CompiledRoute(route_config, index)
+            if route_config.prefix is not None:
+                node = trie
+                for char in route_config.prefix:
+                    node = node.setdefault(char, {})
+                # First configured route wins for duplicate prefixes
+                node.setdefault(None, compiled)
+            elif route_config.regex is not None:
+                pattern = re.compile(route_config.regex)
+                if pattern.groups or pattern.flags & ~re.UNICODE:
+                    if patterns:
+                        regexes.append((re.compile("|".join(patterns)), None))
+                        patterns = []
+                    regexes.append((pattern, compiled))
+                else:
+                    name = f"r{index}"
+                    patterns.append(f"(?P<{name}>{route_config.regex})")
+                    regex_routes[name] = compiled
+            for model_id in ([route_config.model] if route_config.model is not None else []) + route_config.aliases:
+                exact.setdefault(model_id, compiled)
+
+        if patterns:
+            regexes.append((re.compile("|".join(patterns)), None))
+
+        self.config = config
+        self._exact = exact
+        self._trie = trie
+        self._regexes = regexes
+        self._regex_routes = regex_routes
+        self._cache.clear()
+
+    def _match_prefix(self, model_id: str) -> Optional[Tuple[_CompiledRoute, int]]:
+        node = self._trie
+        match = node.get(None)
+        length = 0
+        for depth, char in enumerate(model_id, 1):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                match = node[None]
+                length = depth
+        return (match, length) if match is not None else None
+
+    def _resolve(self, model_id: str) -> Route:
+        compiled = self._exact.get(model_id)
+        if compiled is not None:
+            return compiled.route(model_id)
+
+        prefix_match = self._match_prefix(model_id)
+        if prefix_match is not None:
+            compiled, length = prefix_match
+            return compiled.route(model_id, model_id[:length])
+
+        for regex, compiled in self._regexes:
+            m = regex.fullmatch(model_id)
+            if m is not None:
+                if compiled is None:
+                    compiled = self._regex_routes[m.lastgroup]
+                return compiled.route(model_id)
+
+        if self.config.catalog_fallback and self.catalog is not None and model_id in self.catalog:
+            return Route("bedrock", model_id, source="catalog")
+        return Route(self.config.default_handler, model_id)
+
+    def resolve(self, model_id: str) -> Route:
+        """Return the route for a model id"""
+        if self.catalog is not None and self.catalog.version != self._cache_version:
+            self._cache.clear()
+            self._cache_version = self.catalog.version
+
+        route = self._cache.get(model_id)
+        if route is None:
+            route = self._resolve(model_id)
+            if len(self._cache) >= self.cache_size:
+                # Model ids come from the request path, so don't let the cache grow unbounded
+                self._cache.clear()
+            self._cache[model_id] = route
+        return route
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "routes": len(self.config.routes),
+            "exact": len(self._exact),
+            "regexes": sum(1 for route in self.config.routes if route.regex is not None),
+            "cached": len(self._cache),
+            "catalog_fallback": self.config.catalog_fallback,
+            "default_handler": self.config.default_handler
+        }
+
+
+model_router = ModelRouter.from_file(MODEL_ROUTES_FILE, model_catalog, ROUTE_CACHE_SIZE)
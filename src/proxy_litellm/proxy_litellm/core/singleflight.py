@@ -0,0 +1,171 @@
+"""Coalescing of identical in-flight converse requests"""
+
+import os
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi.responses import Response, StreamingResponse
+
+from ..utils.metrics import registry, Gauge
+from ..utils.responses import ClosingStreamingResponse
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_ENABLED = os.environ.get("SINGLEFLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+SINGLEFLIGHT_REQUESTS = registry.counter(
+    "proxy_singleflight_requests_total", "Coalesced requests by role (leader sends upstream, follower shares)", ("role",))
+
+# Headers set per response that must not be copied to other callers
+_SKIPPED_HEADERS = frozenset((b"content-length", b"server-timing", b"x-cache"))
+
+
+class _Flight:
+    """One upstream call shared by all identical requests that arrive while it runs"""
+
+    __slots__ = ("task", "response", "chunks", "finished", "error", "event", "pump", "subscribers")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.response: Optional[Response] = None
+        self.chunks: List[bytes] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.event = asyncio.Event()
+        self.pump: Optional[asyncio.Task] = None
+        self.subscribers = 0
+
+    def _headers(self) -> List[Tuple[bytes, bytes]]:
+        return [(k, v) for k, v in self.response.raw_headers if k not in _SKIPPED_HEADERS]
+
+    def _notify(self) -> None:
+        event, self.event = self.event, asyncio.Event()
+        event.set()
+
+    async def _subscribe(self) -> AsyncIterator[bytes]:
+        """Yield every frame from the start of the stream, then follow it live"""
+        index = 0
+        while True:
+            if index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            elif self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self.event.wait()
+
+    def response_for(self, leader: bool) -> Response:
+        """Build the response handed to one caller"""
+        response = self.response
+        if self.pump is not None:
+            subscriber = ClosingStreamingResponse(self._subscribe(), status_code=response.status_code)
+            subscriber.raw_headers.extend(self._headers())
+            return subscriber
+        if leader or response is None:
+            return response
+        copy = Response(content=response.body, status_code=response.status_code)
+        copy.raw_headers.extend(self._headers())
+        return copy
+
+
+class SingleFlight:
+    """Runs one upstream call per key and shares its result.
+
+    Non-streaming callers receive copies of the same response. For streams
+    the upstream body is read by a background task into a frame list that
+    every caller, including ones that join after frames were produced, reads
+    from the beginning. A key is in flight until the response (or for
+    streams, the last frame) has been received. When every caller of a
+    stream has gone, the upstream stream is closed.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+
+    def _done(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _leave(self, key: str, flight: _Flight) -> None:
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.finished:
+            # Nobody reads the stream any more; later requests start a new call
+            self._done(key, flight)
+            flight.pump.cancel()
+
+    async def _pump(self, key: str, flight: _Flight, iterator: AsyncIterator[bytes]) -> None:
+        try:
+            async for chunk in iterator:
+                flight.chunks.append(chunk)
+                flight._notify()
+        except BaseException as e:
+            flight.error = e
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            flight.finished = True
+            self._done(key, flight)
+            flight._notify()
+            # Releases the upstream connection of a stream that was cancelled or failed
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    async def _run(self, key: str, flight: _Flight, call: Callable[[], Awaitable[Response]]) -> None:
+        try:
+            response = await call()
+        except BaseException:
+            self._done(key, flight)
+            raise
+        flight.response = response
+        if isinstance(response, StreamingResponse):
+            flight.pump = asyncio.create_task(self._pump(key, flight, response.body_iterator))
+        else:
+            self._done(key, flight)
+
+    @staticmethod
+    def _retrieve(task: asyncio.Task) -> None:
+        # The leader may have gone away; don't log the error as never retrieved
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Response]]) -> Tuple[Response, bool]:
+        """Run call once for all concurrent callers with the same key
+
+        Returns:
+            The response for this caller and whether it was shared from another caller's call
+        """
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(self._run(key, flight, call))
+            flight.task.add_done_callback(self._retrieve)
+        SINGLEFLIGHT_REQUESTS.inc("follower" if shared else "leader")
+
+        # Shielded so a disconnecting caller does not cancel the call for the others
+        await asyncio.shield(flight.task)
+        response = flight.response_for(leader=not shared)
+        if flight.pump is not None:
+            flight.subscribers += 1
+            response.call_on_close(lambda: self._leave(key, flight))
+        return response, shared
+
+    def collect(self) -> List[Gauge]:
+        in_flight = Gauge("proxy_singleflight_in_flight", "Distinct upstream calls currently shared")
+        in_flight.set(len(self._flights))
+        return [in_flight]
+
+
+def singleflight_enabled(route_setting: Optional[bool], deterministic: bool) -> bool:
+    """Per-route setting wins; otherwise only deterministic requests are coalesced"""
+    if route_setting is not None:
+        return route_setting
+    return SINGLEFLIGHT_ENABLED and deterministic
+
+
+singleflight = SingleFlight()
+registry.add_collector(singleflight.collect)
@@ -0,0 +1,170 @@
+"""Request metrics for the converse endpoints"""
+
+import os
+import time
+import logging
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiohttp
+from fastapi.responses import Response, StreamingResponse
+
+from ..utils import json_codec
+from ..utils.eventstream import iter_messages
+from ..utils.metrics import registry, GAP_BUCKETS, RATE_BUCKETS
+from ..utils.timing import RequestTiming, SlowRequestLog
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get("SLOW_REQUEST_THRESHOLD_MS", "5000"))
+SLOW_REQUEST_BUFFER_SIZE = int(os.environ.get("SLOW_REQUEST_BUFFER_SIZE", "100"))
+
+LABELS = ("model", "handler")
+
+REQUESTS = registry.counter(
+    "proxy_requests_total", "Converse requests received", ("model", "handler", "stream"))
+ERRORS = registry.counter(
+    "proxy_request_errors_total", "Failed converse requests by status", ("model", "handler", "status"))
+LATENCY = registry.histogram(
+    "proxy_request_duration_seconds", "Total request latency, until the end of the stream for streaming requests", LABELS)
+UPSTREAM_CONNECT = registry.histogram(
+    "proxy_upstream_connect_seconds", "Time to open a new upstream connection", ("handler",))
+TIME_TO_FIRST_TOKEN = registry.histogram(
+    "proxy_time_to_first_token_seconds", "Time from request start to the first content delta sent", LABELS)
+INTER_TOKEN = registry.histogram(
+    "proxy_inter_token_seconds", "Gap between consecutive stream writes", LABELS, GAP_BUCKETS)
+TOKENS_PER_SECOND = registry.histogram(
+    "proxy_output_tokens_per_second", "Output tokens per second after the first token", LABELS, RATE_BUCKETS)
+ACTIVE_STREAMS = registry.gauge(
+    "proxy_active_streams", "Streams currently being relayed", LABELS)
+RELAYED_BYTES = registry.counter(
+    "proxy_relayed_bytes_total", "Body bytes relayed between client and upstream", ("model", "handler", "direction"))
+PHASE = registry.histogram(
+    "proxy_request_phase_seconds", "Time spent per request phase", ("model", "handler", "phase"))
+SLOW_REQUESTS = registry.counter(
+    "proxy_slow_requests_total", "Requests over SLOW_REQUEST_THRESHOLD_MS", LABELS)
+
+slow_requests = SlowRequestLog(SLOW_REQUEST_THRESHOLD_MS / 1000, SLOW_REQUEST_BUFFER_SIZE)
+
+_CONTENT_DELTA = b"contentBlockDelta"
+
+
+def record_error(model_id: str, handler_type: str, status: int) -> None:
+    ERRORS.inc(model_id, handler_type, str(status))
+
+
+def finish_request(timing: RequestTiming, status: Optional[int] = None) -> None:
+    """Record total latency and phase durations once a request is done"""
+    labels = (timing.model_id, timing.handler_type)
+    LATENCY.observe(timing.finish(status), *labels)
+    for phase, duration in timing.phases.items():
+        PHASE.observe(duration, timing.model_id, timing.handler_type, phase)
+    if slow_requests.record(timing):
+        SLOW_REQUESTS.inc(*labels)
+        logger.warning("[%s] Slow request: %s", timing.request_id, timing.server_timing())
+
+
+def stream_usage(chunk) -> Optional[Dict[str, Any]]:
+    """Read the usage of a metadata event in the last chunk of a stream"""
+    for headers, payload in iter_messages(chunk):
+        if headers.get(":event-type") == "metadata":
+            try:
+                return json_codec.loads(bytes(payload)).get("usage")
+            except (ValueError, AttributeError):
+                return None
+    return None
+
+
+def response_usage(body: bytes) -> Optional[Dict[str, Any]]:
+    """Read the usage of a converse response body"""
+    try:
+        return json_codec.loads(body).get("usage")
+    except (ValueError, AttributeError):
+        return None
+
+
+def stream_output_tokens(chunk: bytes) -> Optional[int]:
+    """Read outputTokens from a metadata event in the last chunk of a stream"""
+    usage = stream_usage(chunk)
+    return usage.get("outputTokens") if isinstance(usage, dict) else None
+
+
+async def _instrument_stream(iterator: AsyncIterator[bytes], timing: RequestTiming) -> AsyncIterator[bytes]:
+    """Observe time to first token, write gaps and throughput while relaying a stream"""
+    model_id, handler_type, start = timing.model_id, timing.handler_type, timing.start
+    labels = (model_id, handler_type)
+    active = ACTIVE_STREAMS.series(*labels)
+    gaps = INTER_TOKEN.series(*labels)
+    relayed = RELAYED_BYTES.series(model_id, handler_type, "response")
+    active.inc()
+
+    first_token = None
+    last_write = None
+    last_chunk = b""
+    try:
+        async for chunk in iterator:
+            now = time.perf_counter()
+            if last_write is not None:
+                gaps.observe(now - last_write)
+            last_write = now
+            # Replayed streams are memoryviews, which only support bytes search once copied
+            if first_token is None and _CONTENT_DELTA in (chunk if isinstance(chunk, bytes) else bytes(chunk)):
+                first_token = now
+                TIME_TO_FIRST_TOKEN.observe(now - start, *labels)
+            relayed.inc(len(chunk))
+            last_chunk = chunk
+            yield chunk
+    except Exception:
+        record_error(model_id, handler_type, 500)
+        timing.status = 500
+        raise
+    finally:
+        active.dec()
+        end = timing.mark("relay")
+        finish_request(timing)
+
+    if first_token is not None and end > first_token:
+        output_tokens = stream_output_tokens(last_chunk)
+        if output_tokens:
+            TOKENS_PER_SECOND.observe(output_tokens / (end - first_token), *labels)
+
+
+def instrument_response(response: Response, timing: RequestTiming) -> Response:
+    """Record metrics for a handler response; streams are observed as they are relayed
+
+    Streaming responses only carry the phases up to the response head in
+    their Server-Timing header.
+    """
+    model_id, handler_type = timing.model_id, timing.handler_type
+    if isinstance(response, StreamingResponse):
+        response.headers.append("server-timing", timing.server_timing())
+        response.body_iterator = _instrument_stream(response.body_iterator, timing)
+        return response
+
+    if response is None:
+        finish_request(timing)
+        return response
+    RELAYED_BYTES.inc(model_id, handler_type, "response", amount=len(response.body))
+    if response.status_code >= 400:
+        record_error(model_id, handler_type, response.status_code)
+    finish_request(timing, response.status_code)
+    response.headers.append("server-timing", timing.server_timing())
+    return response
+
+
+def connect_trace_config(handler_type: str) -> aiohttp.TraceConfig:
+    """aiohttp trace hooks observing new upstream connection setup time"""
+    series = UPSTREAM_CONNECT.series(handler_type)
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_start(session, context, params):
+        context.connect_start = time.perf_counter()
+
+    async def on_end(session, context, params):
+        series.observe(time.perf_counter() - context.connect_start)
+        # Requests made with trace_request_ctx=timing get a connect phase
+        if isinstance(context.trace_request_ctx, RequestTiming):
+            context.trace_request_ctx.mark("connect")
+
+    trace_config.on_connection_create_start.append(on_start)
+    trace_config.on_connection_create_end.append(on_end)
+    return trace_config
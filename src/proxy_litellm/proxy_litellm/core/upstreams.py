@@ -0,0 +1,265 @@
+"""Upstream groups: load balancing, health checks and circuit breaking"""
+
+import os
+import time
+import asyncio
+import logging
+import urllib.parse
+from typing import Any, Collection, Dict, List, Optional
+
+import aiohttp
+
+from ..utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# least_outstanding: fewest requests in flight; ewma: in flight weighted by response latency
+UPSTREAM_BALANCING = os.environ.get("UPSTREAM_BALANCING", "least_outstanding")
+UPSTREAM_HEALTH_PATH = os.environ.get("UPSTREAM_HEALTH_PATH", "/health/liveliness")
+UPSTREAM_HEALTH_INTERVAL = float(os.environ.get("UPSTREAM_HEALTH_INTERVAL", "10"))
+UPSTREAM_HEALTH_TIMEOUT = float(os.environ.get("UPSTREAM_HEALTH_TIMEOUT", "2"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", "10"))
+UPSTREAM_SLOW_START_SECONDS = float(os.environ.get("UPSTREAM_SLOW_START_SECONDS", "30"))
+# Weight of the newest sample in the latency EWMA
+EWMA_WEIGHT = 0.2
+# Share of traffic a recovered upstream starts with before ramping up
+SLOW_START_MIN_WEIGHT = 0.1
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+UPSTREAM_FAILURES = registry.counter(
+    "proxy_upstream_failures_total", "Failed upstream requests (connect errors, 5xx)", ("handler", "upstream"))
+BREAKER_TRANSITIONS = registry.counter(
+    "proxy_upstream_breaker_transitions_total", "Circuit breaker state changes", ("handler", "upstream", "state"))
+
+
+def split_urls(value: str) -> List[str]:
+    """Split a comma-separated upstream list"""
+    return [url.strip() for url in value.split(",") if url.strip()]
+
+
+class Upstream:
+    """One upstream server with its load, latency and breaker state"""
+
+    def __init__(self, url: str):
+        self.url = url
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.name = f"{self.host}:{self.port}"
+        self.origin = f"{parsed.scheme}://{parsed.netloc}"
+
+        self.outstanding = 0
+        self.ewma = 0.0
+        self.state = CLOSED
+        # Consecutive failures while closed
+        self.failures = 0
+        self.opened_at = 0.0
+        # A half-open breaker lets a single trial request through
+        self.trial = False
+        # Result of the last active health probe
+        self.healthy = True
+        self.recovered_at: Optional[float] = None
+        self.requests = 0
+        self.errors = 0
+
+        # Raw-socket pool and host header, set by handlers that use them
+        self.pool = None
+        self.host_header: Optional[bytes] = None
+
+    def weight(self, now: float, slow_start: float) -> float:
+        """Share of traffic relative to a fully warmed up upstream"""
+        if self.recovered_at is None or slow_start <= 0:
+            return 1.0
+        ramp = (now - self.recovered_at) / slow_start
+        if ramp >= 1.0:
+            self.recovered_at = None
+            return 1.0
+        return max(SLOW_START_MIN_WEIGHT, ramp)
+
+    def stats(self, now: float, slow_start: float) -> Dict[str, Any]:
+        stats = {
+            "url": self.url,
+            "state": self.state,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "latency_ewma_ms": round(self.ewma * 1000, 3),
+            "weight": round(self.weight(now, slow_start), 3),
+            "consecutive_failures": self.failures,
+            "requests": self.requests,
+            "errors": self.errors
+        }
+        if self.pool is not None:
+            stats["pool"] = self.pool.stats()
+        return stats
+
+
+class UpstreamGroup:
+    """Spreads requests over a list of equivalent upstreams.
+
+    Callers take an upstream with choose(), report the outcome once the
+    response head arrived (or the request failed) with record(), and give
+    it back with done() when the response, including any stream, is over.
+
+    Failures open a per-upstream circuit breaker after failure_threshold
+    consecutive errors. After open_seconds a single trial request is let
+    through; if it succeeds the breaker closes and the upstream gets a
+    growing share of traffic over slow_start seconds. Upstreams failing the
+    active health probe are skipped. If no upstream is available, requests
+    are spread over all of them rather than failed outright.
+    """
+
+    def __init__(self, name: str, urls: List[str], balancing: str = "least_outstanding",
+                 health_path: str = "/health/liveliness", health_interval: float = 10.0,
+                 health_timeout: float = 2.0, failure_threshold: int = 5, open_seconds: float = 10.0,
+                 slow_start: float = 30.0):
+        if not urls:
+            raise ValueError(f"No upstreams configured for {name}")
+        if balancing not in ("least_outstanding", "ewma"):
+            raise ValueError(f"Unknown upstream balancing: {balancing}")
+        self.name = name
+        self.upstreams = [Upstream(url) for url in urls]
+        self.balancing = balancing
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.slow_start = slow_start
+        self._next = 0
+        self._probe_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, name: str, urls: str) -> "UpstreamGroup":
+        return cls(
+            name,
+            split_urls(urls),
+            balancing=UPSTREAM_BALANCING,
+            health_path=UPSTREAM_HEALTH_PATH,
+            health_interval=UPSTREAM_HEALTH_INTERVAL,
+            health_timeout=UPSTREAM_HEALTH_TIMEOUT,
+            failure_threshold=BREAKER_FAILURE_THRESHOLD,
+            open_seconds=BREAKER_OPEN_SECONDS,
+            slow_start=UPSTREAM_SLOW_START_SECONDS
+        )
+
+    def __len__(self) -> int:
+        return len(self.upstreams)
+
+    def _available(self, upstream: Upstream, now: float) -> bool:
+        if not upstream.healthy:
+            return False
+        if upstream.state == OPEN:
+            return now - upstream.opened_at >= self.open_seconds and not upstream.trial
+        if upstream.state == HALF_OPEN:
+            return not upstream.trial
+        return True
+
+    def _score(self, upstream: Upstream, now: float) -> float:
+        load = upstream.outstanding + 1
+        if self.balancing == "ewma":
+            # Upstreams without samples yet look fast so they get some
+            load *= max(upstream.ewma, 0.001)
+        return load / upstream.weight(now, self.slow_start)
+
+    def choose(self, exclude: Collection[Upstream] = ()) -> Upstream:
+        """Pick an upstream for a request and count it as outstanding"""
+        upstreams = self.upstreams
+        if len(upstreams) == 1:
+            upstream = upstreams[0]
+        else:
+            now = time.monotonic()
+            candidates = [u for u in upstreams if u not in exclude and self._available(u, now)]
+            if not candidates:
+                candidates = [u for u in upstreams if u not in exclude] or upstreams
+            # Rotate the starting point so ties don't always go to the first upstream
+            self._next = (self._next + 1) % len(candidates)
+            rotated = candidates[self._next:] + candidates[:self._next]
+            upstream = min(rotated, key=lambda u: self._score(u, now))
+            if upstream.state != CLOSED and self._available(upstream, now):
+                self._transition(upstream, HALF_OPEN)
+                upstream.trial = True
+
+        upstream.outstanding += 1
+        upstream.requests += 1
+        return upstream
+
+    def _transition(self, upstream: Upstream, state: str) -> None:
+        if upstream.state == state:
+            return
+        upstream.state = state
+        BREAKER_TRANSITIONS.inc(self.name, upstream.name, state)
+        if state == OPEN:
+            upstream.opened_at = time.monotonic()
+            logger.warning("Circuit breaker opened for %s upstream %s after %d failures",
+                           self.name, upstream.name, upstream.failures)
+        elif state == CLOSED:
+            upstream.recovered_at = time.monotonic()
+            logger.info("Circuit breaker closed for %s upstream %s", self.name, upstream.name)
+
+    def record(self, upstream: Upstream, ok: bool, latency: Optional[float] = None) -> None:
+        """Report whether a request to upstream succeeded and its time to response head"""
+        upstream.trial = False
+        if ok:
+            upstream.failures = 0
+            if latency is not None:
+                upstream.ewma = latency if upstream.ewma == 0.0 else upstream.ewma + EWMA_WEIGHT * (latency - upstream.ewma)
+            if upstream.state != CLOSED:
+                self._transition(upstream, CLOSED)
+            return
+
+        upstream.failures += 1
+        upstream.errors += 1
+        UPSTREAM_FAILURES.inc(self.name, upstream.name)
+        if upstream.state == HALF_OPEN or (upstream.state == CLOSED and upstream.failures >= self.failure_threshold):
+            self._transition(upstream, OPEN)
+
+    def done(self, upstream: Upstream) -> None:
+        """Release an upstream taken with choose()"""
+        upstream.outstanding -= 1
+        # A trial that ended without a result must not block further trials
+        upstream.trial = False
+
+    async def _probe(self, session: aiohttp.ClientSession, upstream: Upstream) -> None:
+        try:
+            async with session.get(upstream.origin + self.health_path) as response:
+                healthy = response.status < 500
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            healthy = False
+
+        if healthy and not upstream.healthy:
+            logger.info("%s upstream %s passed health check", self.name, upstream.name)
+            upstream.recovered_at = time.monotonic()
+        elif not healthy and upstream.healthy:
+            logger.warning("%s upstream %s failed health check", self.name, upstream.name)
+        upstream.healthy = healthy
+
+    async def _run_probes(self) -> None:
+        timeout = aiohttp.ClientTimeout(total=self.health_timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            while True:
+                await asyncio.gather(*(self._probe(session, u) for u in self.upstreams))
+                await asyncio.sleep(self.health_interval)
+
+    def start(self) -> None:
+        """Start active health checks; only groups with a choice of upstreams are probed"""
+        if len(self.upstreams) > 1 and self.health_path and self.health_interval > 0 and self._probe_task is None:
+            self._probe_task = asyncio.create_task(self._run_probes())
+
+    async def stop(self) -> None:
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "balancing": self.balancing,
+            "health_checks": self._probe_task is not None,
+            "upstreams": [u.stats(now, self.slow_start) for u in self.upstreams]
+        }
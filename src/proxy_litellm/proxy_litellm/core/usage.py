@@ -0,0 +1,217 @@
+"""Token usage ledger, written to SQLite in the background"""
+
+import os
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ..utils.metrics import registry, Gauge
+
+logger = logging.getLogger(__name__)
+
+# SQLite file of token usage per API key, model and hour, shared by all workers; empty disables
+USAGE_DB = os.environ.get("USAGE_DB", "")
+# Seconds between writes of the usage recorded meanwhile
+USAGE_FLUSH_INTERVAL = float(os.environ.get("USAGE_FLUSH_INTERVAL", "5"))
+
+TOKENS = registry.counter(
+    "proxy_tokens_total", "Tokens reported by upstream responses", ("model", "direction"))
+USAGE_WRITES = registry.counter(
+    "proxy_usage_writes_total", "Usage ledger batch writes by result (ok, error)", ("result",))
+
+GROUP_BY = ("key", "model", "hour", "day")
+_GROUP_COLUMNS = {
+    "key": "key",
+    "model": "model",
+    "hour": "hour",
+    "day": "hour / 86400 * 86400 AS day"
+}
+
+
+def key_id(api_key: str) -> str:
+    """How a key is stored: its sha256 digest, as in the rate limits file"""
+    return "sha256:" + hashlib.sha256(api_key.encode()).hexdigest()
+
+
+class UsageLedger:
+    """Sums token usage per API key, model and hour and writes it in batches.
+
+    record() only adds to an in-memory table, so requests never wait on
+    disk. A background task writes the table every flush_interval seconds in
+    one transaction, adding to the stored rows, so several worker processes
+    can share the file (it is in WAL mode). Keys are stored as sha256 digests.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.enabled = bool(path)
+        # (api key, model, hour) -> [requests, input tokens, output tokens]
+        self._pending: Dict[Tuple[str, str, int], List[int]] = {}
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.errors = 0
+
+    def record(self, api_key: str, model_id: str, input_tokens: int, output_tokens: int) -> None:
+        """Add a request's usage"""
+        TOKENS.inc(model_id, "input", amount=input_tokens)
+        TOKENS.inc(model_id, "output", amount=output_tokens)
+        if not self.enabled:
+            return
+        key = (api_key or "", model_id, int(time.time()) // 3600 * 3600)
+        row = self._pending.get(key)
+        if row is None:
+            self._pending[key] = [1, input_tokens, output_tokens]
+        else:
+            row[0] += 1
+            row[1] += input_tokens
+            row[2] += output_tokens
+
+    def _open(self) -> None:
+        created = not os.path.exists(self.path)
+        self._db = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        if created:
+            # Rows identify API keys
+            os.chmod(self.path, 0o600)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            "key TEXT NOT NULL, model TEXT NOT NULL, hour INTEGER NOT NULL, "
+            "requests INTEGER NOT NULL, input_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL, "
+            "PRIMARY KEY (key, model, hour))")
+        logger.info("Opened usage ledger %s", self.path)
+
+    def _write(self, rows: List[Tuple[str, str, int, int, int, int]]) -> None:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    "INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key, model, hour) DO UPDATE SET "
+                    "requests = requests + excluded.requests, "
+                    "input_tokens = input_tokens + excluded.input_tokens, "
+                    "output_tokens = output_tokens + excluded.output_tokens", rows)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    async def flush(self) -> None:
+        """Write the usage recorded since the last flush"""
+        if not self._pending or self._db is None:
+            return
+        batch, self._pending = self._pending, {}
+        rows = [(key_id(api_key), model_id, hour, *row) for (api_key, model_id, hour), row in batch.items()]
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except Exception as e:
+            self.errors += 1
+            USAGE_WRITES.inc("error")
+            logger.error("Failed to write %d usage rows, retrying with the next batch: %s", len(rows), e)
+            # Put the batch back in front of what was recorded meanwhile
+            for key, row in self._pending.items():
+                if key in batch:
+                    batch[key] = [a + b for a, b in zip(batch[key], row)]
+                else:
+                    batch[key] = row
+            self._pending = batch
+            return
+        self.written += len(rows)
+        USAGE_WRITES.inc("ok")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            await asyncio.to_thread(self._open)
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            # Usage recorded since the last flush
+            await self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _query(self, where: str, params: Sequence[Any], group_by: Sequence[str]) -> List[Dict[str, Any]]:
+        columns = ", ".join(_GROUP_COLUMNS[g] for g in group_by)
+        select = f"{columns}, " if columns else ""
+        group = f" GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}" if group_by else ""
+        with self._lock:
+            cursor = self._db.execute(
+                f"SELECT {select}SUM(requests), SUM(input_tokens), SUM(output_tokens) FROM usage{where}{group}",
+                params)
+            rows = cursor.fetchall()
+        results = []
+        for row in rows:
+            *groups, requests, input_tokens, output_tokens = row
+            if requests is None:
+                continue
+            results.append({
+                **dict(zip(group_by, groups)),
+                "requests": requests,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens
+            })
+        return results
+
+    async def query(self, api_key: Optional[str] = None, model: Optional[str] = None,
+                    since: Optional[float] = None, until: Optional[float] = None,
+                    group_by: Sequence[str] = ("key", "model")) -> List[Dict[str, Any]]:
+        """Usage summed over the given columns, for hours starting in [since, until)
+
+        api_key is a key or its "sha256:" digest. Usage that is not written
+        yet, at most flush_interval seconds old, is left out.
+        """
+        if self._db is None:
+            return []
+        conditions, params = [], []
+        if api_key:
+            conditions.append("key = ?")
+            params.append(api_key if api_key.startswith("sha256:") else key_id(api_key))
+        if model:
+            conditions.append("model = ?")
+            params.append(model)
+        if since is not None:
+            conditions.append("hour >= ?")
+            params.append(int(since) // 3600 * 3600)
+        if until is not None:
+            conditions.append("hour < ?")
+            params.append(int(until))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return await asyncio.to_thread(self._query, where, params, group_by)
+
+    def collect(self) -> List[Gauge]:
+        pending = Gauge("proxy_usage_pending_rows", "Usage rows waiting to be written to the ledger")
+        pending.set(len(self._pending))
+        return [pending]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "flush_interval": self.flush_interval,
+            "pending": len(self._pending),
+            "written": self.written,
+            "errors": self.errors
+        }
+
+
+usage_ledger = UsageLedger(USAGE_DB, USAGE_FLUSH_INTERVAL)
+registry.add_collector(usage_ledger.collect)
@@ -8,6 +8,9 @@ from .request_models import (
     GuardrailConfig,
     PerformanceConfig
 )
+from .route_models import RouteConfig, RoutingConfig
+from .limit_models import LimitConfig, RateLimitsConfig
+from .key_models import KeyConfig, KeysConfig
 
 __all__ = [
     "ConverseRequest",
@@ -17,5 +20,11 @@ __all__ = [
     "InferenceConfig",
     "ToolConfig",
     "GuardrailConfig",
-    "PerformanceConfig"
+    "PerformanceConfig",
+    "RouteConfig",
+    "RoutingConfig",
+    "LimitConfig",
+    "RateLimitsConfig",
+    "KeyConfig",
+    "KeysConfig"
 ]
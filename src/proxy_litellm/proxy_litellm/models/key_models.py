@@ -0,0 +1,18 @@
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+
+from .limit_models import LimitConfig
+
+class KeyConfig(BaseModel):
+    """One API key accepted by the gateway"""
+    # Model ids the key may use, requested or upstream; empty allows all
+    models: List[str] = []
+    # Limits for the key when RATE_LIMITS_FILE has no entry for it
+    limits: Optional[LimitConfig] = None
+    # Free-form metadata (owner, team) shown in logs and debug output
+    metadata: Dict[str, str] = {}
+
+class KeysConfig(BaseModel):
+    """Accepted API keys loaded from API_KEYS_FILE"""
+    # By key or "sha256:<hex digest of the key>"
+    keys: Dict[str, KeyConfig] = {}
@@ -0,0 +1,26 @@
+from typing import Dict, Optional
+from pydantic import BaseModel, Field
+
+class LimitConfig(BaseModel):
+    """Limits for one API key or model; unset limits are not enforced"""
+    requests_per_second: Optional[float] = Field(None, gt=0)
+    # Requests allowed back to back before requests_per_second applies
+    burst: Optional[float] = Field(None, gt=0)
+    # Budget for the estimated tokens of admitted requests (inferenceConfig.maxTokens)
+    tokens_per_minute: Optional[int] = Field(None, gt=0)
+    max_concurrent_streams: Optional[int] = Field(None, ge=0)
+
+class RateLimitsConfig(BaseModel):
+    """Admission control settings loaded from RATE_LIMITS_FILE"""
+    # Longest a request waits for capacity before it is rejected with 429
+    max_wait_ms: float = Field(250, ge=0)
+    # Requests that may wait at the same time; more are rejected right away
+    queue_size: int = Field(100, ge=0)
+    # Token estimate for requests without inferenceConfig.maxTokens
+    default_max_tokens: int = Field(1024, gt=0)
+    # Applied to every API key without its own entry in keys
+    default_key: Optional[LimitConfig] = None
+    # Per API key, by key or "sha256:<hex digest of the key>"
+    keys: Dict[str, LimitConfig] = {}
+    # Per model id, shared by all keys
+    models: Dict[str, LimitConfig] = {}
@@ -0,0 +1,51 @@
+import re
+from typing import List, Optional, Dict, Union, Literal
+from pydantic import BaseModel, field_validator, model_validator
+
+HandlerType = Literal["bedrock", "openai"]
+
+class RouteConfig(BaseModel):
+    """One routing table entry, matched by exact model id, prefix or regex"""
+    model: Optional[str] = None
+    aliases: List[str] = []
+    prefix: Optional[str] = None
+    regex: Optional[str] = None
+    handler: HandlerType
+    # LiteLLM base URL for bedrock routes, chat completions URL for openai routes
+    upstream: Optional[str] = None
+    # Model id sent upstream instead of the requested one
+    target_model: Optional[str] = None
+    # Drop the matched prefix from the model id sent upstream
+    strip_prefix: bool = False
+    # Name of a mapping in MODEL_PARAM_MAPPINGS, or an explicit parameter rename map
+    param_mapping: Optional[Union[str, Dict[str, str]]] = None
+    # Coalesce identical in-flight requests; unset means only deterministic ones
+    singleflight: Optional[bool] = None
+    # Hedge slow non-streaming requests; unset means HEDGE_ENABLED
+    hedge: Optional[bool] = None
+
+    @field_validator("regex")
+    @classmethod
+    def check_regex(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None:
+            try:
+                re.compile(value)
+            except re.error as e:
+                raise ValueError(f"invalid route regex: {e}")
+        return value
+
+    @model_validator(mode="after")
+    def check_match(self) -> "RouteConfig":
+        matchers = [m for m in (self.model, self.prefix, self.regex) if m is not None]
+        if len(matchers) != 1 and not (self.aliases and not matchers):
+            raise ValueError("a route needs exactly one of model, prefix or regex")
+        if self.strip_prefix and self.prefix is None:
+            raise ValueError("strip_prefix requires a prefix route")
+        return self
+
+class RoutingConfig(BaseModel):
+    """Routing table loaded from MODEL_ROUTES_FILE"""
+    routes: List[RouteConfig] = []
+    # Route model ids found in the Bedrock model catalog to the bedrock handler
+    catalog_fallback: bool = True
+    default_handler: HandlerType = "openai"
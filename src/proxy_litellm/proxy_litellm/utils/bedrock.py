@@ -1,12 +1,19 @@
 import os
+import json
+import time
 import logging
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Optional
+
 import boto3
-from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 
-@lru_cache()
-def get_bedrock_models():
+Models = Dict[str, Dict[str, Any]]
+
+
+def fetch_bedrock_models() -> Models:
     """Get list of available Bedrock models"""
     bedrock_client = boto3.client(
         'bedrock',
@@ -14,3 +21,172 @@ def get_bedrock_models():
     )
     response = bedrock_client.list_foundation_models()
     return {model['modelId']: model for model in response['modelSummaries']}
+
+
+class ModelCatalog:
+    """Bedrock model ids used to route requests to the passthrough handler.
+
+    The catalog is loaded from a local file at startup and refreshed from
+    Bedrock in a background thread, so lookups are plain dict membership
+    checks that never wait on the network. A refreshed catalog replaces the
+    old dict in one assignment and is written back as the snapshot for the
+    next start. Failed refreshes keep the last known models.
+
+    Without a snapshot, start() waits up to startup_timeout for the first
+    refresh, so Bedrock models aren't routed to OpenAI while the catalog is
+    empty. A static file disables refreshing entirely, and the fetcher can
+    be replaced to run without AWS access.
+    """
+
+    def __init__(self, fetcher: Optional[Callable[[], Models]] = fetch_bedrock_models,
+                 snapshot_path: Optional[str] = None, static_path: Optional[str] = None,
+                 refresh_interval: float = 3600.0, retry_interval: float = 60.0,
+                 startup_timeout: float = 10.0):
+        self.fetcher = fetcher
+        self.snapshot_path = snapshot_path
+        self.static_path = static_path
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.startup_timeout = startup_timeout
+
+        self._models: Models = {}
+        # Bumped on every change so dependent caches know to invalidate
+        self.version = 0
+        self.source = "empty"
+        self.updated_at = 0.0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+        self._stop = threading.Event()
+        # Set once the first refresh has been tried
+        self._first_refresh = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> "ModelCatalog":
+        return cls(
+            snapshot_path=os.environ.get("BEDROCK_MODELS_SNAPSHOT", "bedrock_models.json") or None,
+            static_path=os.environ.get("BEDROCK_MODELS_FILE") or None,
+            refresh_interval=float(os.environ.get("BEDROCK_MODELS_REFRESH_INTERVAL", "3600")),
+            startup_timeout=float(os.environ.get("BEDROCK_MODELS_STARTUP_TIMEOUT", "10"))
+        )
+
+    def __contains__(self, model_id: str) -> bool:
+        return model_id in self._models
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    @property
+    def models(self) -> Models:
+        return self._models
+
+    def get(self, model_id: str) -> Optional[Dict[str, Any]]:
+        return self._models.get(model_id)
+
+    def set_models(self, models: Models, source: str = "manual") -> None:
+        """Replace the catalog contents"""
+        self._models = dict(models)
+        self.version += 1
+        self.source = source
+        self.updated_at = time.time()
+
+    def load_file(self, path: str, source: str) -> bool:
+        """Load models from a JSON file, either a snapshot or a plain model id map/list"""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning("Failed to load Bedrock models from %s: %s", path, e)
+            return False
+
+        models = data.get("models", data) if isinstance(data, dict) else data
+        if isinstance(models, list):
+            models = {model_id: {"modelId": model_id} for model_id in models}
+        self.set_models(models, source)
+        if isinstance(data, dict) and "updated_at" in data:
+            self.updated_at = data["updated_at"]
+        logger.info("Loaded %d Bedrock models from %s", len(models), path)
+        return True
+
+    def _save_snapshot(self) -> None:
+        # A temporary file of its own, since every worker process refreshes and saves
+        directory, name = os.path.split(os.path.abspath(self.snapshot_path))
+        tmp_path = None
+        try:
+            with tempfile.NamedTemporaryFile("w", dir=directory, prefix=f"{name}.", suffix=".tmp", delete=False) as f:
+                tmp_path = f.name
+                json.dump({"updated_at": self.updated_at, "models": self._models}, f, default=str)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning("Failed to write Bedrock model snapshot %s: %s", self.snapshot_path, e)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def refresh(self) -> bool:
+        """Fetch the model list and swap it in; runs in the refresh thread"""
+        try:
+            models = self.fetcher()
+        except Exception as e:
+            self.refresh_errors += 1
+            logger.warning("Failed to refresh Bedrock models, keeping %d known models: %s", len(self._models), e)
+            return False
+
+        self.refreshes += 1
+        self.set_models(models, "bedrock")
+        logger.info("Refreshed Bedrock model catalog: %d models", len(models))
+        if self.snapshot_path:
+            self._save_snapshot()
+        return True
+
+    def _run(self, refresh_now: bool) -> None:
+        delay = 0.0 if refresh_now else self.refresh_interval
+        while not self._stop.wait(delay):
+            delay = self.refresh_interval if self.refresh() else self.retry_interval
+            self._first_refresh.set()
+
+    def start(self) -> None:
+        """Load the local catalog and start background refreshing"""
+        if self.static_path:
+            if not self.load_file(self.static_path, "static"):
+                logger.error("Bedrock models file %s could not be loaded", self.static_path)
+            return
+
+        loaded = bool(self.snapshot_path) and self.load_file(self.snapshot_path, "snapshot")
+        if self.fetcher is None or self.refresh_interval <= 0:
+            return
+        # Refresh right away when starting without models or from a stale snapshot
+        stale = time.time() - self.updated_at >= self.refresh_interval
+        self._stop.clear()
+        self._first_refresh.clear()
+        self._thread = threading.Thread(target=self._run, args=(not loaded or stale,),
+                                        name="bedrock-model-catalog", daemon=True)
+        self._thread.start()
+        if not loaded and not (self._first_refresh.wait(self.startup_timeout) and len(self._models)):
+            logger.warning("No Bedrock models loaded at startup, requests route to OpenAI until a refresh completes")
+
+    def stop(self) -> None:
+        """Stop the refresh thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "models": len(self._models),
+            "source": self.source,
+            "updated_at": self.updated_at,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors
+        }
+
+
+model_catalog = ModelCatalog.from_env()
+
+
+def get_bedrock_models() -> Models:
+    """Get the current Bedrock models from the catalog"""
+    return model_catalog.models
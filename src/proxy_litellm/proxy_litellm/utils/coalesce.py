@@ -0,0 +1,92 @@
+"""Coalescing of consecutive text deltas in converse streams"""
+
+import time
+from typing import Any, Dict, List, Optional
+
+from .eventstream import random_padding
+
+
+class DeltaCoalescer:
+    """Merges consecutive contentBlockDelta text events into fewer, larger events.
+
+    Converted Bedrock stream payloads are added one by one. Text deltas for the
+    same content block are merged until the time window since the first
+    buffered delta has passed, the buffered text length reaches max_bytes, or
+    any other event arrives. A window of 0 disables merging.
+    """
+
+    def __init__(self, window: float = 0.0, max_bytes: int = 1024):
+        self.window = window
+        self.max_bytes = max_bytes
+        self._events: List[Dict[str, Any]] = []
+        self._texts: List[str] = []
+        self._text_bytes = 0
+        self._deadline: Optional[float] = None
+        self._flush = False
+        self.merged = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    @property
+    def pending(self) -> bool:
+        """Whether events are buffered"""
+        return bool(self._events)
+
+    def add(self, event: Dict[str, Any]) -> None:
+        """Buffer a converted stream event"""
+        delta = event.get("delta")
+        text = delta.get("text") if isinstance(delta, dict) and len(delta) == 1 else None
+
+        if text is None or not self.enabled:
+            self._close_delta()
+            self._events.append(event)
+            self._flush = True
+            return
+
+        last = self._events[-1] if self._events else None
+        if self._texts and last.get("contentBlockIndex") == event.get("contentBlockIndex"):
+            self._texts.append(text)
+            self.merged += 1
+        else:
+            self._close_delta()
+            self._events.append(event)
+            self._texts = [text]
+            self._text_bytes = 0
+        self._text_bytes += len(text)
+
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self.window
+        if self._text_bytes >= self.max_bytes:
+            self._flush = True
+
+    def _close_delta(self) -> None:
+        """Write the merged text back into the open delta event"""
+        if len(self._texts) > 1:
+            event = self._events[-1]
+            event["delta"] = {"text": "".join(self._texts)}
+            event["p"] = random_padding()
+        self._texts = []
+        self._text_bytes = 0
+
+    def ready(self) -> bool:
+        """Whether the buffered events should be sent now"""
+        if not self._events:
+            return False
+        return self._flush or self._deadline is None or time.monotonic() >= self._deadline
+
+    def time_left(self) -> Optional[float]:
+        """Seconds until the time window expires, or None if nothing is waiting on it"""
+        if not self._events or self._deadline is None:
+            return None
+        return max(self._deadline - time.monotonic(), 0.0)
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """Return and clear all buffered events"""
+        self._close_delta()
+        events = self._events
+        self._events = []
+        self._deadline = None
+        self._flush = False
+        return events
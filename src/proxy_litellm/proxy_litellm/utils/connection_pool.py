@@ -0,0 +1,235 @@
+"""Keep-alive connection pool for the raw-socket upstream path"""
+
+import time
+import socket
+import asyncio
+import logging
+import ipaddress
+from collections import deque
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PooledConnection:
+    """A single upstream connection checked out of a ConnectionPool"""
+
+    __slots__ = ("reader", "writer", "created_at", "last_used", "requests", "reused")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.requests = 0
+        # Checked out of the idle connections, where the upstream may have closed it
+        self.reused = False
+
+    def is_alive(self) -> bool:
+        """Check whether the peer has not closed the connection"""
+        return not (self.writer.is_closing() or self.reader.at_eof())
+
+    def close(self) -> None:
+        """Close the underlying transport without waiting"""
+        if not self.writer.is_closing():
+            self.writer.close()
+
+
+class ConnectionPool:
+    """Per-upstream pool of idle HTTP/1.1 keep-alive connections.
+
+    Connections are handed out LIFO so the hottest sockets are reused first and
+    idle ones age out from the other end. A connection must only be released
+    as reusable once its response has been read completely.
+    """
+
+    def __init__(self, host: str, port: int, max_idle: int = 64, idle_timeout: float = 4.0,
+                 min_idle: int = 0, dns_ttl: float = 30.0, connect_timeout: float = 10.0,
+                 on_connect: Optional[Callable[[float], None]] = None):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.min_idle = min(min_idle, max_idle)
+        self.dns_ttl = dns_ttl
+        self.connect_timeout = connect_timeout
+        # Called with the setup time in seconds of every new connection
+        self.on_connect = on_connect
+
+        self._idle: deque = deque()
+        self._in_use = 0
+        self._closed = False
+        self._maintenance_task: Optional[asyncio.Task] = None
+
+        self._addresses: List[Tuple] = []
+        self._addresses_expire = 0.0
+        self._next_address = 0
+        self._is_ip_literal = self._check_ip_literal(host)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.created = 0
+        self.closed = 0
+        self.connect_errors = 0
+        self.dns_lookups = 0
+        self.connect_time_total = 0.0
+
+    @staticmethod
+    def _check_ip_literal(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host)
+            return True
+        except ValueError:
+            return False
+
+    async def _resolve(self) -> Tuple[str, int]:
+        """Resolve the upstream host, caching the result for dns_ttl seconds"""
+        if self._is_ip_literal:
+            return self.host, 0
+
+        now = time.monotonic()
+        if not self._addresses or now >= self._addresses_expire:
+            loop = asyncio.get_running_loop()
+            infos = await loop.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+            self.dns_lookups += 1
+            self._addresses = [(info[4][0], info[0]) for info in infos]
+            self._addresses_expire = now + self.dns_ttl
+
+        # Rotate through the resolved addresses
+        address = self._addresses[self._next_address % len(self._addresses)]
+        self._next_address += 1
+        return address
+
+    async def _connect(self) -> PooledConnection:
+        """Open a new connection to the upstream"""
+        start = time.monotonic()
+        try:
+            address, family = await self._resolve()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(address, self.port, family=family),
+                timeout=self.connect_timeout
+            )
+        except Exception:
+            self.connect_errors += 1
+            # Drop cached addresses so a moved upstream is picked up on retry
+            self._addresses_expire = 0.0
+            raise
+        elapsed = time.monotonic() - start
+        self.connect_time_total += elapsed
+        self.created += 1
+        if self.on_connect is not None:
+            self.on_connect(elapsed)
+        return PooledConnection(reader, writer)
+
+    def _evict(self, conn: PooledConnection) -> None:
+        self.evictions += 1
+        self.closed += 1
+        conn.close()
+
+    async def acquire(self, fresh: bool = False) -> PooledConnection:
+        """Check out an idle connection, or open a new one if none is usable or fresh is set"""
+        if self._closed:
+            raise RuntimeError(f"Connection pool for {self.host}:{self.port} is closed")
+
+        now = time.monotonic()
+        while self._idle and not fresh:
+            conn = self._idle.pop()
+            if now - conn.last_used < self.idle_timeout and conn.is_alive():
+                self.hits += 1
+                self._in_use += 1
+                conn.reused = True
+                return conn
+            self._evict(conn)
+
+        self.misses += 1
+        conn = await self._connect()
+        self._in_use += 1
+        return conn
+
+    def release(self, conn: PooledConnection, reusable: bool = True) -> None:
+        """Return a connection to the pool, or close it if it cannot be reused"""
+        self._in_use -= 1
+        conn.requests += 1
+        if not reusable or self._closed or not conn.is_alive():
+            self.closed += 1
+            conn.close()
+            return
+
+        conn.last_used = time.monotonic()
+        self._idle.append(conn)
+        # Keep the newest connections when over capacity
+        while len(self._idle) > self.max_idle:
+            self._evict(self._idle.popleft())
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        while self._idle and (now - self._idle[0].last_used >= self.idle_timeout
+                              or not self._idle[0].is_alive()):
+            self._evict(self._idle.popleft())
+
+    async def warm(self) -> None:
+        """Open connections until min_idle idle connections are available"""
+        missing = self.min_idle - len(self._idle)
+        if missing <= 0:
+            return
+        results = await asyncio.gather(
+            *(self._connect() for _ in range(missing)),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.warning("Failed to warm connection to %s:%s: %s", self.host, self.port, result)
+                continue
+            if self._closed:
+                result.close()
+                continue
+            self._idle.append(result)
+
+    async def _maintain(self) -> None:
+        """Periodically drop expired idle connections and refill to min_idle"""
+        interval = max(self.idle_timeout / 2, 0.5)
+        while not self._closed:
+            await asyncio.sleep(interval)
+            try:
+                self._evict_expired()
+                await self.warm()
+            except Exception as e:
+                logger.warning("Connection pool maintenance failed for %s:%s: %s", self.host, self.port, e)
+
+    async def start(self) -> None:
+        """Warm the pool and start the background maintenance task"""
+        await self.warm()
+        if self._maintenance_task is None:
+            self._maintenance_task = asyncio.create_task(self._maintain())
+
+    async def close(self) -> None:
+        """Close all idle connections and stop maintenance"""
+        self._closed = True
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            try:
+                await self._maintenance_task
+            except asyncio.CancelledError:
+                pass
+            self._maintenance_task = None
+        while self._idle:
+            conn = self._idle.pop()
+            self.closed += 1
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return pool counters for sizing and monitoring"""
+        return {
+            "upstream": f"{self.host}:{self.port}",
+            "idle": len(self._idle),
+            "in_use": self._in_use,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "created": self.created,
+            "closed": self.closed,
+            "connect_errors": self.connect_errors,
+            "dns_lookups": self.dns_lookups,
+            "avg_connect_ms": round(self.connect_time_total / self.created * 1000, 3) if self.created else 0.0
+        }
@@ -3,12 +3,14 @@
 """Binary Event Stream Encoding"""
 
 from binascii import crc32
-from struct import pack
-import json
+from struct import pack, Struct
+import random
+import string
 import logging
 
+from . import json_codec
+
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 _PRELUDE_LENGTH = 12
 
@@ -16,52 +18,250 @@ UINT8_BYTE_FORMAT = '!B'
 UINT16_BYTE_FORMAT = '!H'
 UINT32_BYTE_FORMAT = '!I'
 
+_PRELUDE = Struct('!III')
+_PRELUDE_LENGTHS = Struct('!II')
+_UINT32 = Struct(UINT32_BYTE_FORMAT)
+# Prelude plus trailing message CRC
+_MIN_MESSAGE_LENGTH = _PRELUDE_LENGTH + 4
+# 128 KiB of headers plus 16 MiB of payload
+_MAX_MESSAGE_LENGTH = _MIN_MESSAGE_LENGTH + 128 * 1024 + 16 * 1024 * 1024
+
+# Padding is sliced from a fixed random string instead of drawn per character
+_PADDING_BITS = 12
+_PADDING_SOURCE = ''.join(random.choices(string.ascii_letters, k=(1 << _PADDING_BITS) + 256))
+
+def encode_headers(headers: dict) -> bytes:
+    """Encode string headers in the AWS event stream header format."""
+    parts = []
+    for key, value in headers.items():
+        name_bytes = key.encode('utf-8')
+        value_bytes = value.encode('utf-8')
+        parts.append(pack(UINT8_BYTE_FORMAT, len(name_bytes)))
+        parts.append(name_bytes)
+        parts.append(pack(UINT8_BYTE_FORMAT, 7))  # 7 = string
+        parts.append(pack(UINT16_BYTE_FORMAT, len(value_bytes)))
+        parts.append(value_bytes)
+    return b''.join(parts)
+
+
+def _pack_message(buffer: bytearray, offset: int, headers_bytes: bytes, payload_bytes: bytes) -> int:
+    """Write one message into buffer at offset and return the offset after it."""
+    headers_length = len(headers_bytes)
+    total_length = _PRELUDE_LENGTH + headers_length + len(payload_bytes) + 4
+    end = offset + total_length
+
+    _PRELUDE_LENGTHS.pack_into(buffer, offset, total_length, headers_length)
+    with memoryview(buffer) as view:
+        # Prelude CRC (CRC32 of first 8 bytes of the prelude)
+        prelude_crc = crc32(view[offset:offset + 8])
+        _UINT32.pack_into(buffer, offset + 8, prelude_crc)
+
+        body_start = offset + _PRELUDE_LENGTH
+        buffer[body_start:body_start + headers_length] = headers_bytes
+        buffer[body_start + headers_length:end - 4] = payload_bytes
+
+        # Use prelude_crc as base to calc message_crc
+        message_crc = crc32(view[offset + 8:end - 4], prelude_crc)
+    _UINT32.pack_into(buffer, end - 4, message_crc)
+    return end
+
+
 class EventStreamMessageEncoder:
     """Encodes messages in the AWS event stream wire format."""
 
     @staticmethod
     def encode(headers: dict, payload_dict: dict) -> bytes:
         """Encode a message in the AWS event stream wire format."""
+        headers_bytes = encode_headers(headers)
+        payload_bytes = json_codec.dumps(payload_dict)
 
-        headers_bytes = b''
-        for key, value in headers.items():
-            name_bytes = key.encode('utf-8')
-            value_bytes = value.encode('utf-8')
-            header = (
-                pack(UINT8_BYTE_FORMAT, len(name_bytes)) +
-                name_bytes +
-                pack(UINT8_BYTE_FORMAT, 7) +  # 7 = string
-                pack(UINT16_BYTE_FORMAT, len(value_bytes)) +
-                value_bytes
-            )
-            headers_bytes += header
+        message = bytearray(_MIN_MESSAGE_LENGTH + len(headers_bytes) + len(payload_bytes))
+        _pack_message(message, 0, headers_bytes, payload_bytes)
+        return bytes(message)
 
-        payload_bytes = json.dumps(payload_dict).encode('utf-8')
 
-        headers_length = len(headers_bytes)
-        total_length = _PRELUDE_LENGTH + headers_length + len(payload_bytes) + 4
+# Value sizes of the non length-prefixed header types
+_HEADER_VALUE_SIZES = {0: 0, 1: 0, 2: 1, 3: 2, 4: 4, 5: 8, 8: 8, 9: 16}
 
-        # Prelude CRC (CRC32 of first 8 bytes of the prelude)
-        prelude_without_crc = pack(UINT32_BYTE_FORMAT, total_length) + pack(UINT32_BYTE_FORMAT, headers_length)
-        prelude_crc = crc32(prelude_without_crc) & 0xFFFFFFFF
-        prelude = prelude_without_crc + pack(UINT32_BYTE_FORMAT, prelude_crc)
 
-        # Use prelude_crc as base to calc message_crc
-        message_bytes = prelude[8:] + headers_bytes + payload_bytes
-        initial_crc = prelude_crc
-        message_crc = crc32(message_bytes, initial_crc) & 0xFFFFFFFF  # Add initial_crc
-
-        message = (
-            prelude +
-            headers_bytes +
-            payload_bytes +
-            pack(UINT32_BYTE_FORMAT, message_crc)
-        )
-
-        logger.debug(f"Total length: {total_length}")
-        logger.debug(f"Headers length: {headers_length}")
-        logger.debug(f"Prelude CRC: 0x{prelude_crc:08x}")
-        logger.debug(f"Message CRC: 0x{message_crc:08x}")
-        logger.debug(f"Complete message (hex): {message.hex()}")
-
-        return message
\ No newline at end of file
+def decode_headers(data, start: int, end: int) -> dict:
+    """Decode a header block; string values are decoded, others kept as bytes."""
+    headers = {}
+    pos = start
+    while pos < end:
+        name_length = data[pos]
+        name = bytes(data[pos + 1:pos + 1 + name_length]).decode('utf-8')
+        pos += 1 + name_length
+        value_type = data[pos]
+        pos += 1
+        if value_type in (6, 7):
+            value_length = int.from_bytes(data[pos:pos + 2], 'big')
+            pos += 2
+        else:
+            value_length = _HEADER_VALUE_SIZES[value_type]
+        value = bytes(data[pos:pos + value_length])
+        headers[name] = value.decode('utf-8') if value_type == 7 else value
+        pos += value_length
+    return headers
+
+
+def iter_messages(data):
+    """Yield (headers, payload) for each complete message in data.
+
+    Payloads are memoryview slices of data.
+    """
+    view = memoryview(data)
+    pos = 0
+    end = len(data)
+    while end - pos >= _MIN_MESSAGE_LENGTH:
+        total_length, headers_length, _ = _PRELUDE.unpack_from(data, pos)
+        if total_length < _MIN_MESSAGE_LENGTH or end - pos < total_length:
+            break
+        headers_start = pos + _PRELUDE_LENGTH
+        payload_start = headers_start + headers_length
+        yield decode_headers(data, headers_start, payload_start), view[payload_start:pos + total_length - 4]
+        pos += total_length
+
+
+def random_padding(length: int = 32) -> str:
+    """Return a random letter string for the 'p' padding field of stream events."""
+    offset = random.getrandbits(_PADDING_BITS)
+    return _PADDING_SOURCE[offset:offset + length]
+
+
+class PrecompiledEventStreamEncoder:
+    """Encodes converse-stream events with precompiled header blocks.
+
+    The header block (:event-type, :content-type, :message-type) only depends
+    on the event type, so it is encoded once per event type and reused for
+    every message.
+    """
+
+    def __init__(self, content_type: str = "application/json", message_type: str = "event"):
+        self.content_type = content_type
+        self.message_type = message_type
+        self._header_blocks = {}
+
+    def header_block(self, event_type: str) -> bytes:
+        """Return the cached header block for an event type."""
+        block = self._header_blocks.get(event_type)
+        if block is None:
+            block = self._header_blocks[event_type] = encode_headers({
+                ":event-type": event_type,
+                ":content-type": self.content_type,
+                ":message-type": self.message_type
+            })
+        return block
+
+    def encode(self, event_type: str, payload: dict) -> bytes:
+        """Encode a single event."""
+        return self.encode_many(((event_type, payload),))
+
+    def encode_many(self, events) -> bytes:
+        """Encode (event_type, payload) pairs into one contiguous bytes object."""
+        parts = [
+            (self.header_block(event_type), json_codec.dumps(payload))
+            for event_type, payload in events
+        ]
+        size = sum(_MIN_MESSAGE_LENGTH + len(headers_bytes) + len(payload_bytes)
+                   for headers_bytes, payload_bytes in parts)
+        buffer = bytearray(size)
+        offset = 0
+        for headers_bytes, payload_bytes in parts:
+            offset = _pack_message(buffer, offset, headers_bytes, payload_bytes)
+        return bytes(buffer)
+
+
+class EventStreamFramer:
+    """Splits a byte stream into complete AWS event stream messages.
+
+    Incoming data is appended to a single buffer that is consumed by moving a
+    read offset, so complete messages are never shifted or copied one by one.
+    drain() returns every complete message buffered so far as one bytes object,
+    which lets a relay forward a whole read with a single write. When a read
+    ends exactly on a message boundary the data is returned without copying.
+    """
+
+    MIN_READ_SIZE = 16 * 1024
+    MAX_READ_SIZE = 256 * 1024
+
+    def __init__(self, min_read_size: int = MIN_READ_SIZE, max_read_size: int = MAX_READ_SIZE,
+                 compact_threshold: int = 64 * 1024):
+        self._buffer = b''
+        self._offset = 0
+        self.min_read_size = min_read_size
+        self.max_read_size = max_read_size
+        self.compact_threshold = compact_threshold
+        # Suggested size for the next socket read, adapted to the traffic
+        self.read_size = min_read_size
+        self.message_count = 0
+        # Number of messages and start of the last one in the last drain() result
+        self.last_count = 0
+        self.last_message_offset = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of buffered bytes not yet returned by drain()"""
+        return len(self._buffer) - self._offset
+
+    def feed(self, data: bytes) -> None:
+        """Append data read from the upstream"""
+        size = len(data)
+        if size >= self.read_size and self.read_size < self.max_read_size:
+            self.read_size = min(self.read_size * 2, self.max_read_size)
+        elif size < self.read_size // 8 and self.read_size > self.min_read_size:
+            self.read_size = max(self.read_size // 2, self.min_read_size)
+
+        if self._offset == len(self._buffer):
+            # Nothing pending, keep a reference instead of copying
+            self._buffer = data
+            self._offset = 0
+            return
+
+        if not isinstance(self._buffer, bytearray):
+            self._buffer = bytearray(memoryview(self._buffer)[self._offset:])
+            self._offset = 0
+        elif self._offset >= self.compact_threshold:
+            del self._buffer[:self._offset]
+            self._offset = 0
+        self._buffer += data
+
+    def drain(self) -> bytes:
+        """Return all complete messages buffered so far, or b'' if there are none.
+
+        Raises:
+            ValueError: If a message prelude is invalid
+        """
+        buffer = self._buffer
+        start = pos = self._offset
+        end = len(buffer)
+        last = pos
+        count = 0
+
+        while end - pos >= _PRELUDE_LENGTH:
+            total_length, headers_length, prelude_crc = _PRELUDE.unpack_from(buffer, pos)
+            if (total_length < _MIN_MESSAGE_LENGTH or total_length > _MAX_MESSAGE_LENGTH
+                    or crc32(buffer[pos:pos + 8]) != prelude_crc):
+                raise ValueError(f"Invalid event stream message prelude at offset {pos}")
+            if end - pos < total_length:
+                break
+            last = pos
+            pos += total_length
+            count += 1
+
+        self.last_count = count
+        if not count:
+            return b''
+
+        if start == 0 and pos == end and isinstance(buffer, bytes):
+            messages = buffer
+        else:
+            messages = memoryview(buffer)[start:pos].tobytes()
+        self._offset = pos
+        self.last_message_offset = last - start
+        self.message_count += count
+
+        if pos == end and isinstance(buffer, bytearray):
+            self._buffer = b''
+            self._offset = 0
+        return messages
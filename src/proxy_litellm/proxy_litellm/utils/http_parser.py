@@ -0,0 +1,275 @@
+"""Incremental HTTP/1.1 response parser for the raw-socket upstream path"""
+
+import asyncio
+from typing import List, Optional, Tuple
+
+# Parser states
+_HEAD = 0
+_BODY_LENGTH = 1
+_CHUNK_SIZE = 2
+_CHUNK_DATA = 3
+_CHUNK_DATA_END = 4
+_TRAILERS = 5
+_BODY_EOF = 6
+_DONE = 7
+
+# Headers that describe a single connection and are never relayed
+HOP_BY_HOP_HEADERS = frozenset((
+    "connection",
+    "keep-alive",
+    "proxy-connection",
+    "transfer-encoding",
+    "te",
+    "trailer",
+    "upgrade",
+))
+
+
+class HTTPParseError(ValueError):
+    """Raised when an upstream response is not valid HTTP/1.1"""
+
+
+class HTTPResponseParser:
+    """Incremental HTTP/1.1 response parser.
+
+    Data read from the socket is passed to feed(), which returns the decoded
+    body chunks it contains. Content-Length, chunked transfer-encoding (with
+    trailers) and read-until-close bodies are supported. Once
+    message_complete is set, the connection can be reused if keep_alive is.
+    """
+
+    def __init__(self, method: str = "POST", max_line_size: int = 64 * 1024):
+        self.method = method.upper()
+        self.max_line_size = max_line_size
+
+        self.version = ""
+        self.status = 0
+        self.reason = ""
+        self.headers: List[Tuple[str, str]] = []
+        self.trailers: List[Tuple[str, str]] = []
+        self.content_length: Optional[int] = None
+        self.chunked = False
+        self.keep_alive = False
+        self.headers_complete = False
+        self.message_complete = False
+        self.body_bytes = 0
+        # All bytes fed, head included
+        self.bytes_received = 0
+        # Bytes received after the end of the message
+        self.unconsumed = b""
+
+        self._state = _HEAD
+        self._remaining = 0
+        self._partial = b""
+
+    def header(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """Return the last value of a header by case-insensitive name"""
+        name = name.lower()
+        for key, value in reversed(self.headers):
+            if key == name:
+                return value
+        return default
+
+    def _parse_header_lines(self, lines: List[str], into: List[Tuple[str, str]]) -> None:
+        for line in lines:
+            name, sep, value = line.partition(":")
+            if not sep or not name or name != name.strip():
+                raise HTTPParseError(f"Invalid header line: {line!r}")
+            into.append((name.lower(), value.strip()))
+
+    def _parse_head(self, head: bytes) -> None:
+        lines = head.decode("latin-1").split("\r\n")
+        version, _, rest = lines[0].partition(" ")
+        status, _, reason = rest.partition(" ")
+        if not version.startswith("HTTP/1.") or len(status) != 3 or not status.isdigit():
+            raise HTTPParseError(f"Invalid status line: {lines[0]!r}")
+        self.version = version
+        self.status = int(status)
+        self.reason = reason
+        self.headers = []
+        self._parse_header_lines(lines[1:], self.headers)
+
+        connection = (self.header("connection") or "").lower()
+        if version == "HTTP/1.0":
+            self.keep_alive = "keep-alive" in connection
+        else:
+            self.keep_alive = "close" not in connection
+
+    def _start_body(self) -> None:
+        """Pick the body framing once the head has been parsed"""
+        self.headers_complete = True
+        transfer_encoding = (self.header("transfer-encoding") or "").lower()
+        content_length = self.header("content-length")
+
+        if self.method == "HEAD" or self.status in (204, 304):
+            self._finish()
+        elif transfer_encoding:
+            if not transfer_encoding.endswith("chunked"):
+                raise HTTPParseError(f"Unsupported transfer-encoding: {transfer_encoding}")
+            self.chunked = True
+            self._state = _CHUNK_SIZE
+        elif content_length is not None:
+            try:
+                self.content_length = int(content_length)
+            except ValueError:
+                raise HTTPParseError(f"Invalid content-length: {content_length!r}")
+            if self.content_length < 0:
+                raise HTTPParseError(f"Invalid content-length: {content_length!r}")
+            self._remaining = self.content_length
+            if self._remaining:
+                self._state = _BODY_LENGTH
+            else:
+                self._finish()
+        else:
+            # Body delimited by connection close
+            self.keep_alive = False
+            self._state = _BODY_EOF
+
+    def _finish(self) -> None:
+        self._state = _DONE
+        self.message_complete = True
+
+    def _check_line_size(self, size: int) -> None:
+        if size > self.max_line_size:
+            raise HTTPParseError("Response head or chunk line too long")
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Parse received data and return the decoded body chunks it contains
+
+        Raises:
+            HTTPParseError: If the response is malformed
+        """
+        self.bytes_received += len(data)
+        if self._partial:
+            data = self._partial + data
+            self._partial = b""
+
+        body: List[bytes] = []
+        pos = 0
+        size = len(data)
+
+        while pos < size:
+            state = self._state
+
+            if state == _BODY_LENGTH or state == _CHUNK_DATA:
+                take = min(self._remaining, size - pos)
+                body.append(data[pos:pos + take] if take < size else data)
+                self.body_bytes += take
+                self._remaining -= take
+                pos += take
+                if not self._remaining:
+                    if state == _BODY_LENGTH:
+                        self._finish()
+                    else:
+                        self._state = _CHUNK_DATA_END
+
+            elif state == _CHUNK_SIZE:
+                end = data.find(b"\r\n", pos)
+                if end < 0:
+                    self._check_line_size(size - pos)
+                    self._partial = data[pos:]
+                    break
+                line = data[pos:end].split(b";", 1)[0].strip()
+                try:
+                    self._remaining = int(line, 16)
+                except ValueError:
+                    raise HTTPParseError(f"Invalid chunk size: {line!r}")
+                pos = end + 2
+                self._state = _CHUNK_DATA if self._remaining else _TRAILERS
+
+            elif state == _CHUNK_DATA_END:
+                if size - pos < 2:
+                    self._partial = data[pos:]
+                    break
+                if data[pos:pos + 2] != b"\r\n":
+                    raise HTTPParseError("Missing CRLF after chunk data")
+                pos += 2
+                self._state = _CHUNK_SIZE
+
+            elif state == _TRAILERS:
+                end = data.find(b"\r\n", pos)
+                if end < 0:
+                    self._check_line_size(size - pos)
+                    self._partial = data[pos:]
+                    break
+                if end == pos:
+                    pos += 2
+                    self._finish()
+                else:
+                    self._parse_header_lines([data[pos:end].decode("latin-1")], self.trailers)
+                    pos = end + 2
+
+            elif state == _HEAD:
+                end = data.find(b"\r\n\r\n", pos)
+                if end < 0:
+                    self._check_line_size(size - pos)
+                    self._partial = data[pos:]
+                    break
+                self._parse_head(data[pos:end])
+                pos = end + 4
+                if 100 <= self.status < 200:
+                    # Skip interim responses such as 100 Continue
+                    continue
+                self._start_body()
+
+            elif state == _BODY_EOF:
+                body.append(data[pos:] if pos else data)
+                self.body_bytes += size - pos
+                pos = size
+
+            else:
+                # Data after a complete message cannot be attributed to any request
+                self.unconsumed = data[pos:]
+                self.keep_alive = False
+                break
+
+        return body
+
+    def feed_eof(self) -> None:
+        """Signal that the upstream closed the connection
+
+        Raises:
+            HTTPParseError: If the response was cut short
+        """
+        self.keep_alive = False
+        if self._state == _BODY_EOF:
+            self._finish()
+        elif self._state != _DONE:
+            raise HTTPParseError("Upstream closed the connection before the response was complete")
+
+    def relay_headers(self) -> List[Tuple[bytes, bytes]]:
+        """End-to-end response headers, in order, without hop-by-hop or length headers"""
+        return [
+            (name.encode("latin-1"), value.encode("latin-1"))
+            for name, value in self.headers
+            if name not in HOP_BY_HOP_HEADERS and name != "content-length"
+        ]
+
+
+async def read_response_head(reader: asyncio.StreamReader, parser: HTTPResponseParser,
+                             read_size: int = 65536) -> List[bytes]:
+    """Read until the response head is parsed
+
+    Returns:
+        Body chunks that arrived together with the head
+    """
+    body: List[bytes] = []
+    while not parser.headers_complete:
+        data = await reader.read(read_size)
+        if not data:
+            parser.feed_eof()
+            break
+        body.extend(parser.feed(data))
+    return body
+
+
+async def read_response_body(reader: asyncio.StreamReader, parser: HTTPResponseParser,
+                             body: List[bytes], read_size: int = 65536) -> bytes:
+    """Read the rest of the response body after read_response_head"""
+    while not parser.message_complete:
+        data = await reader.read(read_size)
+        if not data:
+            parser.feed_eof()
+            break
+        body.extend(parser.feed(data))
+    return b"".join(body)
@@ -0,0 +1,86 @@
+"""Pluggable JSON codec for the request/response path.
+
+Uses orjson or msgspec when installed and falls back to the standard library.
+The backend can be forced with the PROXY_JSON_CODEC environment variable
+(auto, orjson, msgspec or json) to compare them under load.
+"""
+
+import os
+import json
+import logging
+from typing import Any, Callable, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("orjson", "msgspec", "json")
+
+
+def _stdlib_codec() -> Tuple[Callable, Callable]:
+    encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+    def dumps(obj: Any) -> bytes:
+        return encoder.encode(obj).encode("utf-8")
+
+    return json.loads, dumps
+
+
+def _orjson_codec() -> Tuple[Callable, Callable]:
+    import orjson
+
+    # orjson.JSONDecodeError is a json.JSONDecodeError
+    return orjson.loads, orjson.dumps
+
+
+def _msgspec_codec() -> Tuple[Callable, Callable]:
+    import msgspec
+
+    decoder = msgspec.json.Decoder()
+    encoder = msgspec.json.Encoder()
+
+    def loads(data: Union[bytes, str]) -> Any:
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+    return loads, encoder.encode
+
+
+_FACTORIES = {
+    "orjson": _orjson_codec,
+    "msgspec": _msgspec_codec,
+    "json": _stdlib_codec,
+}
+
+
+def _select(name: str) -> Tuple[str, Callable, Callable]:
+    """Load the requested backend, or the first available one for 'auto'"""
+    candidates = BACKENDS if name == "auto" else (name, "json")
+    for candidate in candidates:
+        factory = _FACTORIES.get(candidate)
+        if factory is None:
+            logger.warning("Unknown JSON codec %r, falling back", candidate)
+            continue
+        try:
+            return (candidate,) + factory()
+        except ImportError:
+            if name != "auto":
+                logger.warning("JSON codec %r is not installed, falling back to json", candidate)
+    raise RuntimeError("No JSON codec available")
+
+
+backend, _loads, _dumps = _select(os.environ.get("PROXY_JSON_CODEC", "auto").lower())
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """Decode JSON from bytes or str
+
+    Raises:
+        ValueError: If the data is not valid JSON
+    """
+    return _loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode an object as compact UTF-8 JSON bytes"""
+    return _dumps(obj)
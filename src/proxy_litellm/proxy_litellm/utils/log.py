@@ -0,0 +1,218 @@
+"""Non-blocking logging setup and request body sampling.
+
+All configured handlers are moved behind a queue that is drained by a
+background writer thread, so the event loop only fills in the message and
+enqueues the record; the handlers' formatting and disk I/O happen in the
+writer thread.
+"""
+
+import os
+import copy
+import queue
+import atexit
+import random
+import logging
+import logging.config
+import threading
+from binascii import crc32
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class SamplingFilter(logging.Filter):
+    """Passes only a fraction of records at or below max_level.
+
+    Attach it to a logger or handler in log_conf.yaml to keep a sample of
+    noisy debug output instead of all or nothing.
+    """
+
+    def __init__(self, rate: float = 1.0, max_level: str = "DEBUG", name: str = ""):
+        super().__init__(name)
+        self.rate = float(rate)
+        self.max_level = logging.getLevelName(max_level) if isinstance(max_level, str) else max_level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class LogWriter(threading.Thread):
+    """Background thread that hands queued records to their real handlers"""
+
+    def __init__(self, maxsize: int = 10000):
+        super().__init__(name="log-writer", daemon=True)
+        self.queue: queue.Queue = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, handlers: Tuple[logging.Handler, ...], record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait((handlers, record))
+        except queue.Full:
+            # Never block the event loop on logging
+            self.dropped += 1
+
+    def run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            handlers, record = item
+            for handler in handlers:
+                if record.levelno >= handler.level:
+                    try:
+                        handler.handle(record)
+                    except Exception:
+                        handler.handleError(record)
+
+    def stop(self) -> None:
+        """Flush pending records and stop the thread"""
+        if self.is_alive():
+            self.queue.put(_STOP)
+            self.join(timeout=5)
+
+
+class AsyncQueueHandler(logging.Handler):
+    """Enqueues records for the LogWriter instead of emitting them.
+
+    As with logging.handlers.QueueHandler, the message is interpolated (with
+    any traceback) before the record is queued, so the writer thread never
+    sees the caller's live argument objects, which may change or be freed
+    meanwhile.
+    """
+
+    def __init__(self, writer: LogWriter, handlers: List[logging.Handler]):
+        super().__init__(logging.NOTSET)
+        self.writer = writer
+        self.targets = tuple(handlers)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        msg = self.format(record)
+        record = copy.copy(record)
+        record.message = msg
+        record.msg = msg
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.stack_info = None
+        return record
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.writer.put(self.targets, self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+
+_writer: Optional[LogWriter] = None
+
+
+def _install_queue(writer: LogWriter) -> None:
+    """Replace the handlers of every configured logger with queue handlers"""
+    loggers = [logging.getLogger()]
+    loggers.extend(
+        existing for existing in logging.Logger.manager.loggerDict.values()
+        if isinstance(existing, logging.Logger)
+    )
+    wrapped: Dict[Tuple[int, ...], AsyncQueueHandler] = {}
+    for target in loggers:
+        handlers = [h for h in target.handlers if not isinstance(h, AsyncQueueHandler)]
+        if not handlers:
+            continue
+        key = tuple(id(h) for h in handlers)
+        if key not in wrapped:
+            wrapped[key] = AsyncQueueHandler(writer, handlers)
+        target.handlers = [wrapped[key]]
+
+
+def setup_logging(config_path: Optional[str] = None) -> None:
+    """Configure logging from the YAML config and move output off the caller's thread
+
+    Args:
+        config_path: Path of the dictConfig YAML file, defaults to LOG_CONFIG or log_conf.yaml
+    """
+    global _writer
+
+    config_path = config_path or os.environ.get("LOG_CONFIG", "log_conf.yaml")
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            logging.config.dictConfig(yaml.safe_load(f))
+    else:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+            handlers=[logging.StreamHandler()]
+        )
+
+    if os.environ.get("LOG_ASYNC", "true").lower() not in ("1", "true", "yes"):
+        return
+
+    if _writer is not None:
+        _writer.stop()
+    _writer = LogWriter(int(os.environ.get("LOG_QUEUE_SIZE", "10000")))
+    _writer.start()
+    atexit.register(_writer.stop)
+    _install_queue(_writer)
+
+
+def dropped_records() -> int:
+    """Number of records dropped because the log queue was full"""
+    return _writer.dropped if _writer is not None else 0
+
+
+class BodyLogPolicy:
+    """Decides which requests get their bodies logged.
+
+    Modes (LOG_BODIES):
+        off: never log bodies
+        errors: log bodies of failed requests only
+        sample: log bodies of a LOG_BODY_SAMPLE_RATE fraction of requests, and of failed ones
+        all: log every body
+    Sampling is decided per request id, so all bodies of a request are kept together.
+    """
+
+    MODES = ("off", "errors", "sample", "all")
+
+    def __init__(self, mode: str = "off", rate: float = 0.01, max_chars: int = 16384):
+        if mode not in self.MODES:
+            logger.warning("Unknown LOG_BODIES mode %r, using 'off'", mode)
+            mode = "off"
+        self.mode = mode
+        self.rate = rate
+        self.max_chars = max_chars
+        self._threshold = int(rate * 0xFFFFFFFF)
+        self.logger = logging.getLogger("proxy_litellm.bodies")
+
+    @classmethod
+    def from_env(cls) -> "BodyLogPolicy":
+        return cls(
+            mode=os.environ.get("LOG_BODIES", "off").lower(),
+            rate=float(os.environ.get("LOG_BODY_SAMPLE_RATE", "0.01")),
+            max_chars=int(os.environ.get("LOG_BODY_MAX_CHARS", "16384"))
+        )
+
+    def sampled(self, request_id: str) -> bool:
+        """Whether bodies of a successful request should be logged"""
+        if self.mode == "all":
+            return True
+        if self.mode == "sample":
+            return crc32(request_id.encode()) <= self._threshold
+        return False
+
+    def log(self, request_id: str, label: str, body: Any) -> None:
+        """Log a body if the request is sampled"""
+        if self.sampled(request_id):
+            self.logger.info("[%s] %s: %.*s", request_id, label, self.max_chars, body, stacklevel=2)
+
+    def log_failure(self, request_id: str, label: str, body: Any) -> None:
+        """Log a body of a failed request"""
+        if self.mode != "off":
+            self.logger.error("[%s] %s: %.*s", request_id, label, self.max_chars, body, stacklevel=2)
+
+
+body_logging = BodyLogPolicy.from_env()
@@ -0,0 +1,161 @@
+"""Binary content blocks carried as spans of the request body.
+
+Converse requests carry images, documents and videos as base64 strings in
+"bytes" fields. Parsing turns them into Python strings, and every later
+step (the request model dump, the OpenAI data URI, the encoded payload)
+used to copy them again. split_spans cuts large "bytes" strings out of the
+body before it is parsed, restore_spans puts BinarySpan references to the
+body in their place, and encode_parts serializes a request holding spans
+as chunks that point into the body. The base64 is never decoded or copied,
+so a request costs about the size of its body however many images it has.
+"""
+
+import hashlib
+import secrets
+from typing import Any, List, Tuple, Union
+
+from . import json_codec
+
+# Smaller strings are parsed as usual
+MIN_SPAN_BYTES = 1024
+
+_BYTES_KEY = b'"bytes"'
+_WHITESPACE = b" \t\r\n"
+
+
+class BinarySpan:
+    """A JSON string value in a request body, by offsets"""
+
+    __slots__ = ("buffer", "start", "end", "_digest")
+
+    def __init__(self, buffer: bytes, start: int, end: int):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self._digest = None
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def view(self) -> memoryview:
+        return memoryview(self.buffer)[self.start:self.end]
+
+    def digest(self) -> str:
+        if self._digest is None:
+            self._digest = hashlib.blake2b(self.view(), digest_size=16).hexdigest()
+        return self._digest
+
+    def __str__(self) -> str:
+        # Stands in for the content in request fingerprints and body logs
+        return f"<{len(self)} bytes {self.digest()}>"
+
+    __repr__ = __str__
+
+
+class DataURI:
+    """A base64 data: URI built around a span when the request is encoded"""
+
+    __slots__ = ("media_type", "data")
+
+    def __init__(self, media_type: str, data: Union[str, BinarySpan]):
+        self.media_type = media_type
+        self.data = data
+
+    def __repr__(self) -> str:
+        return f"data:{self.media_type};base64,{self.data!r}"
+
+
+def split_spans(body: bytes) -> Tuple[bytes, List[BinarySpan], str]:
+    """Replace large "bytes" strings of a JSON body with placeholders.
+
+    Returns the body to parse, the spans cut out and the placeholder
+    prefix; the i-th span's placeholder is f"{prefix}{i}". Strings with
+    escapes are left in place, their raw bytes would not be their value.
+    """
+    spans: List[BinarySpan] = []
+    pieces: List[bytes] = []
+    prefix = f"{secrets.token_hex(16)}:"
+    pos = 0
+    find = body.find(_BYTES_KEY)
+    while find != -1:
+        # An escaped quote means the match is inside a string
+        i = find + len(_BYTES_KEY)
+        if find == 0 or body[find - 1] != 0x5C:
+            while i < len(body) and body[i] in _WHITESPACE:
+                i += 1
+            if body[i:i + 1] == b":":
+                i += 1
+                while i < len(body) and body[i] in _WHITESPACE:
+                    i += 1
+                if body[i:i + 1] == b'"':
+                    start = i + 1
+                    end = body.find(b'"', start)
+                    if end - start >= MIN_SPAN_BYTES and body.find(b"\\", start, end) == -1:
+                        pieces.append(body[pos:start])
+                        pieces.append(f"{prefix}{len(spans)}".encode())
+                        spans.append(BinarySpan(body, start, end))
+                        pos = i = end
+        find = body.find(_BYTES_KEY, i)
+    if not spans:
+        return body, spans, prefix
+    pieces.append(body[pos:])
+    return b"".join(pieces), spans, prefix
+
+
+def restore_spans(value: Any, spans: List[BinarySpan], prefix: str) -> Any:
+    """Put the spans back in place of their placeholders in a parsed body"""
+    if isinstance(value, dict):
+        for k, v in value.items():
+            if isinstance(v, (dict, list)):
+                restore_spans(v, spans, prefix)
+            elif isinstance(v, str) and v.startswith(prefix):
+                value[k] = spans[int(v[len(prefix):])]
+    elif isinstance(value, list):
+        for k, v in enumerate(value):
+            if isinstance(v, (dict, list)):
+                restore_spans(v, spans, prefix)
+            elif isinstance(v, str) and v.startswith(prefix):
+                value[k] = spans[int(v[len(prefix):])]
+    return value
+
+
+def encode_parts(obj: Any) -> Tuple[List[Union[bytes, memoryview]], int]:
+    """Serialize obj to JSON as chunks, with spans referenced rather than copied.
+
+    Returns the chunks and their total length.
+    """
+    refs: List[Union[BinarySpan, DataURI]] = []
+    prefix = secrets.token_hex(16)
+
+    def replace(value: Any) -> Any:
+        if isinstance(value, dict):
+            return {k: replace(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [replace(v) for v in value]
+        if isinstance(value, DataURI) and isinstance(value.data, str):
+            return f"data:{value.media_type};base64,{value.data}"
+        if isinstance(value, (BinarySpan, DataURI)):
+            refs.append(value)
+            return f"{prefix}{len(refs) - 1}"
+        return value
+
+    data = json_codec.dumps(replace(obj))
+    if not refs:
+        return [data], len(data)
+
+    parts: List[Union[bytes, memoryview]] = []
+    pos = 0
+    for i, ref in enumerate(refs):
+        marker = f'"{prefix}{i}"'.encode()
+        at = data.index(marker, pos)
+        parts.append(data[pos:at])
+        if isinstance(ref, DataURI):
+            parts.append(f'"data:{ref.media_type};base64,'.encode())
+            ref = ref.data
+        else:
+            parts.append(b'"')
+        parts.append(ref.view())
+        parts.append(b'"')
+        pos = at + len(marker)
+    parts.append(data[pos:])
+    return parts, sum(len(part) for part in parts)
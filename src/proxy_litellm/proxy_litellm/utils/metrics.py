@@ -0,0 +1,214 @@
+"""Minimal in-process Prometheus metrics.
+
+Metrics are only updated from the event loop thread, so plain integer and
+list updates are enough and no locks are taken on the hot path. Label
+values are passed positionally; series() returns a bound child that can be
+kept for the lifetime of a stream to skip the label lookup per update.
+"""
+
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Label values beyond this many series per metric are folded into "other",
+# since model ids come from the request path
+MAX_SERIES = 1000
+OVERFLOW_LABEL = "other"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+GAP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+RATE_BUCKETS = (1.0, 5.0, 10.0, 20.0, 30.0, 50.0, 75.0, 100.0, 150.0, 200.0, 300.0, 500.0, 1000.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_sample(name: str, labelnames: Sequence[str], labels: Sequence[str], extra: str, value: float) -> str:
+    """One sample line in the Prometheus text format"""
+    return f"{name}{_format_labels(labelnames, labels, extra)} {_format_value(value)}"
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Tuple[str, ...]) -> Tuple[str, ...]:
+        if labels in self._series or len(self._series) < MAX_SERIES:
+            return labels
+        return (OVERFLOW_LABEL,) * len(self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonic counter"""
+
+    type = "counter"
+
+    def series(self, *labels: str) -> _Value:
+        key = self._key(labels)
+        value = self._series.get(key)
+        if value is None:
+            value = self._series[key] = _Value()
+        return value
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.series(*labels).value += amount
+
+    def samples(self) -> Iterable[Tuple[str, Tuple[str, ...], str, float]]:
+        for labels, value in self._series.items():
+            yield self.name, labels, "", value.value
+
+
+class Gauge(Counter):
+    """Value that can go up and down
+
+    aggregate says how values from several worker processes are combined:
+    sum (default), max or min.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), aggregate: str = "sum"):
+        super().__init__(name, documentation, labelnames)
+        self.aggregate = aggregate
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.series(*labels).value -= amount
+
+    def set(self, value: float, *labels: str) -> None:
+        self.series(*labels).value = value
+
+
+class _HistogramSeries:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # One slot per bucket plus +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    """Histogram with fixed buckets"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def series(self, *labels: str) -> _HistogramSeries:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(self.buckets)
+        return series
+
+    def observe(self, value: float, *labels: str) -> None:
+        self.series(*labels).observe(value)
+
+    def samples(self) -> Iterable[Tuple[str, Tuple[str, ...], str, float]]:
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series.counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels, f'le="{_format_value(bound)}"', cumulative
+            yield f"{self.name}_sum", labels, "", series.sum
+            yield f"{self.name}_count", labels, "", cumulative
+
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[_Metric]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), aggregate: str = "sum") -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, aggregate))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[_Metric]]) -> None:
+        """Register a callback producing metrics at render time, e.g. pool stats"""
+        self._collectors.append(collector)
+
+    def collect(self) -> List[_Metric]:
+        metrics = list(self._metrics.values())
+        for collector in self._collectors:
+            metrics.extend(collector())
+        return metrics
+
+    def render(self, metrics: Optional[List[_Metric]] = None) -> str:
+        lines: List[str] = []
+        for metric in metrics if metrics is not None else self.collect():
+            lines.extend(metric.header())
+            for name, labels, extra, value in metric.samples():
+                lines.append(format_sample(name, metric.labelnames, labels, extra, value))
+        lines.append("")
+        return "\n".join(lines)
+
+    def snapshot(self) -> List[list]:
+        """Current samples of all metrics in a JSON-serializable form, see utils.shared_metrics"""
+        return [
+            [metric.name, metric.type, metric.documentation, list(metric.labelnames),
+             getattr(metric, "aggregate", "sum"),
+             [[name, list(labels), extra, value] for name, labels, extra, value in metric.samples()]]
+            for metric in self.collect()
+        ]
+
+
+registry = Registry()
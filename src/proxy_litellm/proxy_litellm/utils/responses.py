@@ -0,0 +1,36 @@
+"""Streaming response with cleanup that runs however the response ends"""
+
+import logging
+from typing import Callable, List
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that runs its close callbacks once it is done.
+
+    Cleanup in the finally block of a body iterator is skipped if the client
+    disconnects before the first chunk is pulled, since the iterator never
+    starts. Callbacks added with call_on_close run when the response has
+    been sent, abandoned or has failed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._on_close: List[Callable[[], None]] = []
+
+    def call_on_close(self, callback: Callable[[], None]) -> None:
+        self._on_close.append(callback)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            for callback in self._on_close:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error("Error closing streaming response: %s", e)
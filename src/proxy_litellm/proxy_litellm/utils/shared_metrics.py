@@ -0,0 +1,236 @@
+"""Metrics shared between worker processes through shared memory.
+
+Each worker periodically publishes a snapshot of its registry into its own
+slot of a shared memory segment. /metrics in any worker reads every slot
+and merges the samples, so the container is reported as a whole. When a
+worker exits, the launcher folds its counters and histograms into a
+retired slot so totals don't go backwards.
+
+Slots are written by one process only and read with a seqlock: the writer
+makes the slot's sequence number odd while it copies the data in, and
+readers retry if the number was odd or changed while they read.
+"""
+
+import os
+import time
+import struct
+import asyncio
+import logging
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import json_codec
+from .metrics import registry, format_sample
+
+logger = logging.getLogger(__name__)
+
+# Header: global sequence number (changed while a worker is retired), slot count, slot size
+_HEADER = struct.Struct("<QQQ")
+# Slot header: sequence number, data length
+_SLOT = struct.Struct("<QQ")
+# Give up on a slot that keeps changing while it is read
+_READ_RETRIES = 100
+
+
+class SharedMetrics:
+    """Shared memory segment with one metrics snapshot slot per worker.
+
+    The last slot holds the accumulated counters of exited workers and is
+    only written by the launcher.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool = False):
+        self.shm = shm
+        self.owner = owner
+        _, self.slots, self.slot_size = _HEADER.unpack_from(shm.buf, 0)
+        self.retired_slot = self.slots - 1
+
+    @classmethod
+    def create(cls, workers: int, slot_size: int) -> "SharedMetrics":
+        """Create a segment for workers worker slots plus the retired slot"""
+        slots = workers + 1
+        shm = shared_memory.SharedMemory(create=True, size=_HEADER.size + slots * (_SLOT.size + slot_size))
+        _HEADER.pack_into(shm.buf, 0, 0, slots, slot_size)
+        for slot in range(slots):
+            _SLOT.pack_into(shm.buf, cls._offset(slot, slot_size), 0, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedMetrics":
+        # Workers are started by the launcher's multiprocessing context and
+        # share its resource tracker, so attaching doesn't hand them ownership
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @staticmethod
+    def _offset(slot: int, slot_size: int) -> int:
+        return _HEADER.size + slot * (_SLOT.size + slot_size)
+
+    def write(self, slot: int, data: bytes) -> bool:
+        """Publish data to slot; returns False if it does not fit"""
+        if len(data) > self.slot_size:
+            return False
+        buf = self.shm.buf
+        offset = self._offset(slot, self.slot_size)
+        seq = _SLOT.unpack_from(buf, offset)[0]
+        _SLOT.pack_into(buf, offset, seq + 1, 0)
+        start = offset + _SLOT.size
+        buf[start:start + len(data)] = data
+        _SLOT.pack_into(buf, offset, seq + 2, len(data))
+        return True
+
+    def read(self, slot: int) -> bytes:
+        """Return a consistent copy of slot's data"""
+        buf = self.shm.buf
+        offset = self._offset(slot, self.slot_size)
+        start = offset + _SLOT.size
+        for _ in range(_READ_RETRIES):
+            seq, length = _SLOT.unpack_from(buf, offset)
+            if seq & 1:
+                time.sleep(0)
+                continue
+            data = bytes(buf[start:start + length])
+            if _SLOT.unpack_from(buf, offset)[0] == seq:
+                return data
+        logger.warning("Metrics slot %d kept changing while being read", slot)
+        return b""
+
+    def _global_seq(self) -> int:
+        return _HEADER.unpack_from(self.shm.buf, 0)[0]
+
+    def _set_global_seq(self, seq: int) -> None:
+        _HEADER.pack_into(self.shm.buf, 0, seq, self.slots, self.slot_size)
+
+    def read_all(self) -> List[bytes]:
+        """Read every slot, retrying while a worker is being retired"""
+        for _ in range(_READ_RETRIES):
+            seq = self._global_seq()
+            if seq & 1:
+                time.sleep(0)
+                continue
+            data = [self.read(slot) for slot in range(self.slots)]
+            if self._global_seq() == seq:
+                return data
+        return [self.read(slot) for slot in range(self.slots)]
+
+    def retire(self, slot: int) -> None:
+        """Fold the counters and histograms of an exited worker into the retired slot"""
+        seq = self._global_seq()
+        self._set_global_seq(seq + 1)
+        try:
+            snapshots = [decode(self.read(s)) for s in (self.retired_slot, slot)]
+            merged = [
+                [name, kind, doc, labelnames, aggregate, samples]
+                for name, kind, doc, labelnames, aggregate, samples in merge(snapshots)
+                if kind != "gauge"
+            ]
+            if not self.write(self.retired_slot, json_codec.dumps(merged)):
+                logger.warning("Retired worker metrics don't fit in a metrics slot and were dropped")
+            self.write(slot, b"")
+        finally:
+            self._set_global_seq(seq + 2)
+
+    def close(self) -> None:
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def decode(data: bytes) -> List[list]:
+    return json_codec.loads(data) if data else []
+
+
+def merge(snapshots: Iterable[List[list]]) -> List[list]:
+    """Combine registry snapshots: counters and histograms are summed, gauges use their aggregate"""
+    metrics: Dict[str, list] = {}
+    values: Dict[str, Dict[Tuple, float]] = {}
+    for snapshot in snapshots:
+        for name, kind, doc, labelnames, aggregate, samples in snapshot:
+            if name not in metrics:
+                metrics[name] = [name, kind, doc, labelnames, aggregate]
+                values[name] = {}
+            merged = values[name]
+            for sample_name, labels, extra, value in samples:
+                key = (sample_name, tuple(labels), extra)
+                current = merged.get(key)
+                if current is None:
+                    merged[key] = value
+                elif aggregate == "max":
+                    merged[key] = max(current, value)
+                elif aggregate == "min":
+                    merged[key] = min(current, value)
+                else:
+                    merged[key] = current + value
+    return [
+        metrics[name] + [[[sample_name, list(labels), extra, value]
+                          for (sample_name, labels, extra), value in values[name].items()]]
+        for name in metrics
+    ]
+
+
+def render(snapshot: List[list]) -> str:
+    """Render a merged snapshot in the Prometheus text format"""
+    lines: List[str] = []
+    for name, kind, doc, labelnames, _, samples in snapshot:
+        lines.append(f"# HELP {name} {doc}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_name, labels, extra, value in samples:
+            lines.append(format_sample(sample_name, labelnames, labels, extra, value))
+    lines.append("")
+    return "\n".join(lines)
+
+
+class WorkerMetrics:
+    """Publishes this worker's metrics and renders those of all workers"""
+
+    def __init__(self, shared: SharedMetrics, slot: int, interval: float = 1.0):
+        self.shared = shared
+        self.slot = slot
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._warned = False
+
+    def publish(self) -> None:
+        if not self.shared.write(self.slot, json_codec.dumps(registry.snapshot())) and not self._warned:
+            self._warned = True
+            logger.warning("Worker metrics exceed METRICS_SLOT_SIZE (%d bytes) and are not shared", self.shared.slot_size)
+
+    def render(self) -> str:
+        self.publish()
+        return render(merge(decode(data) for data in self.shared.read_all()))
+
+    async def _run(self) -> None:
+        while True:
+            self.publish()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Final counts, picked up by the launcher when this worker is retired
+        self.publish()
+
+
+def from_env() -> Optional[WorkerMetrics]:
+    """Attach to the segment named by the launcher, if this process is one of its workers"""
+    name = os.environ.get("PROXY_METRICS_SHM")
+    if not name:
+        return None
+    slot = int(os.environ["PROXY_WORKER_SLOT"])
+    interval = float(os.environ.get("METRICS_PUBLISH_INTERVAL", "1"))
+    return WorkerMetrics(SharedMetrics.attach(name), slot, interval)
+
+
+worker_metrics = from_env()
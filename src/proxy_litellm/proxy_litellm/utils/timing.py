@@ -0,0 +1,91 @@
+"""Per-request phase timing"""
+
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+# Phases in the order a request goes through them
+PHASES = ("parse", "convert", "connect", "ttfb", "relay")
+
+
+class RequestTiming:
+    """Records how long a request spends in each phase.
+
+    mark(phase) attributes the time since the previous mark to the phase, so
+    callers only mark the end of each step. Marking the same phase twice adds
+    to it.
+    """
+
+    __slots__ = ("request_id", "model_id", "handler_type", "stream", "status",
+                 "start", "end", "wall_start", "phases", "_last")
+
+    def __init__(self, request_id: str = "", model_id: str = "", handler_type: str = "",
+                 stream: bool = False, start: Optional[float] = None):
+        self.request_id = request_id
+        self.model_id = model_id
+        self.handler_type = handler_type
+        self.stream = stream
+        self.status = 200
+        self.start = start if start is not None else time.perf_counter()
+        self.end: Optional[float] = None
+        self.wall_start = time.time() - (time.perf_counter() - self.start)
+        self.phases: Dict[str, float] = {}
+        self._last = self.start
+
+    def mark(self, phase: str) -> float:
+        """Attribute the time since the previous mark to phase"""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self._last)
+        self._last = now
+        return now
+
+    def finish(self, status: Optional[int] = None) -> float:
+        """Stop the clock and return the total duration in seconds"""
+        if status is not None:
+            self.status = status
+        if self.end is None:
+            self.end = time.perf_counter()
+        return self.end - self.start
+
+    @property
+    def total(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def server_timing(self) -> str:
+        """Format the recorded phases as a Server-Timing header value"""
+        parts = [f"{phase};dur={duration * 1000:.2f}" for phase, duration in self.phases.items()]
+        parts.append(f"total;dur={self.total * 1000:.2f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "model": self.model_id,
+            "handler": self.handler_type,
+            "stream": self.stream,
+            "status": self.status,
+            "started_at": round(self.wall_start, 3),
+            "total_ms": round(self.total * 1000, 3),
+            "phases_ms": {phase: round(duration * 1000, 3) for phase, duration in self.phases.items()}
+        }
+
+
+class SlowRequestLog:
+    """Ring buffer with the phase breakdown of the latest slow requests"""
+
+    def __init__(self, threshold: float = 5.0, size: int = 100):
+        self.threshold = threshold
+        self.recorded = 0
+        self._entries: deque = deque(maxlen=size)
+
+    def record(self, timing: RequestTiming) -> bool:
+        """Keep the timing if the request was over the threshold"""
+        if timing.total < self.threshold:
+            return False
+        self.recorded += 1
+        self._entries.append(timing.to_dict())
+        return True
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Return the buffered requests, newest first"""
+        return list(reversed(self._entries))
@@ -0,0 +1,4 @@
+import os
+
+# Importing the package creates the app, whose Bedrock handler needs an endpoint
+os.environ.setdefault("LITELLM_ENDPOINT", "http://localhost:4000")
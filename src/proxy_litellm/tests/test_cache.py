@@ -0,0 +1,69 @@
+import pytest
+from starlette.requests import Request
+
+from proxy_litellm.core.cache import cache_bypassed, fingerprint, is_deterministic
+
+REQUEST = {
+    "messages": [{"role": "user", "content": [{"text": "hello"}]}],
+    "inferenceConfig": {"temperature": 0, "maxTokens": 100},
+}
+
+
+def _raw_request(headers):
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    })
+
+
+def test_fingerprint_ignores_key_order_nulls_and_metadata():
+    reordered = {
+        "inferenceConfig": {"maxTokens": 100, "temperature": 0, "topP": None},
+        "messages": [{"content": [{"text": "hello"}], "role": "user"}],
+        "system": None,
+        "requestMetadata": {"team": "a"},
+    }
+    assert fingerprint("m", REQUEST, "k") == fingerprint("m", reordered, "k")
+
+
+@pytest.mark.parametrize("model_id, request_, api_key, extra", [
+    ("other", REQUEST, "k", ()),
+    ("m", REQUEST, "other", ()),
+    ("m", {**REQUEST, "inferenceConfig": {"temperature": 0, "maxTokens": 101}}, "k", ()),
+    ("m", {**REQUEST, "messages": [{"role": "user", "content": [{"text": "hello!"}]}]}, "k", ()),
+    ("m", REQUEST, "k", ("stream",)),
+])
+def test_fingerprint_differs(model_id, request_, api_key, extra):
+    assert fingerprint(model_id, request_, api_key, *extra) != fingerprint("m", REQUEST, "k")
+
+
+def test_fingerprint_parts_are_separated():
+    assert fingerprint("ab", REQUEST, "c") != fingerprint("a", REQUEST, "bc")
+
+
+def test_is_deterministic():
+    assert is_deterministic(REQUEST)
+    assert not is_deterministic({**REQUEST, "inferenceConfig": {"temperature": 0.5}})
+    assert not is_deterministic({"messages": []})
+
+
+@pytest.mark.parametrize("value, bypassed", [
+    ("true", True), ("1", True), ("YES", True), ("false", False), ("", False),
+    (True, True), (1, True), (False, False), (0, False), (None, False),
+])
+def test_cache_bypassed_metadata(value, bypassed):
+    assert cache_bypassed({**REQUEST, "requestMetadata": {"cacheBypass": value}}, None) is bypassed
+
+
+@pytest.mark.parametrize("headers, bypassed", [
+    ({}, False),
+    ({"x-cache-bypass": "true"}, True),
+    ({"x-cache-bypass": "no"}, False),
+    ({"cache-control": "no-cache"}, True),
+    ({"cache-control": "max-age=0, no-store"}, True),
+    ({"cache-control": "max-age=60"}, False),
+])
+def test_cache_bypassed_headers(headers, bypassed):
+    assert cache_bypassed(REQUEST, _raw_request(headers)) is bypassed
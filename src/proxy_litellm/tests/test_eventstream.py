@@ -0,0 +1,114 @@
+import random
+from binascii import crc32
+from struct import pack
+
+import pytest
+
+from proxy_litellm.utils.eventstream import (
+    _MAX_MESSAGE_LENGTH, EventStreamFramer, EventStreamMessageEncoder, iter_messages
+)
+
+
+def _message(i: int) -> bytes:
+    return EventStreamMessageEncoder.encode(
+        {":event-type": "contentBlockDelta", ":message-type": "event"},
+        {"contentBlockIndex": 0, "delta": {"text": f"token {i} " * (i % 7)}})
+
+
+def _prelude(total_length: int, headers_length: int = 0) -> bytes:
+    lengths = pack("!II", total_length, headers_length)
+    return lengths + pack("!I", crc32(lengths))
+
+
+def test_whole_read_is_returned_without_copy():
+    data = b"".join(_message(i) for i in range(3))
+    framer = EventStreamFramer()
+    framer.feed(data)
+    assert framer.drain() is data
+    assert framer.message_count == 3
+    assert framer.pending == 0
+
+
+def test_split_prelude():
+    message = _message(1)
+    for split in (1, 5, 8, 11, 12, 13):
+        framer = EventStreamFramer()
+        framer.feed(message[:split])
+        assert framer.drain() == b""
+        framer.feed(message[split:])
+        assert framer.drain() == message
+        assert framer.pending == 0
+
+
+def test_random_splits():
+    messages = [_message(i) for i in range(50)]
+    data = b"".join(messages)
+    rng = random.Random(4)
+    for _ in range(50):
+        framer = EventStreamFramer(compact_threshold=256)
+        out = []
+        pos = 0
+        while pos < len(data):
+            size = rng.randint(1, 400)
+            framer.feed(data[pos:pos + size])
+            pos += size
+            out.append(framer.drain())
+        assert b"".join(out) == data
+        assert framer.message_count == len(messages)
+        assert framer.pending == 0
+
+
+def test_last_message_offset():
+    messages = [_message(i) for i in range(3)]
+    framer = EventStreamFramer()
+    framer.feed(b"".join(messages) + messages[0][:4])
+    drained = framer.drain()
+    assert framer.last_count == 3
+    assert drained[framer.last_message_offset:] == messages[2]
+    assert [headers[":event-type"] for headers, _ in iter_messages(drained)] == ["contentBlockDelta"] * 3
+    assert framer.pending == 4
+
+
+def test_bad_prelude_crc():
+    message = bytearray(_message(1))
+    message[8] ^= 0xFF
+    framer = EventStreamFramer()
+    framer.feed(bytes(message))
+    with pytest.raises(ValueError):
+        framer.drain()
+
+
+def test_bad_prelude_after_good_message():
+    framer = EventStreamFramer()
+    framer.feed(_message(1) + b"HTTP/1.1 200 OK\r\n")
+    with pytest.raises(ValueError):
+        framer.drain()
+
+
+def test_max_message_length():
+    framer = EventStreamFramer()
+    framer.feed(_prelude(_MAX_MESSAGE_LENGTH + 1))
+    with pytest.raises(ValueError):
+        framer.drain()
+
+    # At the limit the message is waited for
+    framer = EventStreamFramer()
+    framer.feed(_prelude(_MAX_MESSAGE_LENGTH))
+    assert framer.drain() == b""
+
+
+def test_min_message_length():
+    framer = EventStreamFramer()
+    framer.feed(_prelude(15) + b"\0" * 8)
+    with pytest.raises(ValueError):
+        framer.drain()
+
+
+def test_read_size_adapts():
+    framer = EventStreamFramer(min_read_size=1024, max_read_size=4096)
+    framer.feed(_message(1) * 200)
+    framer.drain()
+    assert framer.read_size == 2048
+    for _ in range(3):
+        framer.feed(b"")
+    assert framer.read_size == 1024
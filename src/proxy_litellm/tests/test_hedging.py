@@ -0,0 +1,120 @@
+import asyncio
+
+from fastapi.responses import Response
+
+from proxy_litellm.core.hedging import Hedger, LatencyWindow, hedging_enabled
+
+
+def _hedger(latency=0.02, samples=20, **kwargs):
+    hedger = Hedger(percentile=95, min_delay=0.01, min_samples=samples, **kwargs)
+    for _ in range(samples):
+        hedger.observe("m", latency)
+    return hedger
+
+
+def _attempt(latencies, statuses=None, started=None):
+    """Attempt whose n-th call takes latencies[n-1] seconds"""
+    async def attempt(number):
+        if started is not None:
+            started.append(number)
+        await asyncio.sleep(latencies[number - 1])
+        status = statuses[number - 1] if statuses else 200
+        return Response(str(number).encode(), status_code=status)
+    return attempt
+
+
+def test_latency_window_percentile():
+    window = LatencyWindow(size=100)
+    for i in range(100):
+        window.add(float(i))
+    assert window.percentile(95, min_samples=10) == 95.0
+    assert LatencyWindow().percentile(95, min_samples=1) is None
+
+
+def test_latency_window_keeps_the_latest_samples():
+    window = LatencyWindow(size=4)
+    for latency in (9.0, 9.0, 9.0, 9.0, 1.0, 1.0, 1.0, 1.0):
+        window.add(latency)
+    assert window.percentile(99, min_samples=4) == 1.0
+
+
+def test_no_hedge_until_enough_samples():
+    hedger = _hedger(samples=5)
+    hedger.min_samples = 20
+    assert hedger.delay("m") is None
+    assert hedger.delay("unknown") is None
+    started = []
+
+    async def run():
+        return await hedger.run("m", _attempt([0.05, 0.0], started=started))
+
+    assert asyncio.run(run()).body == b"1"
+    assert started == [1]
+
+
+def test_delay_is_at_least_min_delay():
+    assert _hedger(latency=0.001).delay("m") == 0.01
+    assert _hedger(latency=0.5).delay("m") == 0.5
+
+
+def test_slow_request_is_hedged_and_second_attempt_wins():
+    hedger = _hedger(budget_percent=100)
+    hedger.balance = 5
+    started = []
+
+    async def run():
+        return await hedger.run("m", _attempt([1.0, 0.0], started=started))
+
+    assert asyncio.run(run()).body == b"2"
+    assert started == [1, 2]
+    assert hedger.balance == 5
+
+
+def test_fast_request_is_not_hedged():
+    hedger = _hedger()
+    hedger.balance = 5
+    started = []
+
+    async def run():
+        return await hedger.run("m", _attempt([0.0, 0.0], started=started))
+
+    assert asyncio.run(run()).body == b"1"
+    assert started == [1]
+
+
+def test_no_hedge_without_budget():
+    hedger = _hedger(budget_percent=5)
+    started = []
+
+    async def run():
+        return await hedger.run("m", _attempt([0.1, 0.0], started=started))
+
+    assert asyncio.run(run()).body == b"1"
+    assert started == [1]
+    assert hedger.balance == 0.05
+
+
+def test_failed_attempt_does_not_win():
+    hedger = _hedger()
+    hedger.balance = 5
+
+    async def run():
+        return await hedger.run("m", _attempt([0.1, 0.0], statuses=[200, 503]))
+
+    assert asyncio.run(run()).body == b"1"
+
+
+def test_first_attempt_result_when_both_fail():
+    hedger = _hedger()
+    hedger.balance = 5
+
+    async def run():
+        return await hedger.run("m", _attempt([0.1, 0.0], statuses=[500, 503]))
+
+    response = asyncio.run(run())
+    assert (response.body, response.status_code) == (b"1", 500)
+
+
+def test_hedging_enabled():
+    assert hedging_enabled(True)
+    assert not hedging_enabled(False)
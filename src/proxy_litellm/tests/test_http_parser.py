@@ -0,0 +1,184 @@
+import asyncio
+
+import pytest
+
+from proxy_litellm.utils.http_parser import (
+    HTTPParseError, HTTPResponseParser, read_response_body, read_response_head
+)
+
+BODY = bytes(range(256)) * 20
+CHUNKED = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Transfer-Encoding: chunked\r\n"
+    b"Content-Type: application/vnd.amazon.eventstream\r\n"
+    b"\r\n"
+    + b"".join(b"%x;name=value\r\n%s\r\n" % (len(BODY[i:i + 700]), BODY[i:i + 700]) for i in range(0, len(BODY), 700))
+    + b"0\r\n"
+    b"X-Checksum: abc\r\n"
+    b"X-Other: 1\r\n"
+    b"\r\n"
+)
+
+
+def _feed_all(parser: HTTPResponseParser, data: bytes, size: int) -> bytes:
+    out = []
+    for i in range(0, len(data), size):
+        out.extend(parser.feed(data[i:i + size]))
+    return b"".join(out)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 701, len(CHUNKED)])
+def test_chunked_with_extensions_and_trailers(size):
+    parser = HTTPResponseParser()
+    assert _feed_all(parser, CHUNKED, size) == BODY
+    assert parser.status == 200
+    assert parser.chunked
+    assert parser.message_complete
+    assert parser.keep_alive
+    assert parser.trailers == [("x-checksum", "abc"), ("x-other", "1")]
+    assert parser.body_bytes == len(BODY)
+    assert parser.bytes_received == len(CHUNKED)
+
+
+@pytest.mark.parametrize("size", [1, 5, 100])
+def test_content_length(size):
+    data = b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(BODY), BODY)
+    parser = HTTPResponseParser()
+    assert _feed_all(parser, data, size) == BODY
+    assert parser.message_complete
+    assert not parser.keep_alive
+    assert parser.header("content-length") == str(len(BODY))
+
+
+def test_interim_response_is_skipped():
+    parser = HTTPResponseParser()
+    body = parser.feed(b"HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 201 Created\r\nContent-Length: 2\r\n\r\nok")
+    assert body == [b"ok"]
+    assert parser.status == 201
+
+
+def test_body_until_close():
+    parser = HTTPResponseParser()
+    body = parser.feed(b"HTTP/1.1 200 OK\r\n\r\nabc")
+    assert not parser.message_complete
+    parser.feed_eof()
+    assert body == [b"abc"]
+    assert parser.message_complete
+    assert not parser.keep_alive
+
+
+def test_head_and_no_content_have_no_body():
+    parser = HTTPResponseParser("HEAD")
+    parser.feed(b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n")
+    assert parser.message_complete
+    parser = HTTPResponseParser()
+    parser.feed(b"HTTP/1.1 204 No Content\r\n\r\n")
+    assert parser.message_complete
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"HTTP/1.1 200 OK\r\nContent-Len",
+    b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nabc",
+    b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nab",
+    b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n2\r\nab\r\n",
+    b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n0\r\nX-Checksum: abc\r\n",
+])
+def test_eof_before_complete(data):
+    parser = HTTPResponseParser()
+    parser.feed(data)
+    with pytest.raises(HTTPParseError):
+        parser.feed_eof()
+    assert not parser.message_complete
+    assert parser.bytes_received == len(data)
+
+
+@pytest.mark.parametrize("data", [
+    b"HTTP/2 200 OK\r\n\r\n",
+    b"HTTP/1.1 20 OK\r\n\r\n",
+    b"HTTP/1.1 200 OK\r\nbad header\r\n\r\n",
+    b"HTTP/1.1 200 OK\r\nContent-Length: -1\r\n\r\n",
+    b"HTTP/1.1 200 OK\r\nTransfer-Encoding: gzip\r\n\r\n",
+    b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n",
+    b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n2\r\nabXX",
+])
+def test_malformed(data):
+    with pytest.raises(HTTPParseError):
+        HTTPResponseParser().feed(data)
+
+
+def test_line_too_long():
+    parser = HTTPResponseParser(max_line_size=64)
+    with pytest.raises(HTTPParseError):
+        parser.feed(b"HTTP/1.1 200 OK\r\nX-Long: " + b"a" * 100)
+
+    parser = HTTPResponseParser(max_line_size=64)
+    parser.feed(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n")
+    with pytest.raises(HTTPParseError):
+        parser.feed(b"5;" + b"x" * 100)
+
+
+def test_data_after_message_disables_keep_alive():
+    parser = HTTPResponseParser()
+    parser.feed(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nokHTTP/1.1")
+    assert parser.message_complete
+    assert parser.unconsumed == b"HTTP/1.1"
+    assert not parser.keep_alive
+
+
+def test_relay_headers():
+    parser = HTTPResponseParser()
+    parser.feed(b"HTTP/1.1 200 OK\r\nConnection: keep-alive\r\nContent-Length: 0\r\n"
+                b"Keep-Alive: timeout=5\r\nX-Request-Id: 1\r\nContent-Type: application/json\r\n\r\n")
+    assert parser.relay_headers() == [(b"x-request-id", b"1"), (b"content-type", b"application/json")]
+
+
+def test_http10_keep_alive():
+    parser = HTTPResponseParser()
+    parser.feed(b"HTTP/1.0 200 OK\r\nContent-Length: 0\r\n\r\n")
+    assert not parser.keep_alive
+    parser = HTTPResponseParser()
+    parser.feed(b"HTTP/1.0 200 OK\r\nConnection: Keep-Alive\r\nContent-Length: 0\r\n\r\n")
+    assert parser.keep_alive
+
+
+def _reader(data: bytes, eof: bool = True) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    if eof:
+        reader.feed_eof()
+    return reader
+
+
+def test_read_response():
+    async def run():
+        parser = HTTPResponseParser()
+        reader = _reader(CHUNKED)
+        chunks = await read_response_head(reader, parser, read_size=100)
+        assert parser.headers_complete
+        return await read_response_body(reader, parser, chunks, read_size=100)
+
+    assert asyncio.run(run()) == BODY
+
+
+def test_read_response_eof_mid_body():
+    async def run():
+        parser = HTTPResponseParser()
+        reader = _reader(CHUNKED[:-200])
+        chunks = await read_response_head(reader, parser)
+        await read_response_body(reader, parser, chunks)
+
+    with pytest.raises(HTTPParseError):
+        asyncio.run(run())
+
+
+def test_read_response_eof_before_head():
+    parser = HTTPResponseParser()
+
+    async def run():
+        await read_response_head(_reader(b""), parser)
+
+    with pytest.raises(HTTPParseError):
+        asyncio.run(run())
+    # Nothing was received, so the request can be sent again
+    assert parser.bytes_received == 0
@@ -0,0 +1,95 @@
+import base64
+
+from proxy_litellm.utils import json_codec
+from proxy_litellm.utils.media import BinarySpan, DataURI, MIN_SPAN_BYTES, encode_parts, restore_spans, split_spans
+
+IMAGE = base64.b64encode(bytes(range(256)) * 8).decode()
+
+
+def _body(**fields):
+    return json_codec.dumps({
+        "messages": [{"role": "user", "content": [
+            {"text": "describe these"},
+            {"image": {"format": "png", "source": {"bytes": IMAGE}}},
+            {"document": {"format": "pdf", "name": "doc", "source": {"bytes": IMAGE[:-4]}}},
+        ]}],
+        **fields,
+    })
+
+
+def _parse(body):
+    parsed_body, spans, prefix = split_spans(body)
+    return restore_spans(json_codec.loads(parsed_body), spans, prefix), spans
+
+
+def test_round_trip():
+    body = _body()
+    parsed, spans = _parse(body)
+    assert len(spans) == 2
+    content = parsed["messages"][0]["content"]
+    image = content[1]["image"]["source"]["bytes"]
+    assert isinstance(image, BinarySpan)
+    assert bytes(image.view()) == IMAGE.encode()
+    assert bytes(content[2]["document"]["source"]["bytes"].view()) == IMAGE[:-4].encode()
+    assert content[0] == {"text": "describe these"}
+
+    parts, length = encode_parts(parsed)
+    encoded = b"".join(bytes(part) for part in parts)
+    assert len(encoded) == length
+    assert json_codec.loads(encoded) == json_codec.loads(body)
+
+
+def test_spans_point_into_the_body():
+    body = _body()
+    _, spans = _parse(body)
+    for span in spans:
+        assert span.buffer is body
+        assert body[span.start:span.end] == bytes(span.view())
+
+
+def test_small_strings_are_left_in_place():
+    body = json_codec.dumps({"image": {"source": {"bytes": "a" * (MIN_SPAN_BYTES - 1)}}})
+    parsed_body, spans, _ = split_spans(body)
+    assert spans == []
+    assert parsed_body is body
+
+
+def test_escaped_and_nested_matches_are_left_in_place():
+    escaped = ("a\\/" * MIN_SPAN_BYTES)
+    body = (b'{"text": "the \\"bytes\\": \\"' + b"b" * MIN_SPAN_BYTES + b'\\"", '
+            b'"source": {"bytes": "' + escaped.encode() + b'"}}')
+    parsed, spans = _parse(body)
+    assert spans == []
+    assert parsed == json_codec.loads(body)
+
+
+def test_whitespace_around_the_colon():
+    body = b'{"source": {"bytes" :\n "' + IMAGE.encode() + b'"}}'
+    parsed, spans = _parse(body)
+    assert len(spans) == 1
+    assert bytes(parsed["source"]["bytes"].view()) == IMAGE.encode()
+
+
+def test_span_digest_stands_in_for_the_content():
+    _, spans = _parse(_body())
+    other, _ = _parse(_body(system=[{"text": "x"}]))
+    assert str(spans[0]) == str(other["messages"][0]["content"][1]["image"]["source"]["bytes"])
+    assert str(spans[0]) != str(spans[1])
+    assert IMAGE not in str(spans[0])
+
+
+def test_data_uri_is_encoded_around_the_span():
+    _, spans = _parse(_body())
+    request = {"image_url": {"url": DataURI("image/png", spans[0])}, "small": DataURI("image/png", "AAAA")}
+    parts, length = encode_parts(request)
+    encoded = json_codec.loads(b"".join(bytes(part) for part in parts))
+    assert encoded["image_url"]["url"] == f"data:image/png;base64,{IMAGE}"
+    assert encoded["small"] == "data:image/png;base64,AAAA"
+    assert sum(len(part) for part in parts) == length
+
+
+def test_encode_parts_without_spans():
+    parts, length = encode_parts({"a": [1, "b"]})
+    assert len(parts) == 1
+    assert json_codec.loads(parts[0]) == {"a": [1, "b"]}
+    assert length == len(parts[0])
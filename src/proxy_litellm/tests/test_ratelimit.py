@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+
+import pytest
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+from proxy_litellm.core.ratelimit import RateLimiter, TokenBucket
+from proxy_litellm.models.limit_models import LimitConfig, RateLimitsConfig
+
+REQUEST = {"inferenceConfig": {"maxTokens": 100}}
+
+
+def _limiter(**config):
+    return RateLimiter(RateLimitsConfig.model_validate(config))
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, capacity=4)
+    now = bucket.updated
+    assert bucket.wait_time(4, now) == 0
+    bucket.take(4)
+    assert bucket.wait_time(1, now) == pytest.approx(0.5)
+    assert bucket.wait_time(1, now + 0.5) == 0
+    # Refills up to capacity only
+    assert bucket.wait_time(4, now + 100) == 0
+    assert bucket.tokens == 4
+
+
+def test_token_bucket_large_request_needs_a_full_bucket():
+    bucket = TokenBucket(rate=1, capacity=10)
+    now = bucket.updated
+    assert bucket.wait_time(50, now) == 0
+    bucket.take(50)
+    assert bucket.tokens == 0
+    assert bucket.wait_time(50, now) == pytest.approx(10)
+
+
+def test_disabled_limiter_admits_everything():
+    limiter = RateLimiter()
+    assert not limiter.enabled
+
+    async def run():
+        for _ in range(100):
+            await limiter.acquire("k", "m", REQUEST, stream=True)
+
+    asyncio.run(run())
+
+
+def test_requests_per_second_rejects_with_retry_after():
+    limiter = _limiter(max_wait_ms=0, default_key={"requests_per_second": 1, "burst": 2})
+
+    async def run():
+        await limiter.acquire("k", "m", REQUEST, stream=False)
+        await limiter.acquire("k", "m", REQUEST, stream=False)
+        with pytest.raises(HTTPException) as e:
+            await limiter.acquire("k", "m", REQUEST, stream=False)
+        assert e.value.status_code == 429
+        assert e.value.headers["Retry-After"] == "1"
+        # Other keys have their own bucket
+        await limiter.acquire("other", "m", REQUEST, stream=False)
+
+    asyncio.run(run())
+
+
+def test_waits_for_capacity_within_max_wait():
+    limiter = _limiter(max_wait_ms=1000, default_key={"requests_per_second": 20, "burst": 1})
+
+    async def run():
+        await limiter.acquire("k", "m", REQUEST, stream=False)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await limiter.acquire("k", "m", REQUEST, stream=False)
+        assert loop.time() - start >= 0.03
+        assert limiter.waiting == 0
+
+    asyncio.run(run())
+
+
+def test_tokens_per_minute_uses_max_tokens():
+    limiter = _limiter(max_wait_ms=0, default_max_tokens=500, models={"m": {"tokens_per_minute": 1000}})
+
+    async def run():
+        await limiter.acquire("k", "m", {}, stream=False)
+        await limiter.acquire("k", "m", REQUEST, stream=False)
+        await limiter.acquire("k", "m", {"inferenceConfig": {"maxTokens": 400}}, stream=False)
+        with pytest.raises(HTTPException) as e:
+            await limiter.acquire("k", "m", REQUEST, stream=False)
+        assert "model (tokens)" in e.value.detail
+
+    asyncio.run(run())
+
+
+def test_key_entry_by_digest_wins_over_default():
+    digest = "sha256:" + hashlib.sha256(b"k").hexdigest()
+    limiter = _limiter(max_wait_ms=0, default_key={"requests_per_second": 100},
+                       keys={digest: {"requests_per_second": 1, "burst": 1}})
+
+    async def run():
+        await limiter.acquire("k", "m", REQUEST, stream=False)
+        with pytest.raises(HTTPException):
+            await limiter.acquire("k", "m", REQUEST, stream=False)
+
+    asyncio.run(run())
+
+
+def test_key_limits_from_validation():
+    limiter = RateLimiter()
+    limits = LimitConfig(requests_per_second=1, burst=1)
+
+    async def run():
+        await limiter.acquire("k", "m", REQUEST, stream=False, key_limits=limits)
+        with pytest.raises(HTTPException):
+            await limiter.acquire("k", "m", REQUEST, stream=False, key_limits=limits)
+
+    asyncio.run(run())
+
+
+def test_changed_key_limits_keep_streams_and_spent_tokens():
+    limiter = RateLimiter()
+
+    async def run():
+        limits = LimitConfig(requests_per_second=1, burst=2, max_concurrent_streams=1)
+        permit = await limiter.acquire("k", "m", REQUEST, stream=True, key_limits=limits)
+        scope = limiter._key_scopes["k"]
+
+        limits = LimitConfig(requests_per_second=0.5, burst=2, max_concurrent_streams=1)
+        with pytest.raises(HTTPException) as e:
+            await limiter.acquire("k", "m", REQUEST, stream=True, key_limits=limits)
+        assert "key (streams)" in e.value.detail
+        assert limiter._key_scopes["k"] is scope
+        assert scope.requests.rate == 0.5
+
+        permit.release()
+        assert scope.streams == 0
+        await limiter.acquire("k", "m", REQUEST, stream=False, key_limits=limits)
+        with pytest.raises(HTTPException) as e:
+            await limiter.acquire("k", "m", REQUEST, stream=False, key_limits=limits)
+        assert "key (requests)" in e.value.detail
+
+    asyncio.run(run())
+
+
+def test_stream_slots_are_released_once():
+    limiter = _limiter(max_wait_ms=0, models={"m": {"max_concurrent_streams": 1}})
+
+    async def run():
+        permit = await limiter.acquire("k", "m", REQUEST, stream=True)
+        with pytest.raises(HTTPException) as e:
+            await limiter.acquire("k", "m", REQUEST, stream=True)
+        assert "model (streams)" in e.value.detail
+        # Non-streaming requests don't take stream slots
+        await limiter.acquire("k", "m", REQUEST, stream=False)
+        permit.release()
+        permit.release()
+        assert limiter._model_scopes["m"].streams == 0
+        await limiter.acquire("k", "m", REQUEST, stream=True)
+
+    asyncio.run(run())
+
+
+def test_stream_waiter_is_woken_on_release():
+    limiter = _limiter(max_wait_ms=1000, models={"m": {"max_concurrent_streams": 1}})
+
+    async def run():
+        permit = await limiter.acquire("k", "m", REQUEST, stream=True)
+        waiter = asyncio.create_task(limiter.acquire("k", "m", REQUEST, stream=True))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        assert limiter.waiting == 1
+        permit.release()
+        await asyncio.wait_for(waiter, 0.5)
+        assert limiter.waiting == 0
+
+    asyncio.run(run())
+
+
+def test_queue_size():
+    limiter = _limiter(max_wait_ms=1000, queue_size=1, models={"m": {"max_concurrent_streams": 0}})
+
+    async def run():
+        waiter = asyncio.create_task(limiter.acquire("k", "m", REQUEST, stream=True))
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as e:
+            await limiter.acquire("k", "m", REQUEST, stream=True)
+        assert "(queue)" in e.value.detail
+        waiter.cancel()
+
+    asyncio.run(run())
+
+
+def test_attach_releases_after_the_stream():
+    limiter = _limiter(models={"m": {"max_concurrent_streams": 2}})
+
+    async def body():
+        yield b"a"
+        yield b"b"
+
+    async def run():
+        permit = await limiter.acquire("k", "m", REQUEST, stream=True)
+        response = permit.attach(StreamingResponse(body()))
+        assert limiter._model_scopes["m"].streams == 1
+        assert [chunk async for chunk in response.body_iterator] == [b"a", b"b"]
+        assert limiter._model_scopes["m"].streams == 0
+
+        plain_permit = await limiter.acquire("k", "m", REQUEST, stream=True)
+        plain_permit.attach(Response(b"error", status_code=500))
+        assert limiter._model_scopes["m"].streams == 0
+
+    asyncio.run(run())
@@ -0,0 +1,82 @@
+import asyncio
+import itertools
+
+import pytest
+
+from proxy_litellm.core.registration import KeyStore, Registrar
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = KeyStore(str(tmp_path / "registrations.db"), max_entries=2)
+    store.open()
+    yield store
+    store.close()
+
+
+def _registrar(store):
+    registrar = Registrar(store)
+    numbers = itertools.count(1)
+
+    async def generate(access_key):
+        await asyncio.sleep(0)
+        return {"key": f"sk-{next(numbers)}", "user_id": access_key}
+
+    registrar._generate = generate
+    return registrar
+
+
+def test_master_key_registrations_reuse_the_stored_key(store):
+    registrar = _registrar(store)
+
+    async def run():
+        first, second = await asyncio.gather(registrar.register("AKIA1", True), registrar.register("AKIA1", True))
+        assert first["key"] == second["key"] == "sk-1"
+        assert (await registrar.register("AKIA1", True))["key"] == "sk-1"
+
+    asyncio.run(run())
+
+
+def test_other_registrations_get_new_keys_that_are_not_stored(store):
+    registrar = _registrar(store)
+
+    async def run():
+        assert (await registrar.register("AKIA1", True))["key"] == "sk-1"
+        assert (await registrar.register("AKIA1", False))["key"] == "sk-2"
+        assert (await registrar.register("AKIA1", False))["key"] == "sk-3"
+        assert (await registrar.register("AKIA2", False))["key"] == "sk-4"
+        assert await store.get("AKIA2") is None
+        assert (await registrar.register("AKIA1", True))["key"] == "sk-1"
+
+    asyncio.run(run())
+
+
+def test_expired_key_replaced_by_another_worker_is_picked_up(store):
+    other = KeyStore(store.path)
+    other.open()
+    registrar = _registrar(store)
+
+    async def run():
+        await store.put("AKIA1", {"key": "sk-old", "expires": "2000-01-01T00:00:00Z"})
+        # The other worker replaces the expired key first
+        await other.put("AKIA1", {"key": "sk-other"}, replaces="sk-old")
+        assert (await registrar.register("AKIA1", True))["key"] == "sk-other"
+
+        # A replacement of a key that is no longer stored keeps the stored one
+        kept = await other.put("AKIA1", {"key": "sk-late"}, replaces="sk-old")
+        assert kept["key"] == "sk-other"
+
+    asyncio.run(run())
+    other.close()
+
+
+def test_cache_is_bounded(store):
+    async def run():
+        for i in range(3):
+            await store.put(f"AKIA{i}", {"key": f"sk-{i}"})
+        assert len(store) == 2
+        assert list(store._rows) == ["AKIA1", "AKIA2"]
+        assert (await store.get("AKIA0"))["key"] == "sk-0"
+        assert list(store._rows) == ["AKIA2", "AKIA0"]
+
+    asyncio.run(run())
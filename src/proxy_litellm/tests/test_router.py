@@ -0,0 +1,111 @@
+import pytest
+from pydantic import ValidationError
+
+from proxy_litellm.core.router import ModelRouter
+from proxy_litellm.models.route_models import RoutingConfig
+from proxy_litellm.utils.bedrock import ModelCatalog
+
+
+def _router(routes, catalog=None, **config):
+    return ModelRouter(RoutingConfig.model_validate({"routes": routes, **config}), catalog)
+
+
+def test_exact_and_aliases():
+    router = _router([
+        {"model": "claude", "aliases": ["claude-latest"], "handler": "bedrock", "target_model": "anthropic.claude-v2"},
+    ])
+    for model_id in ("claude", "claude-latest"):
+        route = router.resolve(model_id)
+        assert route.handler == "bedrock"
+        assert route.model_id == "anthropic.claude-v2"
+        assert route.source == "model:0"
+
+
+def test_longest_prefix_wins():
+    router = _router([
+        {"prefix": "anthropic.", "handler": "bedrock"},
+        {"prefix": "anthropic.claude-3", "handler": "openai", "upstream": "http://claude3"},
+        {"prefix": "anthropic.", "handler": "openai"},
+    ])
+    assert router.resolve("anthropic.claude-3-sonnet").upstream == "http://claude3"
+    assert router.resolve("anthropic.claude-2").handler == "bedrock"
+    # Shorter than the longer prefix
+    assert router.resolve("anthropic.claude").handler == "bedrock"
+
+
+def test_strip_prefix():
+    router = _router([{"prefix": "bedrock/", "handler": "bedrock", "strip_prefix": True}])
+    assert router.resolve("bedrock/amazon.nova-pro").model_id == "amazon.nova-pro"
+    # Nothing left after the prefix keeps the requested id
+    assert router.resolve("bedrock/").model_id == "bedrock/"
+
+
+def test_resolution_order():
+    router = _router([
+        {"regex": "gpt-.*", "handler": "openai", "upstream": "regex"},
+        {"prefix": "gpt-4", "handler": "openai", "upstream": "prefix"},
+        {"model": "gpt-4o", "handler": "openai", "upstream": "exact"},
+    ])
+    assert router.resolve("gpt-4o").upstream == "exact"
+    assert router.resolve("gpt-4o-mini").upstream == "prefix"
+    assert router.resolve("gpt-3.5").upstream == "regex"
+
+
+def test_regex_is_a_full_match():
+    router = _router([{"regex": "o[13]", "handler": "bedrock"}])
+    assert router.resolve("o1").handler == "bedrock"
+    assert router.resolve("o1-mini").handler == "openai"
+    assert router.resolve("xo1").handler == "openai"
+
+
+def test_first_matching_regex_wins():
+    router = _router([
+        {"regex": "mistral\\..*", "handler": "openai", "upstream": "first"},
+        {"regex": "mistral\\.large.*", "handler": "openai", "upstream": "second"},
+        {"regex": "meta\\..*", "handler": "openai", "upstream": "third"},
+    ])
+    assert router.resolve("mistral.large-2").upstream == "first"
+    assert router.resolve("meta.llama3").upstream == "third"
+
+
+def test_regexes_with_groups_keep_their_meaning():
+    router = _router([
+        {"regex": "a+", "handler": "openai", "upstream": "simple"},
+        {"regex": "(\\w+)\\.\\1", "handler": "bedrock", "upstream": "backreference"},
+        {"regex": "(?P<family>ab)-(?P=family)", "handler": "bedrock", "upstream": "named"},
+        {"regex": "(?i)claude.*", "handler": "bedrock", "upstream": "flags"},
+        {"regex": "b+", "handler": "openai", "upstream": "simple-after"},
+    ])
+    assert router.resolve("aaa").upstream == "simple"
+    assert router.resolve("foo.foo").upstream == "backreference"
+    assert router.resolve("foo.bar").upstream is None
+    assert router.resolve("ab-ab").upstream == "named"
+    assert router.resolve("CLAUDE-3").upstream == "flags"
+    assert router.resolve("bbb").upstream == "simple-after"
+    assert router.stats()["regexes"] == 5
+
+
+def test_invalid_regex_is_rejected():
+    with pytest.raises(ValidationError):
+        RoutingConfig.model_validate({"routes": [{"regex": "(", "handler": "openai"}]})
+
+
+def test_catalog_fallback_and_default():
+    catalog = ModelCatalog(fetcher=None)
+    catalog.set_models({"amazon.nova-pro": {}})
+    router = _router([], catalog)
+    route = router.resolve("amazon.nova-pro")
+    assert route.handler == "bedrock"
+    assert route.source == "catalog"
+    assert router.resolve("gpt-4o").handler == "openai"
+
+    router = _router([], catalog, catalog_fallback=False, default_handler="bedrock")
+    assert router.resolve("amazon.nova-pro").source == "default"
+
+
+def test_cache_is_dropped_when_catalog_changes():
+    catalog = ModelCatalog(fetcher=None)
+    router = _router([], catalog)
+    assert router.resolve("amazon.nova-pro").handler == "openai"
+    catalog.set_models({"amazon.nova-pro": {}})
+    assert router.resolve("amazon.nova-pro").handler == "bedrock"
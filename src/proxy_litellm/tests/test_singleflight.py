@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+from fastapi.responses import Response, StreamingResponse
+
+from proxy_litellm.core.singleflight import SingleFlight, singleflight_enabled
+
+
+async def _read(response):
+    return [chunk async for chunk in response.body_iterator]
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return Response(b"body", headers={"x-cache": "MISS", "x-amzn-requestid": "r1"})
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("k", call) for _ in range(3)))
+        assert len(calls) == 1
+        assert [shared for _, shared in results] == [False, True, True]
+        for response, _ in results:
+            assert response.body == b"body"
+        follower = results[1][0]
+        assert follower.headers["x-amzn-requestid"] == "r1"
+        assert "x-cache" not in follower.headers
+        assert flight._flights == {}
+
+        # Calls after the first one finished are not shared
+        _, shared = await flight.do("k", call)
+        assert not shared
+        assert len(calls) == 2
+
+    asyncio.run(run())
+
+
+def test_different_keys_are_not_shared():
+    flight = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        return Response(b"body")
+
+    async def run():
+        results = await asyncio.gather(flight.do("a", call), flight.do("b", call))
+        assert [shared for _, shared in results] == [False, False]
+
+    asyncio.run(run())
+
+
+def test_error_reaches_every_caller():
+    flight = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    async def run():
+        results = await asyncio.gather(flight.do("k", call), flight.do("k", call), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert flight._flights == {}
+
+    asyncio.run(run())
+
+
+def test_stream_is_replayed_for_followers_and_late_joiners():
+    flight = SingleFlight()
+    gate = None
+
+    async def body():
+        yield b"one"
+        await gate.wait()
+        yield b"two"
+        yield b"three"
+
+    async def call():
+        return StreamingResponse(body())
+
+    async def run():
+        nonlocal gate
+        gate = asyncio.Event()
+        leader, _ = await flight.do("k", call)
+        follower, shared = await flight.do("k", call)
+        assert shared
+        leader_read = asyncio.create_task(_read(leader))
+        await asyncio.sleep(0.01)
+        # Joins after the first frame was produced
+        late, shared = await flight.do("k", call)
+        assert shared
+        gate.set()
+        expected = [b"one", b"two", b"three"]
+        assert await leader_read == expected
+        assert await _read(follower) == expected
+        assert await _read(late) == expected
+        assert flight._flights == {}
+
+    asyncio.run(run())
+
+
+def test_stream_error_reaches_subscribers_after_the_frames():
+    flight = SingleFlight()
+
+    async def body():
+        yield b"one"
+        raise RuntimeError("connection reset")
+
+    async def call():
+        return StreamingResponse(body())
+
+    async def run():
+        leader, _ = await flight.do("k", call)
+        follower, _ = await flight.do("k", call)
+        for response in (leader, follower):
+            received = []
+            with pytest.raises(RuntimeError):
+                async for chunk in response.body_iterator:
+                    received.append(chunk)
+            assert received == [b"one"]
+
+    asyncio.run(run())
+
+
+def test_upstream_stream_is_closed_when_every_caller_left():
+    flight = SingleFlight()
+    closed = []
+
+    async def body():
+        try:
+            yield b"one"
+            await asyncio.sleep(10)
+            yield b"two"
+        finally:
+            closed.append(True)
+
+    async def call():
+        return StreamingResponse(body())
+
+    def leave(response):
+        for callback in response._on_close:
+            callback()
+
+    async def run():
+        leader, _ = await flight.do("k", call)
+        follower, _ = await flight.do("k", call)
+        await asyncio.sleep(0.01)
+        leave(leader)
+        await asyncio.sleep(0.01)
+        assert not closed
+        leave(follower)
+        # A new request doesn't join the cancelled call
+        assert flight._flights == {}
+        await asyncio.sleep(0.01)
+        assert closed == [True]
+
+    asyncio.run(run())
+
+
+def test_singleflight_enabled():
+    assert singleflight_enabled(True, deterministic=False)
+    assert not singleflight_enabled(False, deterministic=True)
+    assert not singleflight_enabled(None, deterministic=False)